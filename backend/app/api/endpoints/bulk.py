@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Union
+from app.api.endpoints.jobs import accepted
+from app.core.db import get_db
+from app.core.maps import get_map_id
+from app.core.timing import TimedRoute
+from app.schemas.course import CourseBatch, CourseBatchReport, CourseImportReport
+from app.schemas.job import JobStatus
+from app.services.batch_service import BatchService
+from app.services.bulk_service import FORMATS, BulkService
+
+router = APIRouter(route_class=TimedRoute)
+
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+
+def _check_format(fmt: str):
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+@router.post("/courses/import", response_model=Union[CourseImportReport, JobStatus])
+async def import_courses(
+    request: Request,
+    response: Response,
+    format: str = "jsonl",
+    background: bool = False,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """With `background=true` the uploaded file is imported by a background job and
+    the answer is `202 Accepted` with the job, whose result is the import report"""
+    _check_format(format)
+    if background:
+        spooled = await BulkService.spool(request.stream())
+        return accepted(BulkService.submit_import(map_id, format, spooled), response)
+    return await BulkService.import_courses(db, map_id, BulkService.parse_stream(format, request.stream()))
+
+@router.post("/courses/batch", response_model=CourseBatchReport)
+async def apply_batch(
+    batch: CourseBatch,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    return await BatchService.apply_batch(db, map_id, batch)
+
+@router.get("/courses/export")
+async def export_courses(
+    format: str = "jsonl",
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    _check_format(format)
+    return StreamingResponse(
+        BulkService.export_courses(db, map_id, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="courses.{format}"'},
+    )
@@ -1,52 +1,296 @@
-from fastapi import APIRouter, Depends, HTTPException
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 from app.core.db import get_db
-from app.schemas.course import Course, CourseCreate
-from app.services.course_service import CourseService
+from app.core.maps import get_map_id
+from app.core.timing import TimedRoute
+from app.schemas.course import (
+    Course,
+    CourseCreate,
+    CourseDependency,
+    CourseMove,
+    CourseSearchResult,
+    CourseSubtreeChange,
+    DeletedCourse,
+)
+from app.schemas.graph import GraphNeighborhood
+from app.services.course_service import STREAM_BATCH_SIZE, CourseService
+from app.services.neighborhood_service import (
+    MAX_NEIGHBORHOOD_DEPTH,
+    MAX_NEIGHBORHOOD_NODES,
+    NeighborhoodService,
+)
+from app.services.prerequisite_service import MAX_TRAVERSAL_DEPTH, PrerequisiteService
+from app.services.search_service import MAX_SEARCH_RESULTS, SearchService
+from app.services.subtree_service import MAX_DELETED_COURSES, SubtreeService
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+def _etag(course: Course) -> Optional[str]:
+    return f'"{course.version}"' if course.version is not None else None
+
+def _if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """The course version an If-Match header names, or None when it allows any"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip().removeprefix("W/").strip('"')
+    if not tag.isdigit():
+        raise HTTPException(status_code=400, detail="If-Match must be one course ETag, like \"3\"")
+    return int(tag)
+
+def _serialized(model) -> dict:
+    """Route options of list endpoints that serialize plain dicts with orjson
+    themselves: `model` only documents the body, it is not validated per row"""
+    return {"response_class": ORJSONResponse, "responses": {200: {"model": model}}}
+
+def _set_etag(response: Response, course: Course):
+    etag = _etag(course)
+    if etag:
+        response.headers["ETag"] = etag
 
 @router.post("/courses/", response_model=Course)
-async def create_course(course: CourseCreate, db: AsyncSession = Depends(get_db)):
-    return await CourseService.create_course(db=db, course=course)
+async def create_course(
+    course: CourseCreate,
+    response: Response,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    created = await CourseService.create_course(db, map_id, course)
+    _set_etag(response, created)
+    return created
+
+@router.get("/courses/", **_serialized(List[Course]))
+async def read_courses(
+    request: Request,
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """List courses.
+
+    Without `cursor`, `fields` or `format` this is the original offset listing. A
+    `cursor` (empty for the first page) switches to keyset pagination by id;
+    the next page's cursor is returned in the X-Next-Cursor header. `fields`
+    projects each course onto a comma-separated subset of its fields, and
+    `format=ndjson` streams one course per line instead of building a list."""
+    if cursor is None and fields is None and format == "json":
+        courses = await CourseService.get_courses(db, map_id, skip=skip, limit=limit)
+        headers = {}
+        if skip == 0 and len(courses) == limit:
+            headers["X-Next-Cursor"] = CourseService.encode_cursor(courses[-1]["id"])
+        return ORJSONResponse(courses, headers=headers)
+
+    after_id = CourseService.decode_cursor(cursor)
+    projection = CourseService.parse_fields(fields)
 
-@router.get("/courses/", response_model=List[Course])
-async def read_courses(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    courses = await CourseService.get_courses(db, skip=skip, limit=limit)
-    return courses
+    if format == "ndjson":
+        async def lines():
+            chunk = []
+            async for _, course in CourseService.iter_courses(db, map_id, after_id, limit, projection):
+                chunk.append(orjson.dumps(course))
+                if len(chunk) == STREAM_BATCH_SIZE:
+                    yield b"\n".join(chunk) + b"\n"
+                    chunk = []
+            if chunk:
+                yield b"\n".join(chunk) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    courses, next_cursor = await CourseService.get_course_page(db, map_id, after_id, limit, projection)
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return ORJSONResponse(courses, headers=headers)
+
+@router.get("/courses/search", **_serialized(List[CourseSearchResult]))
+async def search_courses(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=MAX_SEARCH_RESULTS),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    return ORJSONResponse(await SearchService.search_courses(db, map_id, q, limit))
+
+@router.get("/courses/deleted", **_serialized(List[DeletedCourse]))
+async def read_deleted_courses(
+    limit: int = Query(100, ge=1, le=MAX_DELETED_COURSES),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Soft-deleted courses, most recently deleted first"""
+    return ORJSONResponse(await SubtreeService.get_deleted_courses(db, map_id, limit))
+
+@router.post("/courses/move", response_model=List[Course])
+async def move_courses(
+    move: CourseMove,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Give every course in `ids`, with the branch below it, the parent `parent_id`
+    (null for the top level) in one transaction"""
+    return await SubtreeService.move_courses(db, map_id, move)
 
 @router.get("/courses/{course_id}", response_model=Course)
-async def read_course(course_id: int, db: AsyncSession = Depends(get_db)):
-    db_course = await CourseService.get_course(db, course_id)
+async def read_course(
+    course_id: int,
+    response: Response,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """A course; its ETag is the row version to send back in If-Match"""
+    db_course = await CourseService.get_course(db, map_id, course_id)
     if db_course is None:
         raise HTTPException(status_code=404, detail="Course not found")
+    _set_etag(response, db_course)
     return db_course
 
 @router.put("/courses/{course_id}", response_model=Course)
-async def update_course(course_id: int, course: CourseCreate, db: AsyncSession = Depends(get_db)):
-    db_course = await CourseService.update_course(db, course_id, course)
+async def update_course(
+    course_id: int,
+    course: CourseCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Replace a course's name and parent. With If-Match the update only applies
+    while the course is still at that version, and answers 409 otherwise"""
+    db_course = await CourseService.update_course(db, map_id, course_id, course, _if_match_version(if_match))
     if db_course is None:
         raise HTTPException(status_code=404, detail="Course not found")
+    _set_etag(response, db_course)
     return db_course
 
-@router.delete("/courses/{course_id}", response_model=Course)
-async def delete_course(course_id: int, db: AsyncSession = Depends(get_db)):
-    db_course = await CourseService.delete_course(db, course_id)
+@router.delete("/courses/{course_id}", response_model=CourseSubtreeChange)
+async def delete_course(
+    course_id: int,
+    subtree: bool = False,
+    permanent: bool = False,
+    if_match: Optional[str] = Header(None),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Soft-delete a course; its children are detached unless `subtree` deletes the
+    whole branch below it too. Prerequisites linking the deleted courses to live
+    ones are removed for good; a restore does not bring them back. `permanent`
+    purges the rows instead, deleted ones included"""
+    db_course = await SubtreeService.delete_course(
+        db, map_id, course_id, _if_match_version(if_match), subtree=subtree, permanent=permanent
+    )
     if db_course is None:
         raise HTTPException(status_code=404, detail="Course not found")
     return db_course
 
-@router.get("/courses/{course_id}/dependencies", response_model=List[Course])
-async def read_course_dependencies(course_id: int, db: AsyncSession = Depends(get_db)):
-    dependencies = await CourseService.get_course_dependencies(db, course_id)
+@router.post("/courses/{course_id}/restore", response_model=CourseSubtreeChange)
+async def restore_course(
+    course_id: int,
+    response: Response,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Undo a soft delete, bringing back the courses the same delete removed below this one"""
+    db_course = await SubtreeService.restore_course(db, map_id, course_id)
+    if db_course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    _set_etag(response, db_course)
+    return db_course
+
+@router.get("/courses/{course_id}/dependencies", **_serialized(List[Course]))
+async def read_course_dependencies(
+    course_id: int,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    dependencies = await CourseService.get_course_dependencies(db, map_id, course_id)
     if not dependencies:
         raise HTTPException(status_code=404, detail="Dependencies not found")
-    return dependencies
+    return ORJSONResponse(dependencies)
 
-@router.get("/courses/parent/{parent_id}", response_model=List[Course])
-async def read_courses_by_parent_id(parent_id: int, db: AsyncSession = Depends(get_db)):
-    courses = await CourseService.get_courses_by_parent_id(db, parent_id)
+@router.get("/courses/parent/{parent_id}", **_serialized(List[Course]))
+async def read_courses_by_parent_id(
+    parent_id: int,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    courses = await CourseService.get_courses_by_parent_id(db, map_id, parent_id)
     if not courses:
         raise HTTPException(status_code=404, detail="No courses found with the given parent_id")
-    return courses
+    return ORJSONResponse(courses)
+
+@router.get("/courses/{course_id}/prerequisites", **_serialized(List[CourseDependency]))
+async def read_course_prerequisites(
+    course_id: int,
+    max_depth: int = Query(MAX_TRAVERSAL_DEPTH, ge=1, le=MAX_TRAVERSAL_DEPTH),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    if await CourseService.get_course(db, map_id, course_id) is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return ORJSONResponse(await PrerequisiteService.walk(db, map_id, course_id, "prerequisites", max_depth))
+
+@router.get("/courses/{course_id}/dependents", **_serialized(List[CourseDependency]))
+async def read_course_dependents(
+    course_id: int,
+    max_depth: int = Query(MAX_TRAVERSAL_DEPTH, ge=1, le=MAX_TRAVERSAL_DEPTH),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    if await CourseService.get_course(db, map_id, course_id) is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return ORJSONResponse(await PrerequisiteService.walk(db, map_id, course_id, "dependents", max_depth))
+
+@router.get("/courses/{course_id}/learning-path", **_serialized(List[CourseDependency]))
+async def read_course_learning_path(
+    course_id: int,
+    max_depth: int = Query(MAX_TRAVERSAL_DEPTH, ge=1, le=MAX_TRAVERSAL_DEPTH),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    order = await PrerequisiteService.learning_order(db, map_id, course_id, max_depth)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return ORJSONResponse(order)
+
+@router.get("/courses/{course_id}/neighborhood", **_serialized(GraphNeighborhood))
+async def read_course_neighborhood(
+    course_id: int,
+    depth: int = Query(1, ge=1, le=MAX_NEIGHBORHOOD_DEPTH),
+    direction: str = Query("both", pattern="^(up|down|both)$"),
+    edges: Optional[str] = None,
+    max_nodes: int = Query(200, ge=1, le=MAX_NEIGHBORHOOD_NODES),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """The subgraph around a course for expanding a map on demand: courses within
+    `depth` hops along the `edges` types (comma-separated, default parent and
+    prerequisite), nearest first and capped at `max_nodes`, with the edges among them"""
+    edge_types = NeighborhoodService.parse_edge_types(edges)
+    return ORJSONResponse(await NeighborhoodService.get_neighborhood(
+        db, map_id, course_id, depth, direction, edge_types, max_nodes
+    ))
+
+@router.post("/courses/{course_id}/prerequisites/{prerequisite_id}", status_code=204)
+async def add_course_prerequisite(
+    course_id: int,
+    prerequisite_id: int,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    await PrerequisiteService.add_prerequisite(db, map_id, course_id, prerequisite_id)
+
+@router.delete("/courses/{course_id}/prerequisites/{prerequisite_id}", status_code=204)
+async def remove_course_prerequisite(
+    course_id: int,
+    prerequisite_id: int,
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    if not await PrerequisiteService.remove_prerequisite(db, map_id, course_id, prerequisite_id):
+        raise HTTPException(status_code=404, detail="Prerequisite not found")
@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Union
+from app.api.endpoints.jobs import accepted
+from app.core.db import get_db
+from app.core.maps import get_map_id
+from app.core.events import graph_events
+from app.core.timing import TimedRoute
+from app.schemas.graph import GraphChangeFeed, GraphLayoutSnapshot, GraphSnapshot, GraphStats
+from app.schemas.job import JobStatus
+from app.services.closure_service import ClosureService
+from app.services.graph_service import GraphService
+
+router = APIRouter(route_class=TimedRoute)
+# Maintenance of tables shared by every map; only mounted without a map prefix
+closure_router = APIRouter(route_class=TimedRoute)
+
+def _etag(version: int, layout: bool = False) -> str:
+    # Layouts depend on the layouts a worker computed before, so equal versions
+    # only promise semantically equivalent bodies
+    return f'W/"{version}-layout"' if layout else f'"{version}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(
+        tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates
+    )
+
+@router.get("/graph", response_model=Union[GraphLayoutSnapshot, GraphSnapshot])
+async def read_graph(
+    layout: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """The whole graph; with `layout=true` every node also carries precomputed x/y"""
+    version = await GraphService.get_version(db, map_id)
+    headers = {"ETag": _etag(version, layout), "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if layout:
+        body = await GraphService.get_layout_json(db, map_id, version)
+    else:
+        body = await GraphService.get_snapshot_json(db, map_id, version)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/graph/changes", response_model=GraphChangeFeed)
+async def read_graph_changes(
+    since: int = Query(..., ge=0),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    return await GraphService.get_changes(db, map_id, since)
+
+@router.get("/graph/stats", response_model=GraphStats)
+async def read_graph_stats(
+    top: int = Query(10, ge=1, le=100),
+    map_id: int = Depends(get_map_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Depth, critical path, roots, leaves, orphans, components and the `top` courses
+    the most others depend on, directly or indirectly; computed once per graph version"""
+    return ORJSONResponse(await GraphService.get_stats(db, map_id, top))
+
+@closure_router.post("/graph/closure/rebuild", response_model=JobStatus, status_code=202)
+async def rebuild_closure(response: Response):
+    """Rebuild the course_closure table from scratch in a background job"""
+    return accepted(ClosureService.submit_rebuild(), response)
+
+@router.get("/graph/events")
+async def stream_graph_events(map_id: int = Depends(get_map_id)):
+    """Server-Sent Events stream of the map's committed graph changes, one change feed per version"""
+    subscription = graph_events.subscribe(map_id)
+
+    async def event_stream():
+        try:
+            async for frame in subscription.frames():
+                yield frame
+        finally:
+            graph_events.unsubscribe(map_id, subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+from typing import List, Optional
+from app.core.jobs import JOB_STATUSES, Job, job_queue
+from app.core.timing import TimedRoute
+from app.schemas.job import JobStatus
+
+router = APIRouter(route_class=TimedRoute)
+
+def accepted(job: Job, response: Response) -> dict:
+    """202 answer for an endpoint that queued `job`, pointing at its status"""
+    response.status_code = 202
+    response.headers["Location"] = f"/api/v1/jobs/{job.id}"
+    return job.to_dict()
+
+@router.get("/jobs", response_model=List[JobStatus])
+async def read_jobs(
+    status: Optional[str] = Query(None, pattern=f"^({'|'.join(JOB_STATUSES)})$"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Recent background jobs, newest first"""
+    return [job.to_dict() for job in job_queue.jobs(status)[:limit]]
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def read_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
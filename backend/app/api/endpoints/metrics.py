@@ -0,0 +1,37 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app.core.db import get_engine
+from app.core.jobs import job_queue
+from app.core.metrics import pool_metrics, render_prometheus
+from app.core.timing import TimedRoute
+from app.services.graph_service import map_graphs
+
+router = APIRouter(route_class=TimedRoute)
+# Mounted without the /api/v1 prefix, where Prometheus scrapes by default
+prometheus_router = APIRouter(route_class=TimedRoute)
+
+@prometheus_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_prometheus_metrics():
+    return PlainTextResponse(
+        render_prometheus(get_engine().pool, map_graphs.stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
+@router.get("/metrics/pool")
+async def read_pool_metrics():
+    return pool_metrics.snapshot(get_engine().pool)
+
+@router.get("/metrics/cache")
+async def read_cache_metrics(map_id: Optional[int] = Query(None, ge=1)):
+    """Graph caches of all maps this process holds, or with `map_id` of one map"""
+    if map_id is None:
+        return map_graphs.stats()
+    graph = map_graphs.peek(map_id)
+    if graph is None:
+        raise HTTPException(status_code=404, detail=f"Map {map_id} is not cached by this process")
+    return graph.cache.stats()
+
+@router.get("/metrics/jobs")
+async def read_job_metrics():
+    return job_queue.stats()
@@ -1,14 +1,64 @@
-from fastapi import APIRouter
+from fastapi import Depends
 from fastapi.middleware.cors import CORSMiddleware
+from app.api.endpoints.bulk import router as bulk_router
 from app.api.endpoints.course import router as course_router
+from app.api.endpoints.graph import closure_router, router as graph_router
+from app.api.endpoints.jobs import router as jobs_router
+from app.api.endpoints.metrics import prometheus_router, router as metrics_router
+from app.core.maps import MAP_PREFIX, map_path
 
-router = APIRouter()
+def setup_routes(app):
+    """Include the API routers in the app. FastAPI rebuilds every route it includes,
+    so they go straight into the app rather than through an intermediate router,
+    which would build them all once more at startup"""
+    # Map routes are served for the default map under /api/v1 and for any map under
+    # /api/v1/maps/{map_id}
+    for prefix, dependencies in (("/api/v1", []), ("/api/v1" + MAP_PREFIX, [Depends(map_path)])):
+        # Registered before the course routes so /courses/export is not read as a course id
+        app.include_router(
+            bulk_router,
+            prefix=prefix,
+            tags=["courses"],
+            dependencies=dependencies
+        )
 
-router.include_router(
-    course_router,
-    prefix="/api/v1",
-    tags=["courses"]
-)
+        app.include_router(
+            course_router,
+            prefix=prefix,
+            tags=["courses"],
+            dependencies=dependencies
+        )
+
+        app.include_router(
+            graph_router,
+            prefix=prefix,
+            tags=["graph"],
+            dependencies=dependencies
+        )
+
+    app.include_router(
+        closure_router,
+        prefix="/api/v1",
+        tags=["graph"]
+    )
+
+    app.include_router(
+        jobs_router,
+        prefix="/api/v1",
+        tags=["jobs"]
+    )
+
+    app.include_router(
+        metrics_router,
+        prefix="/api/v1",
+        tags=["metrics"]
+    )
+
+    # Prometheus scrapes /metrics, outside the versioned API
+    app.include_router(
+        prometheus_router,
+        tags=["metrics"]
+    )
 
 # Configure CORS
 origins = [
@@ -27,4 +77,5 @@ def setup_cors(app):
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", "X-Next-Cursor", "Link", "Server-Timing"],
     )
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Bulk course import/export and graph snapshots from the command line.
+
+    python -m app.cli import courses.jsonl
+    python -m app.cli import courses.csv --format csv
+    python -m app.cli export --format csv > courses.csv
+    python -m app.cli import other.jsonl --map 2
+    python -m app.cli rebuild-closure
+    python -m app.cli snapshot -o graph-cache.json   # for GRAPH_CACHE_SNAPSHOT
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import orjson
+
+from app.core.db import AsyncSessionLocal, async_engine
+from app.core.maps import DEFAULT_MAP_ID
+from app.services.bulk_service import FORMATS, BulkService
+from app.services.closure_service import ClosureService
+from app.services.graph_cache import GraphCache
+from app.services.graph_service import GraphService
+
+async def _read_file(path: str, chunk_size: int = 1024 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+async def import_file(path: str, fmt: str, map_id: int = DEFAULT_MAP_ID) -> int:
+    async with AsyncSessionLocal() as db:
+        report = await BulkService.import_courses(db, map_id, BulkService.parse_stream(fmt, _read_file(path)))
+    for error in report.errors:
+        print(f"line {error.line}: {error.error}", file=sys.stderr)
+    print(f"Imported {report.imported} courses, {report.failed} failed")
+    return 1 if report.failed else 0
+
+async def export_file(path: str, fmt: str, map_id: int = DEFAULT_MAP_ID) -> int:
+    out = open(path, "w", encoding="utf-8") if path != "-" else sys.stdout
+    try:
+        async with AsyncSessionLocal() as db:
+            async for chunk in BulkService.export_courses(db, map_id, fmt):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+async def rebuild_closure() -> int:
+    async with AsyncSessionLocal() as db:
+        await ClosureService.rebuild(db)
+        await db.commit()
+    print("Rebuilt course_closure")
+    return 0
+
+async def snapshot_graph(path: str, map_id: int = DEFAULT_MAP_ID) -> int:
+    async with AsyncSessionLocal() as db:
+        # Read before the graph: a write in between is then replayed from the change
+        # log when the snapshot is loaded, rather than missed
+        version = await GraphService.get_version(db, map_id)
+        snapshot = await GraphService.build_snapshot(db, map_id, version)
+    cache = GraphCache()
+    if not cache.load(snapshot):
+        print(f"Map {map_id} has more than {cache.max_nodes} courses, too many to cache", file=sys.stderr)
+        return 1
+    with open(path, "wb") as f:
+        f.write(orjson.dumps({"map_id": map_id, **cache.dump()}))
+    print(f"Wrote {len(cache.nodes)} courses of map {map_id} at graph version {version} to {path}")
+    return 0
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk course import/export and graph snapshots")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="import courses from a JSONL or CSV file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--map", type=int, default=DEFAULT_MAP_ID, help="map to import into")
+    export_parser = subparsers.add_parser("export", help="export all courses of a map")
+    export_parser.add_argument("-o", "--output", default="-")
+    export_parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    export_parser.add_argument("--map", type=int, default=DEFAULT_MAP_ID, help="map to export")
+    subparsers.add_parser("rebuild-closure", help="recompute the course_closure table")
+    snapshot_parser = subparsers.add_parser("snapshot", help="write a map's graph to a file for GRAPH_CACHE_SNAPSHOT")
+    snapshot_parser.add_argument("-o", "--output", required=True)
+    snapshot_parser.add_argument("--map", type=int, default=DEFAULT_MAP_ID, help="map to snapshot")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "import":
+            fmt = args.format or ("csv" if os.path.splitext(args.path)[1] == ".csv" else "jsonl")
+            return await import_file(args.path, fmt, args.map)
+        if args.command == "rebuild-closure":
+            return await rebuild_closure()
+        if args.command == "snapshot":
+            return await snapshot_graph(args.output, args.map)
+        return await export_file(args.output, args.format, args.map)
+    finally:
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,30 +1,188 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from typing import Dict, Optional
+import itertools
+import math
 import os
-from dotenv import load_dotenv
+import time
+from app.core.metrics import pool_metrics
+from app.core.timing import record_statement
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Startup-optimized mode for serverless cold starts (Vercel sets VERCEL=1): no .env
+# lookup, which the platform's own environment makes redundant, and no database
+# round trip before the first request. Read from the real environment only.
+FAST_STARTUP = _env_bool("FAST_STARTUP", bool(os.getenv("VERCEL")))
+if not FAST_STARTUP:
+    from dotenv import load_dotenv
+    load_dotenv()
 
-load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Comma-separated read replicas; GET requests are spread across them round-robin
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
 
-async_engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    poolclass=NullPool,
-    future=True
-)
+DB_ECHO = _env_bool("DB_ECHO", False)
+# Serverless functions are frozen between invocations, so pooled connections
+# would go stale; default to one connection per request there (Vercel sets VERCEL=1).
+DB_SERVERLESS = _env_bool("DB_SERVERLESS", bool(os.getenv("VERCEL")))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# asyncpg prepared statement cache; set to 0 behind PgBouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# After a client writes, its reads stay on the primary this long so it sees its own
+# writes despite replica lag
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))
+LAST_WRITE_COOKIE = "db_last_write"
+READ_METHODS = ("GET", "HEAD")
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waits, including new connects"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_metrics.record_checkout(time.perf_counter() - start)
+
+def _engine_options(url: str) -> dict:
+    options = {"echo": DB_ECHO, "future": True}
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+
+    if DB_SERVERLESS:
+        options["poolclass"] = NullPool
+    else:
+        options.update({
+            "poolclass": InstrumentedAsyncPool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+        })
+    return options
+
+def _instrument_pool(engine):
+    pool = engine.sync_engine.pool
+    event.listen(pool, "connect", lambda *args: pool_metrics.record_connect())
+    event.listen(pool, "close", lambda *args: pool_metrics.record_close())
+    event.listen(pool, "invalidate", lambda *args: pool_metrics.record_invalidate())
+
+def _instrument_statements(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
 
-AsyncSessionLocal = async_sessionmaker(
-    async_engine,
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        record_statement(statement, time.perf_counter() - conn.info["statement_started"].pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _failed(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("statement_started"):
+            connection.info["statement_started"].pop()
+
+def _create_engine(url: str):
+    engine = create_async_engine(url, **_engine_options(url))
+    _instrument_pool(engine)
+    _instrument_statements(engine)
+    return engine
+
+# Engines are created on first use, so importing the app loads no database driver
+_engines: Dict[str, AsyncEngine] = {}
+
+def get_engine(url: Optional[str] = None) -> AsyncEngine:
+    """The engine for `url`, the primary by default"""
+    url = url or DATABASE_URL
+    engine = _engines.get(url)
+    if engine is None:
+        engine = _engines[url] = _create_engine(url)
+    return engine
+
+def __getattr__(name: str):
+    # async_engine and replica_engines stay importable for scripts; importing them
+    # creates the engines
+    if name == "async_engine":
+        return get_engine()
+    if name == "replica_engines":
+        return [get_engine(url) for url in DATABASE_REPLICA_URLS]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class LazySessionmaker(async_sessionmaker):
+    """Session factory bound to the engine for `url` when its first session is made"""
+
+    def __init__(self, url: Optional[str] = None, **kw):
+        super().__init__(**kw)
+        self.url = url
+
+    def __call__(self, **local_kw) -> AsyncSession:
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine(self.url))
+        return super().__call__(**local_kw)
+
+AsyncSessionLocal = LazySessionmaker(
     class_=AsyncSession,
     expire_on_commit=False,
 )
+# Sessions on a replica are marked so readers can tell they may lag the primary
+ReplicaSessionLocals = [
+    LazySessionmaker(url, class_=AsyncSession, expire_on_commit=False, info={"replica": True})
+    for url in DATABASE_REPLICA_URLS
+]
+_replica_sessions = itertools.cycle(ReplicaSessionLocals)
 
 Base = declarative_base()
 
-async def get_db():
-    async with AsyncSessionLocal() as session:
+def _reads_from_replica(request: Request) -> bool:
+    if not ReplicaSessionLocals or request.method not in READ_METHODS:
+        return False
+    last_write = request.cookies.get(LAST_WRITE_COOKIE)
+    if not last_write:
+        return True
+    try:
+        return time.time() - float(last_write) >= DB_REPLICA_STICKY_SECONDS
+    except ValueError:
+        return True
+
+async def get_db(request: Request, response: Response):
+    """Session for one request: reads go to a replica, writes and a client's reads
+    shortly after its own write go to the primary"""
+    if _reads_from_replica(request):
+        session_factory = next(_replica_sessions)
+    else:
+        session_factory = AsyncSessionLocal
+        if ReplicaSessionLocals and request.method not in READ_METHODS:
+            response.set_cookie(
+                LAST_WRITE_COOKIE,
+                f"{time.time():.3f}",
+                max_age=math.ceil(DB_REPLICA_STICKY_SECONDS),
+                httponly=True,
+                samesite="lax",
+            )
+    async with session_factory() as session:
         try:
             yield session
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+async def dispose_engines():
+    for engine in _engines.values():
+        await engine.dispose()
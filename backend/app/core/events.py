@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+QUEUE_SIZE = int(os.getenv("GRAPH_EVENTS_QUEUE_SIZE", "100"))
+HEARTBEAT_SECONDS = float(os.getenv("GRAPH_EVENTS_HEARTBEAT_SECONDS", "15"))
+
+class Subscription:
+    """Bounded per-connection queue of pre-encoded Server-Sent Event frames"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def close(self):
+        # Drop whatever is pending so the end-of-stream marker always fits
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def frames(self, heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[bytes]:
+        while True:
+            if self.queue.empty():
+                try:
+                    frame = await asyncio.wait_for(self.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+            else:
+                frame = self.queue.get_nowait()
+            if frame is None:
+                if self.overflowed:
+                    yield b"event: reset\ndata: {}\n\n"
+                return
+            yield frame
+
+class GraphEventBroker:
+    """Fans graph mutation events out to every subscriber without ever awaiting on them.
+
+    A subscriber whose queue is full is disconnected with a `reset` event instead of
+    slowing down the publisher; the client then resynchronizes through
+    /graph/changes using the version of the last event it saw.
+    """
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscription] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, data: str, event: str = "graph", event_id: Optional[int] = None):
+        frame = f"event: {event}\n"
+        if event_id is not None:
+            frame = f"id: {event_id}\n" + frame
+        frame = (frame + f"data: {data}\n\n").encode()
+
+        overflowed = []
+        for subscription in self._subscribers:
+            try:
+                subscription.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                overflowed.append(subscription)
+
+        for subscription in overflowed:
+            logging.warning("Dropping slow graph event subscriber")
+            self._subscribers.discard(subscription)
+            subscription.overflowed = True
+            subscription.close()
+
+    def close(self):
+        for subscription in self._subscribers:
+            subscription.close()
+        self._subscribers.clear()
+
+class MapEventBrokers:
+    """A GraphEventBroker per map with subscribers, so a map's events only reach
+    its own subscribers and a busy map cannot overflow the others' queues"""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._brokers: Dict[int, GraphEventBroker] = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(broker.subscriber_count for broker in self._brokers.values())
+
+    def subscribe(self, map_id: int) -> Subscription:
+        broker = self._brokers.get(map_id)
+        if broker is None:
+            broker = self._brokers[map_id] = GraphEventBroker(self.queue_size)
+        return broker.subscribe()
+
+    def unsubscribe(self, map_id: int, subscription: Subscription):
+        broker = self._brokers.get(map_id)
+        if broker is None:
+            return
+        broker.unsubscribe(subscription)
+        if not broker.subscriber_count:
+            del self._brokers[map_id]
+
+    def publish(self, map_id: int, data: str, event: str = "graph", event_id: Optional[int] = None):
+        broker = self._brokers.get(map_id)
+        if broker is not None:
+            broker.publish(data, event, event_id)
+
+    def close(self):
+        for broker in self._brokers.values():
+            broker.close()
+        self._brokers.clear()
+
+graph_events = MapEventBrokers()
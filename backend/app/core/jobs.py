@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from fastapi import HTTPException
+
+JOBS_QUEUE_SIZE = int(os.getenv("JOBS_QUEUE_SIZE", "100"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+# Processes for CPU-bound graph work; 0 runs it in threads instead, which is the
+# default on Vercel where functions cannot spawn worker processes
+JOBS_PROCESSES = int(os.getenv("JOBS_PROCESSES", "0" if os.getenv("VERCEL") else "1"))
+# Finished jobs kept for GET /api/v1/jobs/{id}
+JOBS_RETENTION = int(os.getenv("JOBS_RETENTION", "1000"))
+# Unfinished jobs one owner (a map) may have, so one busy map cannot fill the queue
+JOBS_PER_OWNER = int(os.getenv("JOBS_PER_OWNER", "20"))
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+logger = logging.getLogger("app.jobs")
+
+class Job:
+    """One unit of background work and, once it finished, its outcome.
+
+    What the job's function returned goes only to the requests awaiting the job,
+    so large results such as layouts are not kept alive by the job registry;
+    `result` is the JSON-safe summary the status endpoint shows.
+    """
+
+    def __init__(self, kind: str, key: Optional[Hashable], owner: Optional[Hashable] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.owner = owner
+        self.status = "queued"
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self._done: Optional[asyncio.Future] = asyncio.get_running_loop().create_future()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    async def wait(self) -> Any:
+        """The job's value, or its error re-raised as an HTTPException; await it
+        before the job finishes. A cancelled waiter (a client that went away)
+        leaves the job running for everyone else"""
+        done = self._done
+        value = await asyncio.shield(done) if done is not None else None
+        if self.status == "failed":
+            raise HTTPException(status_code=self.status_code or 500, detail=self.error)
+        return value
+
+class JobQueue:
+    """Bounded in-process queue of background jobs, drained by a few worker tasks.
+
+    CPU-bound functions run in a process pool so they neither block the event
+    loop nor hold the GIL while requests are served. Submitting a job under the
+    key of one that is still queued or running returns that job instead, so
+    concurrent requests for the same graph version share one computation.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = JOBS_QUEUE_SIZE,
+        workers: int = JOBS_WORKERS,
+        processes: int = JOBS_PROCESSES,
+        retention: int = JOBS_RETENTION,
+        per_owner: int = JOBS_PER_OWNER,
+    ):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.processes = processes
+        self.retention = retention
+        self.per_owner = per_owner
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.running = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[Hashable, Job] = {}
+        self._owned: Dict[Hashable, int] = {}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            self._finish(job, error="Server shutting down", status_code=503)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def jobs(self, status: Optional[str] = None) -> List[Job]:
+        """Known jobs, newest first"""
+        return [job for job in reversed(self._jobs.values()) if status is None or job.status == status]
+
+    def submit(self, kind: str, run: Callable[[], Awaitable[Any]], key: Optional[Hashable] = None,
+               summarize: Optional[Callable[[Any], dict]] = None, owner: Optional[Hashable] = None) -> Job:
+        """Queue `run()`, or return the unfinished job already submitted under `key`.
+        Raises 503 when the queue is full or `owner` already has its share of it"""
+        if key is not None and key in self._active:
+            self.coalesced += 1
+            return self._active[key]
+        if owner is not None and self._owned.get(owner, 0) >= self.per_owner:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many background jobs queued for this map; retry later",
+                headers={"Retry-After": "1"},
+            )
+        # Lazily started when the app runs without its lifespan (tests, scripts)
+        self.start()
+        job = Job(kind, key, owner)
+        try:
+            self._queue.put_nowait((job, (run, summarize)))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many background jobs queued; retry later",
+                headers={"Retry-After": "1"},
+            )
+        if key is not None:
+            self._active[key] = job
+        if owner is not None:
+            self._owned[owner] = self._owned.get(owner, 0) + 1
+        self._jobs[job.id] = job
+        self._prune()
+        return job
+
+    async def run_cpu(self, fn: Callable, *args) -> Any:
+        """Call a CPU-bound function from a job. `fn` and its arguments must be
+        picklable and `fn` must live in a module that is cheap to import in a
+        fresh process, which rules out anything that creates the database engine"""
+        if self.processes <= 0:
+            return await asyncio.to_thread(fn, *args)
+        if self._pool is None:
+            # Forking a process with a running event loop and driver threads is unsafe
+            self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def _work(self):
+        while True:
+            job, (run, summarize) = await self._queue.get()
+            job.status = "running"
+            job.started_at = datetime.now(timezone.utc)
+            self.running += 1
+            try:
+                value = await run()
+                result = summarize(value) if summarize is not None else None
+            except asyncio.CancelledError:
+                self._finish(job, error="Server shutting down", status_code=503)
+                raise
+            except HTTPException as exc:
+                self._finish(job, error=str(exc.detail), status_code=exc.status_code)
+            except Exception as exc:
+                logger.exception("Job %s (%s) failed", job.id, job.kind)
+                self._finish(job, error=f"{type(exc).__name__}: {exc}", status_code=500)
+            else:
+                job.result = result
+                self._finish(job, value=value)
+            finally:
+                self.running -= 1
+                self._queue.task_done()
+
+    def _finish(self, job: Job, value: Any = None, error: Optional[str] = None, status_code: Optional[int] = None):
+        job.status = "succeeded" if error is None else "failed"
+        job.error = error
+        job.status_code = status_code
+        job.finished_at = datetime.now(timezone.utc)
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+        if job.key is not None and self._active.get(job.key) is job:
+            del self._active[job.key]
+        if job.owner is not None:
+            self._owned[job.owner] -= 1
+            if not self._owned[job.owner]:
+                del self._owned[job.owner]
+        if job._done is not None:
+            job._done.set_result(value)
+            job._done = None
+        self._prune()
+
+    def _prune(self):
+        # Only finished jobs are forgotten; unfinished ones are bounded by the queue
+        excess = len(self._jobs) - self.retention
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "workers": self.workers,
+            "processes": self.processes,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+        }
+
+job_queue = JobQueue()
@@ -0,0 +1,14 @@
+from fastapi import Path, Request
+
+# Routes without the /maps/{map_id} prefix, and every course written before maps
+# existed, belong to this map
+DEFAULT_MAP_ID = 1
+MAP_PREFIX = "/maps/{map_id}"
+
+def map_path(request: Request, map_id: int = Path(..., ge=1, description="Knowledge map the request works on")):
+    """Validates the {map_id} of map-prefixed routes; added to them as a router dependency"""
+    request.state.map_id = map_id
+
+def get_map_id(request: Request) -> int:
+    """The map a request works on: its /maps/{map_id} prefix, or the default map"""
+    return getattr(request.state, "map_id", DEFAULT_MAP_ID)
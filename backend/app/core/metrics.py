@@ -0,0 +1,204 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": buckets}
+
+class PoolMetrics:
+    """Connection pool checkout latency and connection churn"""
+
+    def __init__(self):
+        # Pool events may fire from the sync side of the async engine
+        self._lock = threading.Lock()
+        self.checkout_wait = Histogram()
+        self.checkouts = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def record_checkout(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait.observe(seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_close(self):
+        with self._lock:
+            self.closes += 1
+
+    def record_invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool=None) -> Dict:
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "checkout_wait_seconds": self.checkout_wait.snapshot(),
+            }
+        if pool is not None and hasattr(pool, "checkedout"):
+            data.update({
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            })
+        return data
+
+class RequestMetrics:
+    """Per-route request latency, SQL work and response serialization time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: Dict[Tuple[str, str, str], Histogram] = {}
+        self.sql_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_statements: Dict[Tuple[str, str], Histogram] = {}
+        self.serialize_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.slow_requests: Dict[Tuple[str, str], int] = {}
+        # Every statement, inside a request or not
+        self.statement_seconds = Histogram()
+
+    def record_statement(self, seconds: float):
+        with self._lock:
+            self.statement_seconds.observe(seconds)
+
+    def record_request(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        seconds: float,
+        sql_count: int,
+        sql_seconds: float,
+        serialize_seconds: Optional[float],
+        slow: bool,
+    ):
+        key = (method, route)
+        with self._lock:
+            self.latency.setdefault((method, route, str(status)), Histogram()).observe(seconds)
+            self.sql_seconds.setdefault(key, Histogram()).observe(sql_seconds)
+            self.sql_statements.setdefault(key, Histogram(STATEMENT_COUNT_BUCKETS)).observe(sql_count)
+            if serialize_seconds is not None:
+                self.serialize_seconds.setdefault(key, Histogram()).observe(serialize_seconds)
+            if slow:
+                self.slow_requests[key] = self.slow_requests.get(key, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "latency": {key: histogram.snapshot() for key, histogram in self.latency.items()},
+                "sql_seconds": {key: histogram.snapshot() for key, histogram in self.sql_seconds.items()},
+                "sql_statements": {key: histogram.snapshot() for key, histogram in self.sql_statements.items()},
+                "serialize_seconds": {key: histogram.snapshot() for key, histogram in self.serialize_seconds.items()},
+                "slow_requests": dict(self.slow_requests),
+                "statement_seconds": self.statement_seconds.snapshot(),
+            }
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items()) + "}"
+
+class PrometheusText:
+    """Builder for the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, labels: Optional[Dict[str, str]] = None):
+        self.lines.append(f"{name}{_labels(labels or {})} {float(value)!r}")
+
+    def histogram(self, name: str, snapshot: Dict, labels: Optional[Dict[str, str]] = None):
+        labels = labels or {}
+        for bound, count in snapshot["buckets"].items():
+            self.sample(f"{name}_bucket", count, {**labels, "le": bound})
+        self.sample(f"{name}_sum", snapshot["sum"], labels)
+        self.sample(f"{name}_count", snapshot["count"], labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+def render_prometheus(pool=None, cache_stats: Optional[Dict] = None) -> str:
+    text = PrometheusText()
+    requests = request_metrics.snapshot()
+
+    text.family("http_request_duration_seconds", "histogram", "Request latency by route")
+    for (method, route, status), snapshot in sorted(requests["latency"].items()):
+        text.histogram("http_request_duration_seconds", snapshot, {"method": method, "route": route, "status": status})
+    text.family("http_request_sql_statements", "histogram", "SQL statements executed per request")
+    for (method, route), snapshot in sorted(requests["sql_statements"].items()):
+        text.histogram("http_request_sql_statements", snapshot, {"method": method, "route": route})
+    text.family("http_request_sql_duration_seconds", "histogram", "Time spent in SQL per request")
+    for (method, route), snapshot in sorted(requests["sql_seconds"].items()):
+        text.histogram("http_request_sql_duration_seconds", snapshot, {"method": method, "route": route})
+    text.family(
+        "http_request_serialization_duration_seconds", "histogram",
+        "Time between the endpoint returning and the response being ready (validation and serialization)",
+    )
+    for (method, route), snapshot in sorted(requests["serialize_seconds"].items()):
+        text.histogram("http_request_serialization_duration_seconds", snapshot, {"method": method, "route": route})
+    text.family("http_slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS")
+    for (method, route), count in sorted(requests["slow_requests"].items()):
+        text.sample("http_slow_requests_total", count, {"method": method, "route": route})
+    text.family("db_statement_duration_seconds", "histogram", "Duration of every SQL statement")
+    text.histogram("db_statement_duration_seconds", requests["statement_seconds"])
+
+    pool_stats = pool_metrics.snapshot(pool)
+    text.family("db_pool_checkout_wait_seconds", "histogram", "Time waited for a pooled connection")
+    text.histogram("db_pool_checkout_wait_seconds", pool_stats.pop("checkout_wait_seconds"))
+    for key in ("checkouts", "connects", "closes", "invalidations"):
+        text.family(f"db_pool_{key}_total", "counter", f"Connection pool {key}")
+        text.sample(f"db_pool_{key}_total", pool_stats.pop(key))
+    for key, value in pool_stats.items():
+        text.family(f"db_pool_{key}", "gauge", f"Connection pool {key.replace('_', ' ')}")
+        text.sample(f"db_pool_{key}", value)
+
+    for key, value in (cache_stats or {}).items():
+        if isinstance(value, (bool, int, float)) and value is not None:
+            kind = "counter" if key in ("hits", "misses", "reloads", "evictions") else "gauge"
+            name = f"graph_cache_{key}_total" if kind == "counter" else f"graph_cache_{key}"
+            text.family(name, kind, f"Graph cache {key.replace('_', ' ')}")
+            text.sample(name, value)
+    return text.render()
+
+pool_metrics = PoolMetrics()
+request_metrics = RequestMetrics()
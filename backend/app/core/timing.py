@@ -0,0 +1,164 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+from fastapi.routing import APIRoute
+from app.core.metrics import request_metrics
+
+# Requests at least this slow get a Server-Timing header and a slow-request log line
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# How many of a slow request's statements are logged, slowest first
+SLOW_LOG_STATEMENTS = 5
+STATEMENT_LOG_LENGTH = 300
+UNMATCHED_ROUTE = "<unmatched>"
+STREAMING_MEDIA_TYPES = (b"text/event-stream",)
+
+logger = logging.getLogger("app.slow_requests")
+
+class RequestTiming:
+    """Where one request's time went; filled in by engine events and TimedRoute"""
+
+    def __init__(self):
+        self.route: Optional[str] = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.endpoint_seconds: Optional[float] = None
+        self.handler_seconds: Optional[float] = None
+        self.slowest: List[Tuple[float, int, str]] = []
+
+    def record_statement(self, statement: str, seconds: float):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        entry = (seconds, self.sql_count, statement)
+        if len(self.slowest) < SLOW_LOG_STATEMENTS:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    @property
+    def serialize_seconds(self) -> Optional[float]:
+        if self.handler_seconds is None or self.endpoint_seconds is None:
+            return None
+        return max(self.handler_seconds - self.endpoint_seconds, 0.0)
+
+    def server_timing(self, total_seconds: float) -> str:
+        metrics = [f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"']
+        if self.endpoint_seconds is not None:
+            metrics.append(f"app;dur={self.endpoint_seconds * 1000:.1f}")
+        if self.serialize_seconds is not None:
+            metrics.append(f"serialize;dur={self.serialize_seconds * 1000:.1f}")
+        metrics.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(metrics)
+
+current_timing: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    "current_timing", default=None
+)
+
+def record_statement(statement: str, seconds: float):
+    request_metrics.record_statement(seconds)
+    timing = current_timing.get()
+    if timing is not None:
+        timing.record_statement(statement, seconds)
+
+class TimedRoute(APIRoute):
+    """APIRoute that times its endpoint separately from the rest of the handler
+    (parameter validation, response model validation and serialization)"""
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "_timed", False):
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    timing = current_timing.get()
+                    if timing is not None:
+                        timing.endpoint_seconds = time.perf_counter() - started
+
+            timed_endpoint._timed = True
+            self.dependant.call = timed_endpoint
+
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request):
+            timing = current_timing.get()
+            if timing is not None:
+                timing.route = route
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                if timing is not None:
+                    timing.handler_seconds = time.perf_counter() - started
+
+        return timed_handler
+
+class RequestTimingMiddleware:
+    """Records per-route latency, SQL and serialization metrics for every HTTP
+    request; slow ones also get a Server-Timing header and a log line.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses pass through."""
+
+    def __init__(self, app, slow_request_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        started = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_with_timing(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.get("headers", [])
+                streaming = any(
+                    name == b"content-type" and value.startswith(STREAMING_MEDIA_TYPES)
+                    for name, value in headers
+                )
+                elapsed = time.perf_counter() - started
+                if elapsed >= self.slow_seconds and not streaming:
+                    message["headers"] = list(headers) + [
+                        (b"server-timing", timing.server_timing(elapsed).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timing.reset(token)
+            if not streaming:
+                self._record(scope, timing, status, time.perf_counter() - started)
+
+    def _record(self, scope, timing: RequestTiming, status: int, elapsed: float):
+        method = scope["method"]
+        route = timing.route or UNMATCHED_ROUTE
+        slow = elapsed >= self.slow_seconds
+        request_metrics.record_request(
+            method, route, status, elapsed,
+            timing.sql_count, timing.sql_seconds, timing.serialize_seconds, slow,
+        )
+        if slow:
+            statements = "; ".join(
+                f"[{seconds * 1000:.1f} ms] {' '.join(statement.split())[:STATEMENT_LOG_LENGTH]}"
+                for seconds, _, statement in sorted(timing.slowest, reverse=True)
+            )
+            logger.warning(
+                "Slow request %s %s -> %s in %.1f ms (%d SQL statements, %.1f ms); slowest: %s",
+                method, scope["path"], status, elapsed * 1000,
+                timing.sql_count, timing.sql_seconds * 1000, statements or "none",
+            )
@@ -1,15 +1,24 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api.router.router import router, setup_cors
-from app.core.db import async_engine
-from sqlalchemy import text
+from app.api.router.router import setup_cors, setup_routes
+from app.core.db import FAST_STARTUP, AsyncSessionLocal, dispose_engines
+from app.core.events import graph_events
+from app.core.jobs import job_queue
+from app.core.maps import DEFAULT_MAP_ID
+from app.core.timing import RequestTimingMiddleware
+from app.services.graph_service import GraphService
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with async_engine.connect() as conn:
-        await conn.execute(text("SELECT 1"))
+    # In fast startup the cache is loaded by the first request that reads the graph
+    if not FAST_STARTUP:
+        async with AsyncSessionLocal() as db:
+            await GraphService.load_cache(db, DEFAULT_MAP_ID)
+    job_queue.start()
     yield
-    await async_engine.dispose()
+    await job_queue.close()
+    graph_events.close()
+    await dispose_engines()
 
 app = FastAPI(
     title="Knowledge Map API",
@@ -19,4 +28,5 @@ app = FastAPI(
 )
 
 setup_cors(app)
-app.include_router(router)
\ No newline at end of file
+app.add_middleware(RequestTimingMiddleware)
+setup_routes(app)
\ No newline at end of file
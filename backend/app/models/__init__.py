@@ -1,2 +1,3 @@
 from .course import Course
+from .graph import GraphChange, GraphState
 from app.core.db import Base
\ No newline at end of file
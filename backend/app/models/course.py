@@ -1,22 +1,66 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Table, Index
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table, Index, text
 from sqlalchemy.orm import relationship, backref
 from app.core.db import Base
+from app.core.maps import DEFAULT_MAP_ID
 
 course_prerequisite = Table(
     "course_prerequisite",
     Base.metadata,
     Column("course_id", Integer, ForeignKey("course.id"), primary_key=True),
     Column("prerequisite_id", Integer, ForeignKey("course.id"), primary_key=True),
+    # The map of both courses; a prerequisite never links two maps
+    Column("map_id", Integer, nullable=False, default=DEFAULT_MAP_ID, server_default=str(DEFAULT_MAP_ID)),
+    Index('ix_course_prerequisite_map_id', 'map_id', 'course_id'),
     Index('ix_course_prerequisite_course_id', 'course_id'),
     Index('ix_course_prerequisite_prerequisite_id', 'prerequisite_id')
 )
 
+# Transitive closure of the parent hierarchy (relation "parent") and of the
+# prerequisite graph (relation "prerequisite"), including depth-0 self rows.
+course_closure = Table(
+    "course_closure",
+    Base.metadata,
+    Column("relation", String, primary_key=True),
+    Column("ancestor_id", Integer, ForeignKey("course.id"), primary_key=True),
+    Column("descendant_id", Integer, ForeignKey("course.id"), primary_key=True),
+    Column("depth", Integer, nullable=False),
+    Index('ix_course_closure_descendant', 'relation', 'descendant_id', 'depth'),
+)
+
+LIVE = text("deleted_at IS NULL")
+DELETED = text("deleted_at IS NOT NULL")
+
 class Course(Base):
     __tablename__ = "course"
+    __table_args__ = (
+        # Names are unique among a map's live courses only, so deleted ones can be
+        # restored or recreated; writes rely on this index through ON CONFLICT
+        Index('ix_course_map_name_live', 'map_id', 'name', unique=True, postgresql_where=LIVE, sqlite_where=LIVE),
+        Index('ix_course_map_parent_id_live', 'map_id', 'parent_id', postgresql_where=LIVE, sqlite_where=LIVE),
+        # Keyset pages of one map
+        Index('ix_course_map_id', 'map_id', 'id'),
+        # Lists a map's trash
+        Index('ix_course_map_deleted', 'map_id', 'deleted_at', 'parent_id', postgresql_where=DELETED, sqlite_where=DELETED),
+        # Walks one deletion's subtree when it is restored
+        Index('ix_course_map_deletion', 'map_id', 'deletion_id', 'parent_id', postgresql_where=DELETED, sqlite_where=DELETED),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    name = Column(String, index=True, unique=True)
+    # Knowledge map (tenant) the course belongs to; ids are unique across maps,
+    # names and parents only within one
+    map_id = Column(Integer, nullable=False, default=DEFAULT_MAP_ID, server_default=str(DEFAULT_MAP_ID))
+    name = Column(String)
     parent_id = Column(Integer, ForeignKey("course.id"), nullable=True)
+    # Incremented by every write to the row; sent as the ETag of a course and
+    # checked against If-Match
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Set when the course is soft-deleted. A live course never has a deleted
+    # parent, and a prerequisite only links two live courses or two courses of
+    # one deletion.
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+    # Shared by the courses one delete took down together, which a restore brings
+    # back together
+    deletion_id = Column(String, nullable=True)
     children = relationship("Course", backref=backref("parent", remote_side=[id]))
 
     prerequisites = relationship(
@@ -0,0 +1,25 @@
+from sqlalchemy import JSON, BigInteger, Column, Index, Integer, String
+from app.core.db import Base
+from app.core.maps import DEFAULT_MAP_ID
+
+class GraphState(Base):
+    __tablename__ = "graph_state"
+
+    # One row per map, keyed by the map id
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class GraphChange(Base):
+    __tablename__ = "graph_change"
+
+    __table_args__ = (
+        Index('ix_graph_change_map_version', 'map_id', 'version'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    map_id = Column(Integer, nullable=False, default=DEFAULT_MAP_ID, server_default=str(DEFAULT_MAP_ID))
+    # Version of the map's graph the change produced
+    version = Column(BigInteger, nullable=False)
+    entity = Column(String, nullable=False)
+    op = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
@@ -1,5 +1,9 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, List
+
+MAX_BATCH_OPERATIONS = 10000
+MAX_MOVE_COURSES = 1000
 
 class CourseBase(BaseModel):
     name: str
@@ -12,6 +16,58 @@ class Course(CourseBase):
     id: int
     parent_id: Optional[int] = None
     parent_name: Optional[str] = None
+    version: Optional[int] = Field(
+        None, description="Row version, also sent as the ETag; single-course responses only, lists leave it out"
+    )
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class CourseDependency(Course):
+    depth: int
+
+class CourseSearchResult(Course):
+    score: float
+
+class DeletedCourse(Course):
+    deleted_at: datetime
+
+class CourseSubtreeChange(Course):
+    # Courses deleted or restored along with this one, itself included
+    courses: int
+
+class CourseMove(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=MAX_MOVE_COURSES)
+    parent_id: Optional[int] = None
+
+class CourseImportRecord(CourseBase):
+    prerequisites: List[str] = []
+
+class CourseImportError(BaseModel):
+    line: int
+    name: Optional[str] = None
+    error: str
+
+class CourseImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[CourseImportError] = []
+    version: Optional[int] = None
+
+class CourseBatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    name: Optional[str] = None
+    parent_name: Optional[str] = None
+
+class CourseBatch(BaseModel):
+    operations: List[CourseBatchOperation] = Field(..., min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+class CourseBatchResult(BaseModel):
+    index: int
+    op: str
+    course: Course
+
+class CourseBatchReport(BaseModel):
+    version: int
+    results: List[CourseBatchResult]
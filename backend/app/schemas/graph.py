@@ -0,0 +1,74 @@
+from pydantic import BaseModel
+from typing import Optional, List
+
+class GraphNode(BaseModel):
+    id: int
+    name: str
+    parent_id: Optional[int] = None
+    version: Optional[int] = None
+
+class GraphEdge(BaseModel):
+    source: int
+    target: int
+    type: str
+
+class GraphSnapshot(BaseModel):
+    version: int
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
+
+class GraphLayoutNode(GraphNode):
+    x: float
+    y: float
+
+class GraphLayoutSnapshot(GraphSnapshot):
+    algorithm: str
+    nodes: List[GraphLayoutNode]
+
+class GraphNeighborhoodNode(GraphNode):
+    depth: int
+
+class GraphNeighborhood(BaseModel):
+    center: int
+    nodes: List[GraphNeighborhoodNode]
+    edges: List[GraphEdge]
+    truncated: bool = False
+
+class GraphCourseReach(BaseModel):
+    id: int
+    name: str
+    dependents: int
+    direct_dependents: int
+
+class GraphStats(BaseModel):
+    version: int
+    courses: int
+    parent_edges: int
+    prerequisite_edges: int
+    max_prerequisite_depth: int
+    mean_prerequisite_depth: float
+    max_parent_depth: int
+    critical_path_length: int
+    critical_path: List[int]
+    roots: int
+    leaves: int
+    orphans: int
+    orphan_ids: List[int]
+    components: int
+    largest_components: List[int]
+    cyclic_courses: int
+    transitive_dependents_exact: bool
+    most_depended_on: List[GraphCourseReach]
+    compute_ms: float
+
+class GraphChange(BaseModel):
+    version: int
+    op: str
+    node: Optional[GraphNode] = None
+    edge: Optional[GraphEdge] = None
+
+class GraphChangeFeed(BaseModel):
+    version: int
+    since: int
+    changes: List[GraphChange] = []
+    snapshot: Optional[GraphSnapshot] = None
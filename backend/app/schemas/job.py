@@ -0,0 +1,13 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Literal, Optional
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
@@ -0,0 +1,340 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import String, bindparam, case, cast, delete, literal, or_, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.course import Course, course_prerequisite
+from app.schemas.course import (
+    Course as CourseSchema,
+    CourseBatch,
+    CourseBatchOperation,
+    CourseBatchReport,
+    CourseBatchResult,
+)
+from app.schemas.graph import GraphNode
+from app.services.bulk_service import BulkService
+from app.services.closure_service import MAX_WALK_DEPTH, ClosureService
+from app.services.graph_service import GraphService
+from app.services.subtree_service import new_deletion_id
+
+# Every course of the map a batch names or deletes, the children of the deleted
+# ones, and the ancestor chains of all of them: enough to check names and parent
+# cycles in memory
+BATCH_COURSES_QUERY = text("""
+    WITH RECURSIVE batch_courses(id, name, parent_id, version, depth) AS (
+        SELECT id, name, parent_id, version, 0 FROM course
+        WHERE map_id = :map_id AND deleted_at IS NULL
+            AND (id IN :ids OR name IN :names OR parent_id IN :deleted_ids)
+        UNION
+        SELECT c.id, c.name, c.parent_id, c.version, bc.depth + 1
+        FROM course c
+        INNER JOIN batch_courses bc ON c.id = bc.parent_id
+        WHERE bc.depth < :max_depth
+    )
+    SELECT DISTINCT id, name, parent_id, version FROM batch_courses
+""").bindparams(
+    bindparam("ids", expanding=True),
+    bindparam("names", expanding=True),
+    bindparam("deleted_ids", expanding=True),
+)
+
+# Temporary names of renamed courses are this followed by their id
+RENAMING_PREFIX = "\x01renaming:"
+
+# (name, parent_id), as in GraphCache.nodes
+Node = Tuple[str, Optional[int]]
+
+def _fail(index: int, status_code: int, detail: str):
+    raise HTTPException(status_code=status_code, detail=f"Operation {index}: {detail}")
+
+class _BatchState:
+    """Working copy of the courses a batch touches, edited one operation at a time"""
+
+    def __init__(self, rows):
+        self.original: Dict[int, Node] = {row.id: (row.name, row.parent_id) for row in rows}
+        self.nodes: Dict[int, Node] = dict(self.original)
+        self.names: Dict[str, int] = {name: course_id for course_id, (name, _) in self.nodes.items()}
+        self.children: Dict[int, Set[int]] = {}
+        for course_id, (_, parent_id) in self.nodes.items():
+            if parent_id is not None:
+                self.children.setdefault(parent_id, set()).add(course_id)
+        # Course id -> index of the operation that last changed it, in that order
+        self.touched: Dict[int, int] = {}
+        self.created: List[int] = []
+        self.deleted: List[int] = []
+        # Row versions, bumped for the courses the batch changes once it is written
+        self.versions: Dict[int, int] = {row.id: row.version for row in rows}
+
+    def course(self, course_id: int) -> dict:
+        name, parent_id = self.nodes[course_id]
+        return {
+            "id": course_id,
+            "name": name,
+            "parent_id": parent_id,
+            "parent_name": self.nodes[parent_id][0] if parent_id is not None else None,
+        }
+
+    def _touch(self, course_id: int, index: int):
+        self.touched.pop(course_id, None)
+        self.touched[course_id] = index
+
+    def _set(self, course_id: int, name: str, parent_id: Optional[int], index: int):
+        previous = self.nodes.get(course_id)
+        if previous is not None:
+            self.names.pop(previous[0], None)
+            if previous[1] is not None:
+                self.children[previous[1]].discard(course_id)
+        self.nodes[course_id] = (name, parent_id)
+        self.names[name] = course_id
+        if parent_id is not None:
+            self.children.setdefault(parent_id, set()).add(course_id)
+        self._touch(course_id, index)
+
+    def _parent_id(self, index: int, operation: CourseBatchOperation) -> Optional[int]:
+        if not operation.parent_name:
+            return None
+        parent_id = self.names.get(operation.parent_name)
+        if parent_id is None:
+            _fail(index, 404, f"Parent course '{operation.parent_name}' not found")
+        return parent_id
+
+    def _existing(self, index: int, operation: CourseBatchOperation) -> int:
+        if operation.id is None:
+            _fail(index, 400, f"{operation.op} requires an id")
+        if operation.id not in self.nodes:
+            _fail(index, 404, f"Course {operation.id} not found")
+        return operation.id
+
+    def _check_name(self, index: int, operation: CourseBatchOperation, course_id: Optional[int] = None):
+        if not operation.name:
+            _fail(index, 400, f"{operation.op} requires a name")
+        holder = self.names.get(operation.name)
+        if holder is not None and holder != course_id:
+            _fail(index, 409, f"Course with name '{operation.name}' already exists")
+
+    def _creates_cycle(self, course_id: int, parent_id: Optional[int]) -> bool:
+        for _ in range(len(self.nodes) + 1):
+            if parent_id is None:
+                return False
+            if parent_id == course_id:
+                return True
+            parent_id = self.nodes.get(parent_id, (None, None))[1]
+        return True
+
+    def create(self, index: int, operation: CourseBatchOperation, course_id: int) -> dict:
+        self._check_name(index, operation)
+        self._set(course_id, operation.name, self._parent_id(index, operation), index)
+        self.created.append(course_id)
+        return self.course(course_id)
+
+    def update(self, index: int, operation: CourseBatchOperation) -> dict:
+        course_id = self._existing(index, operation)
+        self._check_name(index, operation, course_id)
+        parent_id = self._parent_id(index, operation)
+        if self._creates_cycle(course_id, parent_id):
+            _fail(
+                index, 400,
+                f"Making '{operation.parent_name}' the parent of '{operation.name}' would create a cycle",
+            )
+        self._set(course_id, operation.name, parent_id, index)
+        return self.course(course_id)
+
+    def delete(self, index: int, operation: CourseBatchOperation) -> dict:
+        course_id = self._existing(index, operation)
+        course = self.course(course_id)
+        # Children are detached rather than deleted, as DELETE /courses/{id} does
+        for child_id in sorted(self.children.get(course_id, ())):
+            self._set(child_id, self.nodes[child_id][0], None, index)
+        self.children.pop(course_id, None)
+        name, parent_id = self.nodes.pop(course_id)
+        self.names.pop(name, None)
+        if parent_id is not None:
+            self.children[parent_id].discard(course_id)
+        self._touch(course_id, index)
+        if course_id in self.original:
+            self.deleted.append(course_id)
+        else:
+            self.created.remove(course_id)
+        return course
+
+    @staticmethod
+    def node(nodes: Dict[int, Node], course_id: int, version: Optional[int] = None) -> Optional[GraphNode]:
+        if course_id not in nodes:
+            return None
+        name, parent_id = nodes[course_id]
+        return GraphNode(id=course_id, name=name, parent_id=parent_id, version=version)
+
+class BatchService:
+    @staticmethod
+    async def _load_state(db: AsyncSession, map_id: int, operations: List[CourseBatchOperation]) -> _BatchState:
+        ids = {operation.id for operation in operations if operation.id is not None}
+        names = {operation.name for operation in operations if operation.name}
+        names |= {operation.parent_name for operation in operations if operation.parent_name}
+        deleted_ids = {
+            operation.id for operation in operations
+            if operation.op == "delete" and operation.id is not None
+        }
+        result = await db.execute(BATCH_COURSES_QUERY, {
+            "map_id": map_id,
+            "ids": list(ids),
+            "names": list(names),
+            "deleted_ids": list(deleted_ids),
+            "max_depth": MAX_WALK_DEPTH,
+        })
+        return _BatchState(result.all())
+
+    @staticmethod
+    async def _write(db: AsyncSession, map_id: int, state: _BatchState):
+        """Apply the batch's final state with a handful of set-based statements.
+
+        The existing courses it writes are first claimed at the versions the batch
+        read, so it fails with 409 rather than overwrite a concurrent write.
+        Deleted courses are soft-deleted first, which frees their names, and
+        their children are detached by the updates. Renamed courses get temporary
+        names before their final ones. Updates run before inserts so
+        renamed-away names can be reused, and parents that point at courses
+        created in this batch are set once those rows exist."""
+        created = set(state.created)
+        changed = [
+            course_id for course_id in state.touched
+            if course_id in state.original
+            and course_id in state.nodes
+            and state.nodes[course_id] != state.original[course_id]
+        ]
+        moved = [
+            course_id for course_id in changed
+            if state.nodes[course_id][1] != state.original[course_id][1]
+        ]
+
+        written = changed + state.deleted
+        if written:
+            # Claim the rows at the versions the batch read, before anything else is
+            # written; a course changed since, e.g. by a PUT, fails the batch instead
+            # of being overwritten. On Postgres the claimed rows stay locked until commit
+            read_versions = {course_id: state.versions[course_id] for course_id in written}
+            result = await db.execute(
+                update(Course)
+                .where(Course.id.in_(written), Course.version == case(read_versions, value=Course.id))
+                .values(version=Course.version + 1)
+                .returning(Course.id, Course.version)
+            )
+            claimed = dict(result.all())
+            if len(claimed) != len(written):
+                stale = sorted(course_id for course_id in written if course_id not in claimed)
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Courses changed since the batch read them: {', '.join(map(str, stale))}; retry the batch",
+                )
+            state.versions.update((course_id, claimed[course_id]) for course_id in changed)
+
+        if ClosureService.enabled:
+            parent_affected = await ClosureService.descendants(db, "parent", moved + state.deleted)
+            prerequisite_affected = await ClosureService.descendants(db, "prerequisite", state.deleted)
+
+        if state.deleted:
+            # Each delete operation is a deletion of its own, restored on its own as
+            # after DELETE /courses/{id}; their prerequisites are dropped rather than
+            # kept for a restore, as operations may have relinked them
+            deleted_at = datetime.now(timezone.utc)
+            await db.execute(
+                update(Course.__table__)
+                .where(Course.id == bindparam("course_id"))
+                .values(deleted_at=deleted_at, deletion_id=bindparam("deletion_id")),
+                [{"course_id": course_id, "deletion_id": new_deletion_id()} for course_id in state.deleted],
+            )
+            await db.execute(delete(course_prerequisite).where(or_(
+                course_prerequisite.c.course_id.in_(state.deleted),
+                course_prerequisite.c.prerequisite_id.in_(state.deleted),
+            )))
+            if ClosureService.enabled:
+                await ClosureService.remove_courses(db, state.deleted)
+
+        renamed = [
+            course_id for course_id in changed
+            if state.nodes[course_id][0] != state.original[course_id][0]
+        ]
+        if len(renamed) > 1:
+            # The unique name index is checked row by row, so names swapped or
+            # passed along within the batch are first moved out of each other's way
+            await db.execute(
+                update(Course)
+                .where(Course.id.in_(renamed))
+                .values(name=literal(RENAMING_PREFIX) + cast(Course.id, String))
+            )
+        if changed:
+            await db.execute(update(Course), [
+                {
+                    "id": course_id,
+                    "name": state.nodes[course_id][0],
+                    "parent_id": None if state.nodes[course_id][1] in created else state.nodes[course_id][1],
+                }
+                for course_id in changed
+            ])
+        if state.created:
+            await BulkService._insert_rows(
+                db, Course.__table__, ["id", "map_id", "name", "parent_id"],
+                [(course_id, map_id, *state.nodes[course_id]) for course_id in state.created],
+            )
+        deferred = [course_id for course_id in changed if state.nodes[course_id][1] in created]
+        if deferred:
+            await db.execute(update(Course), [
+                {"id": course_id, "parent_id": state.nodes[course_id][1]} for course_id in deferred
+            ])
+        state.versions.update((course_id, 1) for course_id in state.created)
+
+        if ClosureService.enabled:
+            deleted = set(state.deleted)
+            if state.created:
+                await ClosureService.add_courses(db, state.created)
+            await ClosureService.recompute(
+                db, "parent", [course_id for course_id in parent_affected if course_id not in deleted]
+            )
+            await ClosureService.recompute(
+                db, "prerequisite", [course_id for course_id in prerequisite_affected if course_id not in deleted]
+            )
+
+    @staticmethod
+    async def apply_batch(db: AsyncSession, map_id: int, batch: CourseBatch) -> CourseBatchReport:
+        """Validate an ordered list of course operations against the current graph
+        and apply all of them in one transaction, or none of them"""
+        operations = batch.operations
+        try:
+            state = await BatchService._load_state(db, map_id, operations)
+            creates = sum(1 for operation in operations if operation.op == "create")
+            new_ids = iter(await BulkService._allocate_ids(db, creates) if creates else ())
+
+            results = []
+            for index, operation in enumerate(operations):
+                if operation.op == "create":
+                    course = state.create(index, operation, next(new_ids))
+                elif operation.op == "update":
+                    course = state.update(index, operation)
+                else:
+                    course = state.delete(index, operation)
+                results.append(CourseBatchResult(index=index, op=operation.op, course=CourseSchema(**course)))
+
+            await BatchService._write(db, map_id, state)
+            for result in results:
+                if result.op != "delete":
+                    result.course.version = state.versions.get(result.course.id)
+            changes = []
+            for course_id in state.touched:
+                old = state.node(state.original, course_id)
+                new = state.node(state.nodes, course_id, state.versions.get(course_id))
+                if old is not None or new is not None:
+                    changes.extend(GraphService.course_changes(old, new))
+            version = await GraphService.record_changes(db, map_id, changes)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Batch conflicts with a concurrent write; retry the batch",
+            )
+        except Exception:
+            await db.rollback()
+            raise
+
+        GraphService.publish_changes(map_id, version, changes)
+        return CourseBatchReport(version=version, results=results)
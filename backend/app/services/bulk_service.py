@@ -0,0 +1,437 @@
+import codecs
+import csv
+import io
+import json
+import os
+import tempfile
+from collections import deque
+from typing import IO, AbstractSet, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple, Union
+import orjson
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.core.db import AsyncSessionLocal
+from app.core.jobs import Job, job_queue
+from app.models.course import Course, course_prerequisite
+from app.schemas.course import CourseImportError, CourseImportRecord, CourseImportReport
+from app.services.closure_service import ClosureService
+from app.services.graph_service import GraphService
+
+FORMATS = ("jsonl", "csv")
+CSV_FIELDS = ("name", "parent_name", "prerequisites")
+# Prerequisite names are joined with this separator inside a CSV cell
+CSV_LIST_SEPARATOR = ";"
+INSERT_CHUNK_SIZE = 5000
+EXPORT_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+# Background imports are spooled to a temporary file above this many bytes
+IMPORT_SPOOL_SIZE = int(os.getenv("IMPORT_SPOOL_SIZE", str(8 * 1024 * 1024)))
+
+# (line number, parsed record) or (line number, parse error message)
+ParsedLine = Tuple[int, Union[dict, CourseImportRecord, str]]
+
+class BulkService:
+    @staticmethod
+    def _parse_json(line_no: int, line: str) -> Optional[ParsedLine]:
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            return line_no, f"Invalid JSON: {e.msg}"
+        return line_no, data if isinstance(data, dict) else "Expected a JSON object"
+
+    @staticmethod
+    def _parse_csv(line_no: int, values: List[str]) -> Optional[ParsedLine]:
+        if line_no == 1 and values[:1] == ["name"]:
+            return None
+        data = dict(zip(CSV_FIELDS, values))
+        data["parent_name"] = data.get("parent_name") or None
+        data["prerequisites"] = [
+            name for name in (data.get("prerequisites") or "").split(CSV_LIST_SEPARATOR) if name
+        ]
+        return line_no, data
+
+    @staticmethod
+    async def _read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+        """Decode `chunks` incrementally into lines that keep their newline"""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        pending: List[str] = []
+        async for chunk in chunks:
+            *lines, rest = decoder.decode(chunk).split("\n")
+            if lines:
+                lines[0] = "".join(pending) + lines[0]
+                pending.clear()
+                for line in lines:
+                    yield line + "\n"
+            if rest:
+                pending.append(rest)
+        pending.append(decoder.decode(b"", final=True))
+        tail = "".join(pending)
+        if tail:
+            yield tail
+
+    @staticmethod
+    async def parse_stream(fmt: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedLine]:
+        """Parse records as `chunks` arrive, each numbered by the line it starts on"""
+        line_no = 0
+        if fmt == "jsonl":
+            async for line in BulkService._read_lines(chunks):
+                line_no += 1
+                item = BulkService._parse_json(line_no, line)
+                if item:
+                    yield item
+            return
+
+        # One reader across the whole stream, fed a record only once its last line
+        # arrived: a newline ends the record unless it sits inside a quoted field,
+        # i.e. after an odd number of quotes
+        record: deque = deque()
+        reader = csv.reader(iter(record.popleft, None))
+        quotes = 0
+        start = 1
+        async for line in BulkService._read_lines(chunks):
+            line_no += 1
+            if not record:
+                start = line_no
+                if not line.strip():
+                    continue
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                quotes = 0
+                item = BulkService._parse_csv(start, next(reader))
+                if item:
+                    yield item
+        if record:
+            yield start, "Unterminated quoted field"
+
+    @staticmethod
+    def _parent_order(rows: Dict[str, Tuple[int, CourseImportRecord]]) -> Tuple[List[str], List[str]]:
+        """Order batch rows so every in-batch parent precedes its children.
+
+        Returns (ordered names, names caught in or below a parent cycle)."""
+        children: Dict[str, List[str]] = {}
+        queue = deque()
+        for name, (_, record) in rows.items():
+            if record.parent_name in rows:
+                children.setdefault(record.parent_name, []).append(name)
+            else:
+                queue.append(name)
+
+        ordered = []
+        while queue:
+            name = queue.popleft()
+            ordered.append(name)
+            queue.extend(children.get(name, ()))
+
+        placed = set(ordered)
+        return ordered, [name for name in rows if name not in placed]
+
+    @staticmethod
+    def validate(records: Iterable[ParsedLine], existing: Dict[str, int],
+                 imported: AbstractSet[str] = frozenset(), final: bool = True):
+        """Resolve a batch against existing course names entirely in memory;
+        `imported` are the names this import already wrote, among `existing`.
+
+        Returns the accepted rows in insert order, the per-row errors and the rows
+        held back because their parent or prerequisites may still come later in
+        the import. With `final` nothing is held back: those rows are errors."""
+        errors: List[CourseImportError] = []
+        rows: Dict[str, Tuple[int, CourseImportRecord]] = {}
+
+        for line, data in records:
+            if isinstance(data, str):
+                errors.append(CourseImportError(line=line, error=data))
+                continue
+            if isinstance(data, CourseImportRecord):
+                record = data
+            else:
+                try:
+                    record = CourseImportRecord(**data)
+                except ValidationError as e:
+                    errors.append(CourseImportError(
+                        line=line, name=data.get("name"), error=e.errors()[0]["msg"]
+                    ))
+                    continue
+            if record.name in imported or record.name in rows:
+                errors.append(CourseImportError(
+                    line=line, name=record.name,
+                    error=f"Duplicate course name '{record.name}' in import",
+                ))
+            elif record.name in existing:
+                errors.append(CourseImportError(
+                    line=line, name=record.name,
+                    error=f"Course with name '{record.name}' already exists",
+                ))
+            else:
+                rows[record.name] = (line, record)
+
+        ordered, cyclic = BulkService._parent_order(rows)
+        rejected = {name: "Parent chain forms a cycle" for name in cyclic}
+        accepted = dict.fromkeys(ordered)
+        rejected.update(BulkService._prune(rows, accepted, existing))
+        for name in BulkService._prerequisite_cycles(rows, accepted):
+            del accepted[name]
+            rejected[name] = "Prerequisites form a cycle"
+        rejected.update(BulkService._prune(rows, accepted, existing))
+
+        held: List[ParsedLine] = []
+        if final:
+            errors.extend(
+                CourseImportError(line=rows[name][0], name=name, error=error)
+                for name, error in rejected.items()
+            )
+        else:
+            held = [rows[name] for name in rows if name in rejected]
+        errors.sort(key=lambda error: error.line)
+        return [rows[name][1] for name in accepted], errors, held
+
+    @staticmethod
+    def _prerequisite_cycles(rows, accepted) -> List[str]:
+        """Accepted rows on or behind a prerequisite cycle within the batch.
+
+        Existing courses never require new ones, so cycles can only involve batch rows."""
+        remaining = {}
+        unlocks: Dict[str, List[str]] = {}
+        for name in accepted:
+            required = [p for p in rows[name][1].prerequisites if p in accepted]
+            remaining[name] = len(required)
+            for prerequisite in required:
+                unlocks.setdefault(prerequisite, []).append(name)
+
+        queue = deque(name for name, count in remaining.items() if count == 0)
+        while queue:
+            name = queue.popleft()
+            for dependent in unlocks.get(name, ()):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    queue.append(dependent)
+        return [name for name, count in remaining.items() if count > 0]
+
+    @staticmethod
+    def _prune(rows, accepted, existing) -> Dict[str, str]:
+        """Reject rows whose parent or prerequisites are unavailable; rejecting a row
+        can invalidate rows that reference it, so repeat until nothing changes.
+        Returns the error of each rejected row"""
+        rejected = {}
+        pruned = True
+        while pruned:
+            pruned = False
+            for name in list(accepted):
+                record = rows[name][1]
+                error = None
+                if record.parent_name and record.parent_name not in existing and record.parent_name not in accepted:
+                    error = f"Parent course '{record.parent_name}' not found"
+                else:
+                    missing = [
+                        prerequisite for prerequisite in record.prerequisites
+                        if prerequisite not in existing and prerequisite not in accepted
+                    ]
+                    if missing:
+                        error = f"Prerequisite course '{missing[0]}' not found"
+                if error:
+                    del accepted[name]
+                    rejected[name] = error
+                    pruned = True
+        return rejected
+
+    @staticmethod
+    async def _allocate_ids(db: AsyncSession, count: int) -> List[int]:
+        if db.bind.dialect.name == "postgresql":
+            result = await db.execute(
+                text("SELECT nextval(pg_get_serial_sequence('course', 'id')) FROM generate_series(1, :n)"),
+                {"n": count},
+            )
+            return list(result.scalars())
+        start = (await db.execute(select(func.coalesce(func.max(Course.id), 0)))).scalar_one()
+        return list(range(start + 1, start + count + 1))
+
+    @staticmethod
+    async def _copy_rows(db: AsyncSession, table: str, columns: List[str], rows: List[tuple]) -> bool:
+        """COPY rows through the session's own asyncpg connection; False if unavailable"""
+        if not rows or db.bind.dialect.driver != "asyncpg":
+            return False
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table, records=rows, columns=columns)
+        return True
+
+    @staticmethod
+    async def _insert_rows(db: AsyncSession, table, columns: List[str], rows: List[tuple]):
+        if await BulkService._copy_rows(db, table.name, columns, rows):
+            return
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            await db.execute(insert(table), [dict(zip(columns, row)) for row in chunk])
+
+    @staticmethod
+    async def _write_courses(db: AsyncSession, map_id: int, accepted: List[CourseImportRecord],
+                             existing: Dict[str, int]) -> List[int]:
+        """Insert validated rows whose parents and prerequisites are all in `existing`
+        or earlier in `accepted`; their ids are added to `existing`"""
+        ids = await BulkService._allocate_ids(db, len(accepted))
+        existing.update(zip((record.name for record in accepted), ids))
+        course_rows = [
+            (course_id, map_id, record.name, existing.get(record.parent_name))
+            for course_id, record in zip(ids, accepted)
+        ]
+        edge_rows = list(dict.fromkeys(
+            (course_id, existing[prerequisite], map_id)
+            for course_id, record in zip(ids, accepted)
+            for prerequisite in record.prerequisites
+        ))
+        await BulkService._insert_rows(db, Course.__table__, ["id", "map_id", "name", "parent_id"], course_rows)
+        await BulkService._insert_rows(db, course_prerequisite, ["course_id", "prerequisite_id", "map_id"], edge_rows)
+        if ClosureService.enabled:
+            await ClosureService.add_courses(db, ids)
+        return ids
+
+    @staticmethod
+    async def import_courses(
+        db: AsyncSession, map_id: int, records: Union[Iterable[ParsedLine], AsyncIterable[ParsedLine]]
+    ) -> CourseImportReport:
+        """Import the valid `records` in one transaction and report the invalid ones,
+        which are skipped. Records are written as they arrive, INSERT_CHUNK_SIZE at
+        a time; only those whose parent or prerequisites have not been seen yet are
+        held in memory until they are"""
+        if not isinstance(records, AsyncIterable):
+            records = BulkService._aiter(records)
+        existing = dict((await db.execute(
+            select(Course.name, Course.id).where(Course.map_id == map_id, Course.deleted_at.is_(None))
+        )).all())
+        imported: Set[str] = set()
+        errors: List[CourseImportError] = []
+        failed = 0
+        batch: List[ParsedLine] = []
+        arrived = 0
+
+        async def flush(final: bool) -> List[ParsedLine]:
+            nonlocal failed, errors
+            accepted, batch_errors, held = BulkService.validate(batch, existing, imported, final)
+            if accepted:
+                await BulkService._write_courses(db, map_id, accepted, existing)
+                imported.update(record.name for record in accepted)
+            failed += len(batch_errors)
+            errors = sorted(errors + batch_errors, key=lambda error: error.line)[:MAX_REPORTED_ERRORS]
+            return held
+
+        try:
+            async for item in records:
+                batch.append(item)
+                arrived += 1
+                # Held rows are validated again with every batch, so batches grow
+                # with them to keep that linear
+                if arrived >= max(INSERT_CHUNK_SIZE, len(batch) - arrived):
+                    batch = await flush(False)
+                    arrived = 0
+            await flush(True)
+            if not imported:
+                await db.rollback()
+                return CourseImportReport(imported=0, failed=failed, errors=errors)
+            version = await GraphService.record_changes(db, map_id, [])
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Import conflicts with a concurrent write; retry the import",
+            )
+        except Exception:
+            await db.rollback()
+            raise
+
+        GraphService.publish_reset(map_id, version)
+        return CourseImportReport(imported=len(imported), failed=failed, errors=errors, version=version)
+
+    @staticmethod
+    async def _aiter(records: Iterable[ParsedLine]) -> AsyncIterator[ParsedLine]:
+        for record in records:
+            yield record
+
+    @staticmethod
+    async def spool(chunks: AsyncIterator[bytes]) -> IO[bytes]:
+        """Copy an upload to a temporary file, in memory while it is small"""
+        spooled = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+        try:
+            async for chunk in chunks:
+                spooled.write(chunk)
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
+
+    @staticmethod
+    def submit_import(map_id: int, fmt: str, spooled: IO[bytes]) -> Job:
+        """Queue an import of a file spooled by `spool`, which the job closes; the
+        report becomes the job's result"""
+        async def chunks() -> AsyncIterator[bytes]:
+            while True:
+                chunk = spooled.read(EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+        async def run() -> CourseImportReport:
+            try:
+                async with AsyncSessionLocal() as db:
+                    return await BulkService.import_courses(db, map_id, BulkService.parse_stream(fmt, chunks()))
+            finally:
+                spooled.close()
+
+        try:
+            return job_queue.submit("import", run, summarize=lambda report: report.model_dump(), owner=map_id)
+        except HTTPException:
+            spooled.close()
+            raise
+
+    @staticmethod
+    async def export_courses(db: AsyncSession, map_id: int, fmt: str) -> AsyncIterator[str]:
+        prerequisite = aliased(Course)
+        edges = await db.execute(
+            select(course_prerequisite.c.course_id, prerequisite.name)
+            .join(prerequisite, prerequisite.id == course_prerequisite.c.prerequisite_id)
+            .where(course_prerequisite.c.map_id == map_id, prerequisite.deleted_at.is_(None))
+        )
+        prerequisites: Dict[int, List[str]] = {}
+        for course_id, name in edges:
+            prerequisites.setdefault(course_id, []).append(name)
+
+        parent = aliased(Course)
+        rows = await db.stream(
+            select(Course.id, Course.name, parent.name.label("parent_name"))
+            .outerjoin(parent, parent.id == Course.parent_id)
+            .where(Course.map_id == map_id, Course.deleted_at.is_(None))
+            .order_by(Course.id)
+            .execution_options(yield_per=INSERT_CHUNK_SIZE)
+        )
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if fmt == "csv":
+            writer.writerow(CSV_FIELDS)
+        async for row in rows:
+            course_prerequisites = prerequisites.get(row.id, [])
+            if fmt == "csv":
+                writer.writerow((
+                    row.name,
+                    row.parent_name or "",
+                    CSV_LIST_SEPARATOR.join(course_prerequisites),
+                ))
+            else:
+                buffer.write(orjson.dumps({
+                    "name": row.name,
+                    "parent_name": row.parent_name,
+                    "prerequisites": course_prerequisites,
+                }).decode())
+                buffer.write("\n")
+            if buffer.tell() > EXPORT_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
@@ -0,0 +1,260 @@
+import os
+from typing import Iterable, List, Optional
+from sqlalchemy import bindparam, delete, func, insert, literal, or_, select, text, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.core.db import AsyncSessionLocal
+from app.core.jobs import Job, job_queue
+from app.models.course import Course, course_closure
+
+# Maintain course_closure on writes and answer ancestor/descendant reads from it.
+# After enabling on a database written with it off, run `python -m app.cli rebuild-closure`.
+CLOSURE_ENABLED = os.getenv("GRAPH_CLOSURE_ENABLED", "false").lower() in ("1", "true", "yes", "on")
+RELATIONS = ("parent", "prerequisite")
+RECOMPUTE_CHUNK_SIZE = 5000
+# Guards recursive walks against cycles written before cycle checks existed
+MAX_WALK_DEPTH = 1000
+
+# Closure rows for the given descendants, derived from the base tables
+RECOMPUTE_QUERIES = {
+    "parent": """
+        INSERT INTO course_closure (relation, ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk(descendant_id, ancestor_id, depth) AS (
+            SELECT id, parent_id, 1 FROM course
+            WHERE parent_id IS NOT NULL {seed_filter}
+            UNION ALL
+            SELECT w.descendant_id, c.parent_id, w.depth + 1
+            FROM walk w INNER JOIN course c ON c.id = w.ancestor_id
+            WHERE c.parent_id IS NOT NULL AND w.depth < :max_depth
+        )
+        SELECT 'parent', ancestor_id, descendant_id, MIN(depth)
+        FROM walk GROUP BY ancestor_id, descendant_id
+    """,
+    "prerequisite": """
+        INSERT INTO course_closure (relation, ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk(descendant_id, ancestor_id, depth) AS (
+            SELECT course_id, prerequisite_id, 1 FROM course_prerequisite
+            WHERE 1 = 1 {seed_filter}
+            UNION
+            SELECT w.descendant_id, cp.prerequisite_id, w.depth + 1
+            FROM walk w INNER JOIN course_prerequisite cp ON cp.course_id = w.ancestor_id
+            WHERE w.depth < :max_depth
+        )
+        SELECT 'prerequisite', ancestor_id, descendant_id, MIN(depth)
+        FROM walk GROUP BY ancestor_id, descendant_id
+    """,
+}
+
+LIVE_SEEDS = {
+    "parent": "AND deleted_at IS NULL",
+    "prerequisite": "AND course_id IN (SELECT id FROM course WHERE deleted_at IS NULL)",
+}
+
+def _chunks(ids: List[int], size: int = RECOMPUTE_CHUNK_SIZE) -> Iterable[List[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+class ClosureService:
+    enabled = CLOSURE_ENABLED
+
+    @staticmethod
+    def _related(relation: str):
+        return course_closure.c.relation == relation
+
+    @staticmethod
+    async def add_course(db: AsyncSession, course_id: int, parent_id: Optional[int]):
+        await db.execute(insert(course_closure), [
+            {"relation": relation, "ancestor_id": course_id, "descendant_id": course_id, "depth": 0}
+            for relation in RELATIONS
+        ])
+        if parent_id is not None:
+            await db.execute(insert(course_closure).from_select(
+                ["relation", "ancestor_id", "descendant_id", "depth"],
+                select(
+                    literal("parent"),
+                    course_closure.c.ancestor_id,
+                    literal(course_id),
+                    course_closure.c.depth + 1,
+                ).where(ClosureService._related("parent"), course_closure.c.descendant_id == parent_id),
+            ))
+
+    @staticmethod
+    async def move_course(db: AsyncSession, course_id: int, parent_id: Optional[int]):
+        """Re-attach the subtree rooted at `course_id` under `parent_id`"""
+        subtree = (
+            select(course_closure.c.descendant_id)
+            .where(ClosureService._related("parent"), course_closure.c.ancestor_id == course_id)
+            .scalar_subquery()
+        )
+        await db.execute(
+            delete(course_closure).where(
+                ClosureService._related("parent"),
+                course_closure.c.descendant_id.in_(subtree),
+                course_closure.c.ancestor_id.not_in(subtree),
+            )
+        )
+        if parent_id is None:
+            return
+
+        above = aliased(course_closure)
+        below = aliased(course_closure)
+        await db.execute(insert(course_closure).from_select(
+            ["relation", "ancestor_id", "descendant_id", "depth"],
+            select(
+                literal("parent"),
+                above.c.ancestor_id,
+                below.c.descendant_id,
+                above.c.depth + below.c.depth + 1,
+            ).select_from(above.join(below, true())).where(
+                above.c.relation == "parent",
+                above.c.descendant_id == parent_id,
+                below.c.relation == "parent",
+                below.c.ancestor_id == course_id,
+            ),
+        ))
+
+    @staticmethod
+    async def remove_course(db: AsyncSession, course_id: int):
+        await ClosureService.remove_courses(db, [course_id])
+
+    @staticmethod
+    async def remove_courses(db: AsyncSession, course_ids: List[int]):
+        for chunk in _chunks(course_ids):
+            await db.execute(delete(course_closure).where(or_(
+                course_closure.c.ancestor_id.in_(chunk),
+                course_closure.c.descendant_id.in_(chunk),
+            )))
+
+    @staticmethod
+    async def descendants(db: AsyncSession, relation: str, course_ids: List[int]) -> List[int]:
+        """`course_ids` and every course below them, per the current closure rows"""
+        found = set()
+        for chunk in _chunks(course_ids):
+            result = await db.execute(
+                select(course_closure.c.descendant_id).where(
+                    ClosureService._related(relation),
+                    course_closure.c.ancestor_id.in_(chunk),
+                )
+            )
+            found.update(result.scalars())
+        return sorted(found)
+
+    @staticmethod
+    async def add_prerequisite(db: AsyncSession, course_id: int, prerequisite_id: int):
+        """Connect everything `prerequisite_id` requires to everything that requires `course_id`"""
+        above = aliased(course_closure)
+        below = aliased(course_closure)
+        rows = select(
+            literal("prerequisite"),
+            above.c.ancestor_id,
+            below.c.descendant_id,
+            above.c.depth + below.c.depth + 1,
+        ).select_from(above.join(below, true())).where(
+            above.c.relation == "prerequisite",
+            above.c.descendant_id == prerequisite_id,
+            below.c.relation == "prerequisite",
+            below.c.ancestor_id == course_id,
+        )
+
+        postgres = db.bind.dialect.name == "postgresql"
+        stmt = (pg_insert if postgres else sqlite_insert)(course_closure).from_select(
+            ["relation", "ancestor_id", "descendant_id", "depth"], rows
+        )
+        shortest = func.least if postgres else func.min
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["relation", "ancestor_id", "descendant_id"],
+            set_={"depth": shortest(course_closure.c.depth, stmt.excluded.depth)},
+        ))
+
+    @staticmethod
+    async def remove_prerequisite(db: AsyncSession, course_id: int, prerequisite_id: int):
+        # Shortest depths cannot be patched after an edge disappears, so recompute
+        # the closure of every course that required `course_id`
+        result = await db.execute(
+            select(course_closure.c.descendant_id).where(
+                ClosureService._related("prerequisite"),
+                course_closure.c.ancestor_id == course_id,
+            )
+        )
+        await ClosureService.recompute(db, "prerequisite", list(result.scalars()))
+
+    @staticmethod
+    async def recompute(db: AsyncSession, relation: str, course_ids: List[int]):
+        """Rebuild the non-self closure rows of `course_ids` from the base tables"""
+        column = "id" if relation == "parent" else "course_id"
+        query = RECOMPUTE_QUERIES[relation].format(seed_filter=f"AND {column} IN :ids")
+        statement = text(query).bindparams(bindparam("ids", expanding=True))
+        for chunk in _chunks(course_ids):
+            await db.execute(delete(course_closure).where(
+                ClosureService._related(relation),
+                course_closure.c.descendant_id.in_(chunk),
+                course_closure.c.depth > 0,
+            ))
+            await db.execute(statement, {"ids": chunk, "max_depth": MAX_WALK_DEPTH})
+
+    @staticmethod
+    async def add_courses(db: AsyncSession, course_ids: List[int]):
+        """Closure rows for freshly inserted courses, which nothing else can depend on yet"""
+        for chunk in _chunks(course_ids):
+            await db.execute(insert(course_closure), [
+                {"relation": relation, "ancestor_id": course_id, "descendant_id": course_id, "depth": 0}
+                for course_id in chunk
+                for relation in RELATIONS
+            ])
+        for relation in RELATIONS:
+            await ClosureService.recompute(db, relation, course_ids)
+
+    @staticmethod
+    async def rebuild(db: AsyncSession):
+        await db.execute(delete(course_closure))
+        for relation in RELATIONS:
+            await db.execute(insert(course_closure).from_select(
+                ["relation", "ancestor_id", "descendant_id", "depth"],
+                select(literal(relation), Course.id, Course.id, literal(0)).where(Course.deleted_at.is_(None)),
+            ))
+            # Walks from live courses only reach live ones, so seeding them is enough
+            await db.execute(
+                text(RECOMPUTE_QUERIES[relation].format(seed_filter=LIVE_SEEDS[relation])),
+                {"max_depth": MAX_WALK_DEPTH},
+            )
+
+    @staticmethod
+    def submit_rebuild() -> Job:
+        """Queue a rebuild of course_closure, or join the one already queued or running"""
+        async def run():
+            async with AsyncSessionLocal() as db:
+                await ClosureService.rebuild(db)
+                await db.commit()
+
+        return job_queue.submit("closure-rebuild", run, key=("closure-rebuild",))
+
+    @staticmethod
+    def related_query(map_id: int, relation: str, course_id: int, direction: str, max_depth: int):
+        """Courses above (`ancestors`) or below (`descendants`) a course of the map, nearest first"""
+        if direction == "ancestors":
+            anchor, reached = course_closure.c.descendant_id, course_closure.c.ancestor_id
+        else:
+            anchor, reached = course_closure.c.ancestor_id, course_closure.c.descendant_id
+        parent = aliased(Course)
+        return (
+            select(
+                Course.id,
+                Course.name,
+                Course.parent_id,
+                parent.name.label("parent_name"),
+                course_closure.c.depth,
+            )
+            .select_from(course_closure)
+            .join(Course, Course.id == reached)
+            .outerjoin(parent, parent.id == Course.parent_id)
+            .where(
+                ClosureService._related(relation),
+                Course.map_id == map_id,
+                anchor == course_id,
+                course_closure.c.depth > 0,
+                course_closure.c.depth <= max_depth,
+            )
+            .order_by(course_closure.c.depth, Course.id)
+        )
@@ -1,189 +1,436 @@
+import base64
+import binascii
+import json
 import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from app.models.course import Course
 from app.schemas.course import CourseCreate, Course as CourseSchema
+from app.schemas.graph import GraphNode
+from app.services.closure_service import MAX_WALK_DEPTH, ClosureService
+from app.services.graph_service import GraphService
+
+Parent = aliased(Course, name="parent")
+
+COURSE_FIELDS = ("id", "name", "parent_id", "parent_name")
+STREAM_BATCH_SIZE = 1000
+# Conditional updates that lose to a concurrent write without If-Match are retried
+MAX_WRITE_ATTEMPTS = 3
+
+# Creates and updates are one statement each: the unique index on (map_id, name)
+# replaces a duplicate check, and the parent is resolved by name inside the statement
+CREATE_QUERY = """
+    INSERT INTO course (map_id, name, parent_id)
+    {values}
+    ON CONFLICT (map_id, name) WHERE deleted_at IS NULL DO NOTHING
+    RETURNING id, name, parent_id, version
+"""
+CREATE_VALUES = "VALUES (:map_id, :name, NULL)"
+CREATE_WITH_PARENT = """
+    SELECT :map_id, :name, id FROM course
+    WHERE map_id = :map_id AND name = :parent_name AND deleted_at IS NULL
+"""
+
+UPDATE_QUERY = """
+    {ancestors}
+    UPDATE course SET
+        name = :name,
+        parent_id = {parent_id},
+        version = course.version + 1
+    {old_row}
+    WHERE course.id = :course_id AND course.map_id = :map_id AND course.deleted_at IS NULL {conditions}
+    RETURNING course.id, course.name, course.parent_id, course.version{old_columns}
+"""
+# Refuses parents that are the course itself or one of its descendants
+UPDATE_PARENT_ANCESTORS = """
+    WITH RECURSIVE new_ancestors(id) AS (
+        SELECT id FROM course WHERE map_id = :map_id AND name = :parent_name AND deleted_at IS NULL
+        UNION
+        SELECT c.parent_id FROM course c
+        INNER JOIN new_ancestors a ON c.id = a.id
+        WHERE c.parent_id IS NOT NULL
+    )
+"""
+UPDATE_PARENT_CONDITIONS = """
+    AND EXISTS (SELECT 1 FROM course WHERE map_id = :map_id AND name = :parent_name AND deleted_at IS NULL)
+    AND NOT EXISTS (SELECT 1 FROM new_ancestors WHERE id = :course_id)
+"""
+UPDATE_PARENT_ID = "(SELECT id FROM course WHERE map_id = :map_id AND name = :parent_name AND deleted_at IS NULL)"
+# Postgres evaluates a self-join in UPDATE ... FROM against the statement's
+# snapshot, so RETURNING can report the row as it was before the update
+UPDATE_OLD_ROW = "FROM course AS old"
+UPDATE_OLD_CONDITIONS = "AND old.id = course.id AND old.version = course.version"
+UPDATE_OLD_COLUMNS = ", old.name AS old_name, old.parent_id AS old_parent_id"
 
 class CourseService:
     @staticmethod
-    async def _get_course_dict(course, parent=None):
-        """Helper method to convert Course model to dict with parent name"""
+    def _course_query(map_id: int):
+        """Select the map's course columns with the parent name resolved through a self-join"""
+        return select(
+            Course.id,
+            Course.name,
+            Course.parent_id,
+            Parent.name.label("parent_name"),
+            Course.version,
+        ).outerjoin(Parent, Parent.id == Course.parent_id).where(
+            Course.map_id == map_id, Course.deleted_at.is_(None)
+        )
+
+    @staticmethod
+    def _to_schema(row):
+        return CourseSchema(
+            id=row.id,
+            name=row.name,
+            parent_id=row.parent_id,
+            parent_name=row.parent_name,
+            version=row.version,
+        )
+
+    @staticmethod
+    def _to_dict(row) -> Dict:
+        """A course row as the plain dict list endpoints serialize directly, skipping
+        a Pydantic model per row"""
         return {
-            "id": course.id,
-            "name": course.name,
-            "parent_id": course.parent_id,
-            "parent_name": parent.name if parent else None
+            "id": row.id,
+            "name": row.name,
+            "parent_id": row.parent_id,
+            "parent_name": row.parent_name,
         }
 
     @staticmethod
-    async def get_course(db: AsyncSession, course_id: int):
-        query = select(Course).where(Course.id == course_id)
+    def _to_node(course):
+        return GraphNode(id=course.id, name=course.name, parent_id=course.parent_id, version=course.version)
+
+    @staticmethod
+    async def get_course(db: AsyncSession, map_id: int, course_id: int):
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            course = cache.course(course_id)
+            return CourseSchema(**course, version=cache.versions.get(course_id)) if course else None
+
+        query = CourseService._course_query(map_id).where(Course.id == course_id)
         result = await db.execute(query)
-        course = result.scalar_one_or_none()
-        
-        if not course:
-            return None
+        row = result.one_or_none()
 
-        parent = None
-        if course.parent_id:
-            parent_query = select(Course).where(Course.id == course.parent_id)
-            parent_result = await db.execute(parent_query)
-            parent = parent_result.scalar_one_or_none()
+        if not row:
+            return None
 
-        course_dict = await CourseService._get_course_dict(course, parent)
-        return CourseSchema(**course_dict)
+        return CourseService._to_schema(row)
 
     @staticmethod
-    async def get_courses(db: AsyncSession, skip: int = 0, limit: int = 100):
+    async def get_courses(db: AsyncSession, map_id: int, skip: int = 0, limit: int = 100) -> List[Dict]:
         try:
-            query = select(Course).offset(skip).limit(limit)
+            cache = await GraphService.get_cache(db, map_id)
+            if cache is not None:
+                return cache.page(skip, limit)
+
+            query = (
+                CourseService._course_query(map_id)
+                .order_by(Course.id)
+                .offset(skip)
+                .limit(limit)
+            )
             result = await db.execute(query)
-            courses = result.scalars().all()
-            
-            course_list = []
-            for course in courses:
-                parent = None
-                if course.parent_id:
-                    parent_query = select(Course).where(Course.id == course.parent_id)
-                    parent_result = await db.execute(parent_query)
-                    parent = parent_result.scalar_one_or_none()
-                
-                course_dict = await CourseService._get_course_dict(course, parent)
-                course_list.append(CourseSchema(**course_dict))
-            
-            return course_list
+            return [CourseService._to_dict(row) for row in result]
         except Exception as e:
             logging.error(f"Error fetching courses: {str(e)}")
             raise
 
     @staticmethod
-    async def create_course(db: AsyncSession, course: CourseCreate):
+    def encode_cursor(last_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> int:
+        if not cursor:
+            return 0
         try:
-            existing_course = await db.execute(
-                select(Course).where(Course.name == course.name)
+            padded = cursor + "=" * (-len(cursor) % 4)
+            after = json.loads(base64.urlsafe_b64decode(padded))["after"]
+            if isinstance(after, int):
+                return after
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            pass
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    @staticmethod
+    def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+        if not fields:
+            return COURSE_FIELDS
+        requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+        unknown = [field for field in requested if field not in COURSE_FIELDS]
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields {', '.join(unknown)}; expected any of {', '.join(COURSE_FIELDS)}",
             )
-            if existing_course.scalar_one_or_none():
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Course with name '{course.name}' already exists"
-                )
+        return requested
 
-            course_data = {"name": course.name}
+    @staticmethod
+    def _projected_query(map_id: int, fields: Tuple[str, ...]):
+        columns = {
+            "name": Course.name,
+            "parent_id": Course.parent_id,
+            "parent_name": Parent.name.label("parent_name"),
+        }
+        query = select(Course.id, *(columns[field] for field in fields if field != "id")).where(
+            Course.map_id == map_id, Course.deleted_at.is_(None)
+        )
+        if "parent_name" in fields:
+            query = query.outerjoin(Parent, Parent.id == Course.parent_id)
+        return query
 
-            if course.parent_name:
-                parent_course = await db.execute(
-                    select(Course).where(Course.name == course.parent_name)
-                )
-                parent = parent_course.scalar_one_or_none()
-                if not parent:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Parent course '{course.parent_name}' not found"
-                    )
-                course_data["parent_id"] = parent.id
+    @staticmethod
+    async def iter_courses(
+        db: AsyncSession, map_id: int, after_id: int, limit: int, fields: Tuple[str, ...] = COURSE_FIELDS
+    ) -> AsyncIterator[Tuple[int, Dict]]:
+        """Yield (id, projected course) for the map's courses after `after_id` in id order"""
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            for course_id in cache.ids_after(after_id, limit):
+                course = cache.course(course_id)
+                yield course_id, {field: course[field] for field in fields}
+            return
 
-            db_course = Course(**course_data)
-            db.add(db_course)
-            await db.commit()
-            await db.refresh(db_course)
+        query = (
+            CourseService._projected_query(map_id, fields)
+            .where(Course.id > after_id)
+            .order_by(Course.id)
+            .limit(limit)
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        result = await db.stream(query)
+        async for row in result:
+            mapping = row._mapping
+            yield row.id, {field: mapping[field] for field in fields}
 
-            return await CourseService.get_course(db, db_course.id)
-        except Exception as e:
-            await db.rollback()
-            raise e
+    @staticmethod
+    async def get_course_page(
+        db: AsyncSession, map_id: int, after_id: int, limit: int, fields: Tuple[str, ...] = COURSE_FIELDS
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """One keyset page of projected courses and the cursor of the next page, if any"""
+        courses = []
+        last_id = None
+        async for last_id, course in CourseService.iter_courses(db, map_id, after_id, limit, fields):
+            courses.append(course)
+        next_cursor = CourseService.encode_cursor(last_id) if len(courses) == limit else None
+        return courses, next_cursor
 
     @staticmethod
-    async def update_course(db: AsyncSession, course_id: int, course: CourseCreate):
-        db_course = await db.execute(select(Course).where(Course.id == course_id))
-        db_course = db_course.scalar_one_or_none()
-        
-        if not db_course:
-            return None
+    def _written(row, parent_name: Optional[str]) -> CourseSchema:
+        return CourseSchema(
+            id=row.id,
+            name=row.name,
+            parent_id=row.parent_id,
+            parent_name=parent_name if row.parent_id is not None else None,
+            version=row.version,
+        )
+
+    @staticmethod
+    def _name_taken(name: str):
+        return HTTPException(status_code=409, detail=f"Course with name '{name}' already exists")
 
-        if course.name != db_course.name:
-            existing_course = await db.execute(
-                select(Course).where(Course.name == course.name)
+    @staticmethod
+    def _parent_missing(parent_name: str):
+        return HTTPException(status_code=404, detail=f"Parent course '{parent_name}' not found")
+
+    @staticmethod
+    async def create_course(db: AsyncSession, map_id: int, course: CourseCreate):
+        try:
+            query = text(CREATE_QUERY.format(
+                values=CREATE_WITH_PARENT if course.parent_name else CREATE_VALUES
+            ))
+            result = await db.execute(
+                query, {"map_id": map_id, "name": course.name, "parent_name": course.parent_name}
             )
-            if existing_course.scalar_one_or_none():
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Course with name '{course.name}' already exists"
+            row = result.one_or_none()
+            if row is None:
+                # Nothing was inserted: either the name is taken or the parent is missing
+                taken = await db.execute(
+                    select(Course.id).where(
+                        Course.map_id == map_id, Course.name == course.name, Course.deleted_at.is_(None)
+                    )
                 )
+                if taken.first() is not None:
+                    raise CourseService._name_taken(course.name)
+                raise CourseService._parent_missing(course.parent_name)
 
-        db_course.name = course.name
+            if ClosureService.enabled:
+                await ClosureService.add_course(db, row.id, row.parent_id)
+            changes = GraphService.course_changes(
+                None, GraphNode(id=row.id, name=row.name, parent_id=row.parent_id, version=row.version)
+            )
+            version = await GraphService.record_changes(db, map_id, changes)
+            await db.commit()
+            GraphService.publish_changes(map_id, version, changes)
+            return CourseService._written(row, course.parent_name)
+        except Exception as e:
+            await db.rollback()
+            raise e
 
+    @staticmethod
+    async def _update_failure(
+        db: AsyncSession, map_id: int, course_id: int, course: CourseCreate, expected_version: Optional[int]
+    ) -> bool:
+        """Why a conditional update matched no row: False when the course does not
+        exist, True when it lost a race and can be retried, otherwise raises"""
+        result = await db.execute(
+            select(Course.version).where(
+                Course.id == course_id, Course.map_id == map_id, Course.deleted_at.is_(None)
+            )
+        )
+        current_version = result.scalar_one_or_none()
+        if current_version is None:
+            return False
+        if expected_version is not None and current_version != expected_version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Course {course_id} is at version {current_version}, not {expected_version}",
+            )
         if course.parent_name:
-            parent_course = await db.execute(
-                select(Course).where(Course.name == course.parent_name)
+            result = await db.execute(
+                select(Course.id).where(
+                    Course.map_id == map_id, Course.name == course.parent_name, Course.deleted_at.is_(None)
+                )
             )
-            parent = parent_course.scalar_one_or_none()
-            if not parent:
+            parent_id = result.scalar_one_or_none()
+            if parent_id is None:
+                raise CourseService._parent_missing(course.parent_name)
+            if parent_id == course_id or any(
+                ancestor["id"] == course_id
+                for ancestor in await CourseService.get_course_dependencies(db, map_id, parent_id)
+            ):
                 raise HTTPException(
-                    status_code=404,
-                    detail=f"Parent course '{course.parent_name}' not found"
+                    status_code=400,
+                    detail=f"Making '{course.parent_name}' the parent of '{course.name}' would create a cycle"
                 )
-            db_course.parent_id = parent.id
+        return True
+
+    @staticmethod
+    async def _update_row(
+        db: AsyncSession, map_id: int, course_id: int, course: CourseCreate, expected_version: Optional[int]
+    ) -> Optional[tuple]:
+        """Apply the update in one conditional statement. Returns the updated row
+        with the course's previous name and parent, or None if no row matched"""
+        postgres = db.bind.dialect.name == "postgresql"
+        conditions = [UPDATE_PARENT_CONDITIONS] if course.parent_name else []
+        params = {"map_id": map_id, "course_id": course_id, "name": course.name, "parent_name": course.parent_name}
+        old = None
+        if postgres:
+            conditions.append(UPDATE_OLD_CONDITIONS)
+            if expected_version is not None:
+                conditions.append("AND course.version = :expected_version")
+                params["expected_version"] = expected_version
         else:
-            db_course.parent_id = None
+            # Elsewhere RETURNING only sees the new row, so read the old one first
+            # and make the update conditional on it still being current
+            result = await db.execute(
+                select(Course.name, Course.parent_id, Course.version)
+                .where(Course.id == course_id, Course.map_id == map_id, Course.deleted_at.is_(None))
+            )
+            old = result.one_or_none()
+            if old is None or expected_version not in (None, old.version):
+                return None
+            conditions.append("AND course.version = :expected_version")
+            params["expected_version"] = old.version
 
-        await db.commit()
-        await db.refresh(db_course)
-        
-        return await CourseService.get_course(db, db_course.id)
+        query = text(UPDATE_QUERY.format(
+            ancestors=UPDATE_PARENT_ANCESTORS if course.parent_name else "",
+            parent_id=UPDATE_PARENT_ID if course.parent_name else "NULL",
+            old_row=UPDATE_OLD_ROW if postgres else "",
+            conditions=" ".join(conditions),
+            old_columns=UPDATE_OLD_COLUMNS if postgres else "",
+        ))
+        row = (await db.execute(query, params)).one_or_none()
+        if row is None:
+            return None
+        if old is None:
+            return row, row.old_name, row.old_parent_id
+        return row, old.name, old.parent_id
 
     @staticmethod
-    async def delete_course(db: AsyncSession, course_id: int):
-        course = await CourseService.get_course(db, course_id)
-        if course:
-            db_course = await db.execute(select(Course).where(Course.id == course_id))
-            db_course = db_course.scalar_one_or_none()
-            await db.delete(db_course)
+    async def update_course(
+        db: AsyncSession, map_id: int, course_id: int, course: CourseCreate, expected_version: Optional[int] = None
+    ):
+        """Rename or move a course; with `expected_version` (from If-Match) the update
+        only applies while the course is still at that version, otherwise 409"""
+        try:
+            for _ in range(MAX_WRITE_ATTEMPTS):
+                try:
+                    written = await CourseService._update_row(db, map_id, course_id, course, expected_version)
+                except IntegrityError:
+                    raise CourseService._name_taken(course.name)
+                if written is not None:
+                    break
+                if not await CourseService._update_failure(db, map_id, course_id, course, expected_version):
+                    return None
+            else:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Course {course_id} is being changed concurrently; retry the update",
+                )
+
+            row, old_name, old_parent_id = written
+            if ClosureService.enabled and row.parent_id != old_parent_id:
+                await ClosureService.move_course(db, course_id, row.parent_id)
+            changes = GraphService.course_changes(
+                GraphNode(id=course_id, name=old_name, parent_id=old_parent_id, version=row.version - 1),
+                GraphNode(id=row.id, name=row.name, parent_id=row.parent_id, version=row.version),
+            )
+            version = await GraphService.record_changes(db, map_id, changes)
             await db.commit()
-        return course
+        except Exception:
+            await db.rollback()
+            raise
+
+        GraphService.publish_changes(map_id, version, changes)
+        return CourseService._written(row, course.parent_name)
 
     @staticmethod
-    async def get_course_dependencies(db: AsyncSession, course_id: int):
+    async def get_course_dependencies(db: AsyncSession, map_id: int, course_id: int) -> List[Dict]:
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            return cache.ancestors_of(course_id)
+
+        if ClosureService.enabled:
+            result = await db.execute(
+                ClosureService.related_query(map_id, "parent", course_id, "ancestors", MAX_WALK_DEPTH)
+            )
+            return [CourseService._to_dict(row) for row in result]
+
         query = text("""
             WITH RECURSIVE course_dependencies AS (
-                SELECT id, name, parent_id
+                SELECT id, name, parent_id, 0 AS depth
                 FROM course
-                WHERE id = :course_id
+                WHERE id = :course_id AND map_id = :map_id AND deleted_at IS NULL
                 UNION ALL
-                SELECT c.id, c.name, c.parent_id
+                SELECT c.id, c.name, c.parent_id, cd.depth + 1
                 FROM course c
                 INNER JOIN course_dependencies cd ON c.id = cd.parent_id
             )
-            SELECT * FROM course_dependencies
-            WHERE id != :course_id;
+            SELECT cd.id, cd.name, cd.parent_id, p.name AS parent_name
+            FROM course_dependencies cd
+            LEFT JOIN course p ON p.id = cd.parent_id
+            WHERE cd.id != :course_id
+            ORDER BY cd.depth;
         """)
-        result = await db.execute(query, {"course_id": course_id})
-        dependencies = result.fetchall()
-        
-        course_list = []
-        for dep in dependencies:
-            course_dict = {
-                "id": dep.id,
-                "name": dep.name,
-                "parent_id": dep.parent_id,
-                "parent_name": None
-            }
-            course_list.append(CourseSchema(**course_dict))
-        return course_list
-
-    @staticmethod
-    async def get_courses_by_parent_id(db: AsyncSession, parent_id: int):
-        query = select(Course).where(Course.parent_id == parent_id)
+        result = await db.execute(query, {"map_id": map_id, "course_id": course_id})
+        return [CourseService._to_dict(row) for row in result]
+
+    @staticmethod
+    async def get_courses_by_parent_id(db: AsyncSession, map_id: int, parent_id: int) -> List[Dict]:
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            return cache.children_of(parent_id)
+
+        query = (
+            CourseService._course_query(map_id)
+            .where(Course.parent_id == parent_id)
+            .order_by(Course.id)
+        )
         result = await db.execute(query)
-        courses = result.scalars().all()
-        
-        course_list = []
-        for course in courses:
-            parent_query = select(Course).where(Course.id == parent_id)
-            parent_result = await db.execute(parent_query)
-            parent = parent_result.scalar_one_or_none()
-            
-            course_dict = await CourseService._get_course_dict(course, parent)
-            course_list.append(CourseSchema(**course_dict))
-            
-        return course_list
\ No newline at end of file
+        return [CourseService._to_dict(row) for row in result]
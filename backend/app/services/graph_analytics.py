@@ -0,0 +1,270 @@
+import os
+import time
+from typing import List, Optional, Tuple
+import numpy as np
+from app.services.graph_layout import _ranges
+
+# Transitive dependents are counted exactly with one bitset row per course up to
+# this many courses, and estimated from min-rank sketches above it
+GRAPH_ANALYTICS_EXACT_MAX_NODES = int(os.getenv("GRAPH_ANALYTICS_EXACT_MAX_NODES", "8192"))
+# Bitset words gathered at once along the edges of one level in exact counting
+EXACT_MAX_WORDS = 1 << 23
+# Ranks per course in the reachability sketch; relative error is about 1/sqrt(k - 2)
+REACH_SKETCH_SIZE = 16
+# Frontiers smaller than this are peeled in Python, where a level costs
+# microseconds instead of a dozen NumPy calls
+NARROW_FRONTIER = 64
+CRITICAL_PATH_LIMIT = 1000
+LARGEST_COMPONENTS = 10
+ORPHAN_SAMPLE = 100
+
+def _csr(n: int, src: np.ndarray, dst: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Row offsets and targets of the edges src -> dst, grouped by source"""
+    targets = dst[np.argsort(src)]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, targets
+
+def _narrow_levels(csr_lists, remaining: np.ndarray, frontier: List[int], depth: int):
+    """Kahn's algorithm in Python while the frontier stays narrow. Decrements are
+    kept in a dict and written back at the end, so the cost follows the edges
+    walked rather than the size of the graph."""
+    indptr, targets = csr_lists
+    decremented = {}
+    placed, depths = [], []
+    while frontier and len(frontier) < NARROW_FRONTIER:
+        placed.extend(frontier)
+        depths.extend([depth] * len(frontier))
+        reached = []
+        for node in frontier:
+            for target in targets[indptr[node]:indptr[node + 1]]:
+                left = decremented.get(target)
+                if left is None:
+                    left = int(remaining[target])
+                left -= 1
+                decremented[target] = left
+                if left == 0:
+                    reached.append(target)
+        frontier = reached
+        depth += 1
+    if decremented:
+        remaining[np.fromiter(decremented.keys(), dtype=np.int64, count=len(decremented))] = list(decremented.values())
+    return placed, depths, np.array(frontier, dtype=np.int64), depth
+
+def topological_levels(indptr: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Length of the longest edge path into each node, or -1 for nodes on or
+    behind a cycle, and the placed nodes in level order. Linear in nodes plus
+    edges: a wide frontier is peeled with NumPy, a narrow one in Python."""
+    n = indptr.size - 1
+    level = np.full(n, -1, dtype=np.int64)
+    remaining = np.bincount(targets, minlength=n)
+    frontier = np.flatnonzero(remaining == 0)
+    order = []
+    depth = 0
+    csr_lists = None
+    while frontier.size:
+        if frontier.size < NARROW_FRONTIER:
+            if csr_lists is None:
+                csr_lists = indptr.tolist(), targets.tolist()
+            placed, depths, frontier, depth = _narrow_levels(csr_lists, remaining, frontier.tolist(), depth)
+            level[placed] = depths
+            order.append(np.array(placed, dtype=np.int64))
+            continue
+        level[frontier] = depth
+        order.append(frontier)
+        reached, counts = np.unique(
+            targets[_ranges(indptr[frontier], indptr[frontier + 1])], return_counts=True
+        )
+        remaining[reached] -= counts
+        frontier = reached[remaining[reached] == 0]
+        depth += 1
+    return level, np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+
+def _critical_path(level: np.ndarray, src: np.ndarray, dst: np.ndarray) -> List[int]:
+    """Node indices along one longest prerequisite chain, first course first"""
+    if level.size == 0 or level.max() < 0:
+        return []
+    # The lowest-index prerequisite one level up, so ties break the same way
+    # whatever order the edges were loaded in
+    n = level.size
+    predecessor = np.full(n, n, dtype=np.int64)
+    tight = (level[dst] >= 0) & (level[src] == level[dst] - 1)
+    np.minimum.at(predecessor, dst[tight], src[tight])
+    path = [int(np.argmax(level))]
+    while predecessor[path[-1]] < n:
+        path.append(int(predecessor[path[-1]]))
+    path.reverse()
+    return path
+
+def _components(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Weakly connected component label (smallest member index) of each node,
+    by hooking roots onto smaller neighbouring roots and pointer jumping"""
+    label = np.arange(n, dtype=np.int64)
+    while src.size:
+        low = np.minimum(label[src], label[dst])
+        hooked = label.copy()
+        np.minimum.at(hooked, label[src], low)
+        np.minimum.at(hooked, label[dst], low)
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, label):
+            break
+        label = hooked
+        # Edges inside one component can never hook again
+        crossing = label[src] != label[dst]
+        src, dst = src[crossing], dst[crossing]
+    return label
+
+def _propagate(sets: np.ndarray, reduce, level: np.ndarray, order: np.ndarray, indptr: np.ndarray, targets: np.ndarray):
+    """Fold each node's dependents' sets into its own, deepest level first, so
+    every course ends up with the set of everything it leads to"""
+    bounds = np.searchsorted(level[order], np.arange(int(level.max(initial=-1)) + 2))
+    narrow = (np.diff(bounds) < NARROW_FRONTIER).tolist()
+    bounds = bounds.tolist()
+    csr_lists = None
+    for depth in range(len(bounds) - 2, -1, -1):
+        if narrow[depth]:
+            if csr_lists is None:
+                csr_lists = order.tolist(), indptr.tolist()
+            ordered, offsets = csr_lists
+            for node in ordered[bounds[depth]:bounds[depth + 1]]:
+                start, end = offsets[node], offsets[node + 1]
+                if end - start == 1:
+                    reduce(sets[node], sets[targets[start]], out=sets[node])
+                elif end > start:
+                    reduce(sets[node], reduce.reduce(sets[targets[start:end]], axis=0), out=sets[node])
+            continue
+        nodes = order[bounds[depth]:bounds[depth + 1]]
+        nodes = nodes[indptr[nodes + 1] > indptr[nodes]]
+        if not nodes.size:
+            continue
+        starts, ends = indptr[nodes], indptr[nodes + 1]
+        gathered = sets[targets[_ranges(starts, ends)]]
+        offsets = np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+        sets[nodes] = reduce(sets[nodes], reduce.reduceat(gathered, offsets, axis=0))
+
+def transitive_dependents(level: np.ndarray, order: np.ndarray, indptr: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, bool]:
+    """Number of courses that need each course directly or indirectly, and
+    whether the counts are exact"""
+    n = level.size
+    words = (n + 63) // 64
+    if n <= GRAPH_ANALYTICS_EXACT_MAX_NODES and targets.size * words <= EXACT_MAX_WORDS:
+        nodes = np.arange(n)
+        sets = np.zeros((n, words), dtype=np.uint64)
+        sets[nodes, nodes // 64] = np.left_shift(np.uint64(1), (nodes % 64).astype(np.uint64))
+        _propagate(sets, np.bitwise_or, level, order, indptr, targets)
+        # numpy < 2 has no bitwise_count
+        reach = np.unpackbits(sets.view(np.uint8), axis=1).sum(axis=1, dtype=np.int64)
+        return reach - 1, True
+
+    # Each course draws k exponential ranks; the minimum over a set of size s is
+    # Exp(s), so (k - 1) / sum of the k minima estimates s without bias
+    ranks = np.random.default_rng(0).standard_exponential((n, REACH_SKETCH_SIZE), dtype=np.float32)
+    _propagate(ranks, np.minimum, level, order, indptr, targets)
+    reach = (REACH_SKETCH_SIZE - 1) / ranks.sum(axis=1, dtype=np.float64)
+    estimate = np.rint(np.maximum(reach - 1, 0)).astype(np.int64)
+    # The dependents a course is known to have bound the estimate from below
+    return np.maximum(estimate, np.diff(indptr)), False
+
+class GraphAnalytics:
+    """Whole-graph metrics for one graph version, over array-backed (CSR) adjacency.
+
+    Pure computation: GraphService loads the graph and caches the result per version.
+    Courses are addressed by their index in sorted id order.
+    """
+
+    def __init__(self, version: int, ids, parent_ids, course_ids, prerequisite_ids):
+        started = time.perf_counter()
+        self.version = version
+        ids = np.asarray(ids, dtype=np.int64)
+        by_id = np.argsort(ids)
+        self.ids = ids[by_id]
+        n = self.ids.size
+        # Serial ids are dense enough for a direct lookup table, which is much
+        # faster than binary searching every edge endpoint
+        self._lookup = None
+        if n and self.ids[0] >= 0 and self.ids[-1] < 4 * n + 1024:
+            self._lookup = np.full(int(self.ids[-1]) + 1, -1, dtype=np.int64)
+            self._lookup[self.ids] = np.arange(n)
+
+        # Parent ids come aligned with `ids`, -1 for top-level courses
+        parent_src = self._index(np.asarray(parent_ids, dtype=np.int64)[by_id])
+        parent_dst = np.flatnonzero(parent_src >= 0)
+        parent_src = parent_src[parent_dst]
+        prerequisite = self._index(np.asarray(prerequisite_ids, dtype=np.int64))
+        dependent = self._index(np.asarray(course_ids, dtype=np.int64))
+        known = (prerequisite >= 0) & (dependent >= 0) & (prerequisite != dependent)
+        src, dst = prerequisite[known], dependent[known]
+        self.parent_edges = int(parent_src.size)
+        self.prerequisite_edges = int(src.size)
+
+        indptr, targets = _csr(n, src, dst)
+        self.level, order = topological_levels(indptr, targets)
+        self.critical_path = _critical_path(self.level, src, dst)
+        self.parent_level, _ = topological_levels(*_csr(n, parent_src, parent_dst))
+
+        self.dependents = np.diff(indptr)
+        self.prerequisites = np.bincount(dst, minlength=n)
+        degree = (
+            self.dependents + self.prerequisites
+            + np.bincount(parent_src, minlength=n) + np.bincount(parent_dst, minlength=n)
+        )
+        self.orphans = np.flatnonzero(degree == 0)
+
+        label = _components(n, np.concatenate((src, parent_src)), np.concatenate((dst, parent_dst)))
+        self.component_sizes = np.sort(np.bincount(label, minlength=n))[::-1]
+        self.component_sizes = self.component_sizes[self.component_sizes > 0]
+
+        self.transitive, self.exact = transitive_dependents(self.level, order, indptr, targets)
+        self.compute_ms = (time.perf_counter() - started) * 1000
+
+    def _index(self, course_ids: np.ndarray) -> np.ndarray:
+        """Positions of `course_ids` among the sorted ids, -1 where absent"""
+        if not self.ids.size:
+            return np.full(course_ids.shape, -1, dtype=np.int64)
+        if self._lookup is not None:
+            inside = (course_ids >= 0) & (course_ids < self._lookup.size)
+            return np.where(inside, self._lookup[np.where(inside, course_ids, 0)], -1)
+        position = np.minimum(np.searchsorted(self.ids, course_ids), self.ids.size - 1)
+        return np.where(self.ids[position] == course_ids, position, -1)
+
+    def most_depended_on(self, top: int) -> List[Tuple[int, int, int]]:
+        """(id, transitive dependents, direct dependents) of the `top` courses most others build on"""
+        order = np.lexsort((self.ids, -self.dependents, -self.transitive))[:top]
+        return [
+            (int(self.ids[i]), int(self.transitive[i]), int(self.dependents[i]))
+            for i in order
+        ]
+
+    def stats(self, top: int, names: Optional[dict] = None) -> dict:
+        """GraphStats-shaped dict; `names` maps the ids of the top courses to their names"""
+        n = self.ids.size
+        placed = self.level[self.level >= 0]
+        names = names or {}
+        return {
+            "version": self.version,
+            "courses": n,
+            "parent_edges": self.parent_edges,
+            "prerequisite_edges": self.prerequisite_edges,
+            "max_prerequisite_depth": int(placed.max(initial=0)),
+            "mean_prerequisite_depth": round(float(placed.mean()), 3) if placed.size else 0.0,
+            "max_parent_depth": int(self.parent_level.max(initial=0)),
+            "critical_path_length": len(self.critical_path),
+            "critical_path": self.ids[self.critical_path[:CRITICAL_PATH_LIMIT]].tolist(),
+            "roots": int(np.count_nonzero(self.prerequisites == 0)),
+            "leaves": int(np.count_nonzero(self.dependents == 0)),
+            "orphans": int(self.orphans.size),
+            "orphan_ids": self.ids[self.orphans[:ORPHAN_SAMPLE]].tolist(),
+            "components": int(self.component_sizes.size),
+            "largest_components": self.component_sizes[:LARGEST_COMPONENTS].tolist(),
+            "cyclic_courses": int(n - placed.size),
+            "transitive_dependents_exact": self.exact,
+            "most_depended_on": [
+                {"id": course_id, "name": names.get(course_id, ""), "dependents": transitive, "direct_dependents": direct}
+                for course_id, transitive, direct in self.most_depended_on(top)
+            ],
+            "compute_ms": round(self.compute_ms, 1),
+        }
@@ -0,0 +1,328 @@
+import bisect
+import os
+from typing import Dict, List, Optional, Set, Tuple
+from app.schemas.graph import GraphEdge, GraphNode, GraphSnapshot
+from app.services.search_index import SearchIndex
+
+# Seconds a worker trusts its cached graph before re-checking the shared version
+GRAPH_CACHE_TTL = float(os.getenv("GRAPH_CACHE_TTL", "1.0"))
+# Graphs larger than this are not cached; reads then go to the database
+GRAPH_CACHE_MAX_NODES = int(os.getenv("GRAPH_CACHE_MAX_NODES", "200000"))
+
+class GraphCache:
+    """In-memory adjacency view of the course graph at one graph version.
+
+    Pure data structure: GraphService decides when to load, refresh or patch it.
+    """
+
+    def __init__(self, max_nodes: int = GRAPH_CACHE_MAX_NODES, ttl: float = GRAPH_CACHE_TTL):
+        self.max_nodes = max_nodes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.checked_at = 0.0
+        self.disabled = False
+        # Graph version that was too large to cache, so it is re-counted only once the graph changes
+        self.disabled_version: Optional[int] = None
+        # Bumped by every clear, so a search index built meanwhile is not installed
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        self.version: Optional[int] = None
+        self.nodes: Dict[int, Tuple[str, Optional[int]]] = {}
+        self.children: Dict[int, Set[int]] = {}
+        self.prerequisites: Dict[int, Set[int]] = {}
+        self.dependents: Dict[int, Set[int]] = {}
+        # Row versions of the courses, where the snapshot or change carried one
+        self.versions: Dict[int, int] = {}
+        self._sorted_ids: Optional[List[int]] = None
+        # Built off the event loop once the cache is loaded, then patched along with the nodes
+        self._search: Optional[SearchIndex] = None
+        # Courses changed while the index is being built, replayed onto it when it is installed
+        self._search_pending: Optional[Set[int]] = None
+        self.generation += 1
+
+    def disable(self, version: Optional[int] = None):
+        """Stop caching an oversized graph, at `version`, until the next load"""
+        self.clear()
+        self.disabled = True
+        self.disabled_version = version
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    def load(self, snapshot: GraphSnapshot) -> bool:
+        self.clear()
+        self.disabled = False
+        self.reloads += 1
+        if len(snapshot.nodes) > self.max_nodes:
+            self.disable(snapshot.version)
+            return False
+        for node in snapshot.nodes:
+            self._upsert_node(node)
+        for edge in snapshot.edges:
+            if edge.type == "prerequisite":
+                self._add_prerequisite(edge)
+        self.version = snapshot.version
+        return True
+
+    def dump(self) -> dict:
+        """The cached graph as plain lists, which `restore` loads far faster than a snapshot"""
+        return {
+            "version": self.version,
+            "nodes": [
+                [course_id, name, parent_id, self.versions.get(course_id)]
+                for course_id, (name, parent_id) in self.nodes.items()
+            ],
+            "prerequisites": [
+                [course_id, prerequisite_id]
+                for course_id, prerequisite_ids in self.prerequisites.items()
+                for prerequisite_id in prerequisite_ids
+            ],
+        }
+
+    def restore(self, data: dict) -> bool:
+        """Load a graph written by `dump`, possibly in another process"""
+        self.clear()
+        self.disabled = False
+        self.reloads += 1
+        if len(data["nodes"]) > self.max_nodes:
+            self.disable(data["version"])
+            return False
+        for course_id, name, parent_id, version in data["nodes"]:
+            self.nodes[course_id] = (name, parent_id)
+            if version is not None:
+                self.versions[course_id] = version
+            if parent_id is not None:
+                self.children.setdefault(parent_id, set()).add(course_id)
+        for course_id, prerequisite_id in data["prerequisites"]:
+            self.prerequisites.setdefault(course_id, set()).add(prerequisite_id)
+            self.dependents.setdefault(prerequisite_id, set()).add(course_id)
+        self.version = data["version"]
+        return True
+
+    def apply(self, version: int, changes: List[dict]) -> bool:
+        """Patch the cache with the changes of `version`; drop it if that leaves a gap"""
+        if self.version is None or version != self.version + 1:
+            return False
+        for change in changes:
+            node, edge = change.get("node"), change.get("edge")
+            if node is not None:
+                if change["op"] == "delete":
+                    self._delete_node(node.id)
+                else:
+                    self._upsert_node(node)
+            elif edge is not None and edge.type == "prerequisite":
+                if change["op"] == "delete":
+                    self._remove_prerequisite(edge)
+                else:
+                    self._add_prerequisite(edge)
+        if len(self.nodes) > self.max_nodes:
+            self.disable(version)
+            return False
+        self.version = version
+        return True
+
+    def _upsert_node(self, node: GraphNode):
+        previous = self.nodes.get(node.id)
+        if previous is None:
+            self._sorted_ids = None
+        elif previous[1] is not None:
+            self.children.get(previous[1], set()).discard(node.id)
+        self.nodes[node.id] = (node.name, node.parent_id)
+        if node.version is not None:
+            self.versions[node.id] = node.version
+        else:
+            self.versions.pop(node.id, None)
+        if node.parent_id is not None:
+            self.children.setdefault(node.parent_id, set()).add(node.id)
+        if previous is None or previous[0] != node.name:
+            if self._search is not None:
+                self._search.add(node.id, node.name)
+            elif self._search_pending is not None:
+                self._search_pending.add(node.id)
+
+    def _delete_node(self, course_id: int):
+        previous = self.nodes.pop(course_id, None)
+        if previous is None:
+            return
+        self.versions.pop(course_id, None)
+        self._sorted_ids = None
+        if previous[1] is not None:
+            self.children.get(previous[1], set()).discard(course_id)
+        if self._search is not None:
+            self._search.remove(course_id)
+        elif self._search_pending is not None:
+            self._search_pending.add(course_id)
+        for prerequisite_id in self.prerequisites.pop(course_id, ()):
+            self.dependents.get(prerequisite_id, set()).discard(course_id)
+        for dependent_id in self.dependents.pop(course_id, ()):
+            self.prerequisites.get(dependent_id, set()).discard(course_id)
+
+    def _add_prerequisite(self, edge: GraphEdge):
+        self.prerequisites.setdefault(edge.target, set()).add(edge.source)
+        self.dependents.setdefault(edge.source, set()).add(edge.target)
+
+    def _remove_prerequisite(self, edge: GraphEdge):
+        self.prerequisites.get(edge.target, set()).discard(edge.source)
+        self.dependents.get(edge.source, set()).discard(edge.target)
+
+    def course(self, course_id: int) -> Optional[dict]:
+        node = self.nodes.get(course_id)
+        if node is None:
+            return None
+        name, parent_id = node
+        parent = self.nodes.get(parent_id) if parent_id is not None else None
+        return {
+            "id": course_id,
+            "name": name,
+            "parent_id": parent_id,
+            "parent_name": parent[0] if parent else None,
+        }
+
+    def _ids(self) -> List[int]:
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.nodes)
+        return self._sorted_ids
+
+    def page(self, skip: int, limit: int) -> List[dict]:
+        return [self.course(course_id) for course_id in self._ids()[skip:skip + limit]]
+
+    def ids_after(self, after_id: int, limit: int) -> List[int]:
+        ids = self._ids()
+        start = bisect.bisect_right(ids, after_id)
+        return ids[start:start + limit]
+
+    def children_of(self, parent_id: int) -> List[dict]:
+        return [self.course(course_id) for course_id in sorted(self.children.get(parent_id, ()))]
+
+    def ancestors_of(self, course_id: int) -> List[dict]:
+        ancestors = []
+        seen = {course_id}
+        node = self.nodes.get(course_id)
+        while node is not None and node[1] is not None and node[1] not in seen:
+            seen.add(node[1])
+            ancestors.append(self.course(node[1]))
+            node = self.nodes.get(node[1])
+        return ancestors
+
+    @property
+    def needs_search_index(self) -> bool:
+        return self.loaded and self._search is None and self._search_pending is None
+
+    def search_names(self) -> Tuple[int, Dict[int, str]]:
+        """Start building a search index: (generation, names to build it from).
+        Changes from here on are tracked until `set_search_index`"""
+        self._search_pending = set()
+        return self.generation, {course_id: node[0] for course_id, node in self.nodes.items()}
+
+    def set_search_index(self, generation: int, index: Optional[SearchIndex]) -> bool:
+        """Install an index built from `search_names`, or give up on it with None"""
+        if generation != self.generation or self._search_pending is None:
+            return False
+        pending, self._search_pending = self._search_pending, None
+        if index is None:
+            return False
+        for course_id in pending:
+            node = self.nodes.get(course_id)
+            if node is None:
+                index.remove(course_id)
+            else:
+                index.add(course_id, node[0])
+        self._search = index
+        return True
+
+    def search(self, query: str, limit: int) -> Optional[List[Tuple[dict, float]]]:
+        """None until the search index is built"""
+        if self._search is None:
+            return None
+        return [(self.course(course_id), score) for course_id, score in self._search.search(query, limit)]
+
+    def walk(self, course_id: int, direction: str, max_depth: int) -> Dict[int, int]:
+        """Breadth-first prerequisite walk; maps each reached course to its shortest depth"""
+        adjacency = self.prerequisites if direction == "prerequisites" else self.dependents
+        depths: Dict[int, int] = {}
+        frontier = [course_id]
+        for depth in range(1, max_depth + 1):
+            next_frontier = []
+            for current in frontier:
+                for neighbor in adjacency.get(current, ()):
+                    if neighbor not in depths and neighbor != course_id:
+                        depths[neighbor] = depth
+                        next_frontier.append(neighbor)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return depths
+
+    def _neighbors(self, course_id: int, direction: str, edge_types: Tuple[str, ...]) -> List[int]:
+        neighbors: List[int] = []
+        if "parent" in edge_types:
+            if direction in ("up", "both"):
+                parent_id = self.nodes[course_id][1]
+                if parent_id is not None:
+                    neighbors.append(parent_id)
+            if direction in ("down", "both"):
+                neighbors.extend(self.children.get(course_id, ()))
+        if "prerequisite" in edge_types:
+            if direction in ("up", "both"):
+                neighbors.extend(self.prerequisites.get(course_id, ()))
+            if direction in ("down", "both"):
+                neighbors.extend(self.dependents.get(course_id, ()))
+        return neighbors
+
+    def neighborhood(
+        self, course_id: int, depth: int, direction: str, edge_types: Tuple[str, ...], max_nodes: int
+    ) -> Tuple[Dict[int, int], bool]:
+        """Courses within `depth` hops of a course, nearest first and then by id, at
+        most `max_nodes` of them; also whether the walk was cut short"""
+        depths = {course_id: 0}
+        frontier = [course_id]
+        for hops in range(1, depth + 1):
+            reached = set()
+            for current in frontier:
+                for neighbor in self._neighbors(current, direction, edge_types):
+                    if neighbor not in depths:
+                        reached.add(neighbor)
+            if not reached:
+                break
+            frontier = sorted(reached)
+            if len(depths) + len(frontier) > max_nodes:
+                for neighbor in frontier[:max_nodes - len(depths)]:
+                    depths[neighbor] = hops
+                return depths, True
+            for neighbor in frontier:
+                depths[neighbor] = hops
+        return depths, False
+
+    def snapshot(self) -> GraphSnapshot:
+        nodes = []
+        edges = []
+        for course_id in sorted(self.nodes):
+            name, parent_id = self.nodes[course_id]
+            nodes.append(GraphNode(
+                id=course_id, name=name, parent_id=parent_id, version=self.versions.get(course_id)
+            ))
+            if parent_id is not None:
+                edges.append(GraphEdge(source=parent_id, target=course_id, type="parent"))
+        for course_id, prerequisite_ids in self.prerequisites.items():
+            for prerequisite_id in prerequisite_ids:
+                edges.append(GraphEdge(source=prerequisite_id, target=course_id, type="prerequisite"))
+        return GraphSnapshot(version=self.version, nodes=nodes, edges=edges)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "disabled": self.disabled,
+            "version": self.version,
+            "nodes": len(self.nodes),
+            "prerequisite_edges": sum(len(ids) for ids in self.prerequisites.values()),
+            "max_nodes": self.max_nodes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,290 @@
+import os
+from typing import Dict, Optional, Set, Tuple
+import numpy as np
+from app.schemas.graph import GraphLayoutNode, GraphLayoutSnapshot, GraphSnapshot
+
+LAYOUT_ALGORITHMS = ("layered", "force")
+GRAPH_LAYOUT_ALGORITHM = os.getenv("GRAPH_LAYOUT_ALGORITHM", "layered")
+# Changes touching at most this many nodes are laid out around the previous layout
+GRAPH_LAYOUT_INCREMENTAL_MAX = int(os.getenv("GRAPH_LAYOUT_INCREMENTAL_MAX", "200"))
+# A full force-directed pass is O(n^2) per iteration; bigger graphs are laid out in layers
+GRAPH_LAYOUT_FORCE_MAX_NODES = int(os.getenv("GRAPH_LAYOUT_FORCE_MAX_NODES", "1000"))
+
+NODE_SPACING = 120.0
+LAYER_SPACING = 200.0
+ORDERING_SWEEPS = 8
+FORCE_ITERATIONS = 100
+INCREMENTAL_ITERATIONS = 30
+GRAVITY = 0.01
+# Pairwise distances held in memory at once while computing repulsion
+REPULSION_BLOCK_ENTRIES = 1 << 22
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for each pair, without a Python loop"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+def _layers(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Longest-path layering, peeling one frontier of source nodes per round.
+
+    Parent and prerequisite edges together may form cycles; when no source is
+    left, the unplaced node with the fewest unplaced predecessors is released."""
+    layer = np.full(n, -1, dtype=np.int64)
+    indegree = np.bincount(dst, minlength=n)
+    targets = dst[np.argsort(src, kind="stable")]
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+
+    frontier = np.flatnonzero(indegree == 0)
+    depth = 0
+    remaining = n
+    while remaining:
+        if frontier.size == 0:
+            unplaced = np.flatnonzero(layer < 0)
+            frontier = unplaced[[np.argmin(indegree[unplaced])]]
+        layer[frontier] = depth
+        remaining -= frontier.size
+        reached = targets[_ranges(indptr[frontier], indptr[frontier + 1])]
+        np.subtract.at(indegree, reached, 1)
+        reached = np.unique(reached)
+        frontier = reached[(indegree[reached] <= 0) & (layer[reached] < 0)]
+        depth += 1
+    return layer
+
+def _rank_within_layers(layer: np.ndarray, key: np.ndarray, tiebreak: np.ndarray) -> np.ndarray:
+    """Position of each node in its layer when sorted by `key`, centred on 0"""
+    n = layer.size
+    order = np.lexsort((tiebreak, key, layer))
+    sorted_layers = layer[order]
+    rank = np.empty(n)
+    rank[order] = np.arange(n) - np.searchsorted(sorted_layers, sorted_layers, side="left")
+    width = np.bincount(layer)
+    return rank - (width[layer] - 1) / 2
+
+def _neighbor_mean(xy: np.ndarray, known: np.ndarray, src: np.ndarray, dst: np.ndarray):
+    """Mean position of each node's known neighbours, and how many there were"""
+    n = xy.shape[0]
+    weight = known.astype(float)
+    count = np.bincount(dst, weights=weight[src], minlength=n) + np.bincount(src, weights=weight[dst], minlength=n)
+    filled = xy * weight[:, None]
+    total = np.column_stack([
+        np.bincount(dst, weights=filled[src, axis], minlength=n)
+        + np.bincount(src, weights=filled[dst, axis], minlength=n)
+        for axis in range(2)
+    ])
+    return total / np.maximum(count, 1)[:, None], count
+
+def layered_layout(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Sugiyama-style layout: layers from the edge direction, order within a layer
+    from barycentre sweeps alternating between predecessors and successors"""
+    layer = _layers(n, src, dst)
+    tiebreak = np.arange(n)
+    x = _rank_within_layers(layer, tiebreak, tiebreak)
+    for sweep in range(ORDERING_SWEEPS):
+        pulled, towards = (dst, src) if sweep % 2 == 0 else (src, dst)
+        total = np.bincount(pulled, weights=x[towards], minlength=n)
+        count = np.bincount(pulled, minlength=n)
+        barycentre = np.where(count > 0, total / np.maximum(count, 1), x)
+        x = _rank_within_layers(layer, barycentre, x)
+    return np.column_stack((x * NODE_SPACING, layer * LAYER_SPACING))
+
+def place_in_layers(n: int, src: np.ndarray, dst: np.ndarray, previous: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    """Re-layer the graph but leave nodes in `keep` where they were if their layer
+    did not change; every other node takes the free slot in its layer closest to
+    the mean of its kept neighbours"""
+    layer = _layers(n, src, dst)
+    y = layer * LAYER_SPACING
+    keep = keep & (previous[:, 1] == y)
+    xy = np.column_stack((np.where(keep, previous[:, 0], 0.0), y))
+
+    # Slots are half a node apart, as centred layers of even width sit on half slots
+    slots = np.rint(2 * previous[:, 0] / NODE_SPACING).astype(np.int64)
+    occupied = set(zip(layer[keep].tolist(), slots[keep].tolist()))
+    mean, count = _neighbor_mean(xy, keep, src, dst)
+    wanted = np.where(count > 0, np.rint(2 * mean[:, 0] / NODE_SPACING), slots)
+    for i in np.flatnonzero(~keep)[np.lexsort((wanted[~keep], layer[~keep]))]:
+        row, slot = int(layer[i]), int(wanted[i])
+        for offset in range(0, 2 * n + 3):
+            candidate = slot + (offset + 1) // 2 * (1 if offset % 2 else -1) * 2
+            if not any((row, candidate + d) in occupied for d in (-1, 0, 1)):
+                break
+        occupied.add((row, candidate))
+        xy[i, 0] = candidate * NODE_SPACING / 2
+    return xy
+
+def force_layout(
+    xy: np.ndarray,
+    src: np.ndarray,
+    dst: np.ndarray,
+    movable: np.ndarray,
+    iterations: int,
+    temperature: float,
+) -> np.ndarray:
+    """Fruchterman-Reingold iterations moving only the `movable` nodes.
+
+    Repulsion is computed for movable rows against every node in blocks, so an
+    incremental update of m nodes costs O(m * n) per iteration."""
+    xy = xy.copy()
+    n = xy.shape[0]
+    k = NODE_SPACING
+    rows_all = np.flatnonzero(movable)
+    block = max(1, REPULSION_BLOCK_ENTRIES // max(n, 1))
+    for step in range(iterations):
+        displacement = -GRAVITY * xy
+        x, y = xy[:, 0], xy[:, 1]
+        for start in range(0, rows_all.size, block):
+            rows = rows_all[start:start + block]
+            dx = x[rows, None] - x[None, :]
+            dy = y[rows, None] - y[None, :]
+            push = k * k / np.maximum(dx * dx + dy * dy, 1e-2)
+            displacement[rows, 0] += (dx * push).sum(axis=1)
+            displacement[rows, 1] += (dy * push).sum(axis=1)
+        delta = xy[src] - xy[dst]
+        dist = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 1e-2)
+        pull = delta * (dist / k)[:, None]
+        np.subtract.at(displacement, src, pull)
+        np.add.at(displacement, dst, pull)
+
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        limit = temperature * (1 - step / iterations)
+        displacement *= (np.minimum(length, limit) / length)[:, None]
+        xy[movable] += displacement[movable]
+    return xy
+
+class GraphLayout:
+    """Node coordinates for one graph version.
+
+    Pure computation: GraphService decides when to recompute. When only a few
+    nodes gained, lost or changed edges since the previous layout, the previous
+    coordinates seed the new ones instead of laying the graph out from scratch.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = GRAPH_LAYOUT_ALGORITHM,
+        incremental_max: int = GRAPH_LAYOUT_INCREMENTAL_MAX,
+        force_max_nodes: int = GRAPH_LAYOUT_FORCE_MAX_NODES,
+    ):
+        if algorithm not in LAYOUT_ALGORITHMS:
+            raise ValueError(f"Unknown layout algorithm '{algorithm}', expected one of {', '.join(LAYOUT_ALGORITHMS)}")
+        self.algorithm = algorithm
+        self.incremental_max = incremental_max
+        self.force_max_nodes = force_max_nodes
+        self.full_layouts = 0
+        self.incremental_layouts = 0
+        self.clear()
+
+    def clear(self):
+        self.version: Optional[int] = None
+        self.positions: Dict[int, Tuple[float, float]] = {}
+        self._edges: Set[Tuple[int, int]] = set()
+
+    def _affected(self, ids, edges: Set[Tuple[int, int]]) -> Optional[Set[int]]:
+        """Nodes to re-place around the previous layout, or None for a full layout"""
+        if self.version is None:
+            return None
+        affected = {course_id for course_id in ids if course_id not in self.positions}
+        for source, target in edges.symmetric_difference(self._edges):
+            affected.add(source)
+            affected.add(target)
+        if len(affected) > self.incremental_max:
+            return None
+        return affected
+
+    def compute(self, snapshot: GraphSnapshot) -> Dict[int, Tuple[float, float]]:
+        ids = [node.id for node in snapshot.nodes]
+        index = {course_id: i for i, course_id in enumerate(ids)}
+        edges = {
+            (edge.source, edge.target) for edge in snapshot.edges
+            if edge.source != edge.target and edge.source in index and edge.target in index
+        }
+        pairs = np.array([(index[source], index[target]) for source, target in edges], dtype=np.int64).reshape(-1, 2)
+        src, dst = pairs[:, 0], pairs[:, 1]
+        n = len(ids)
+
+        affected = self._affected(ids, edges)
+        if affected is None:
+            xy = self._full(n, src, dst)
+            self.full_layouts += 1
+        else:
+            xy = self._incremental(ids, index, affected, src, dst)
+            self.incremental_layouts += 1
+
+        self.positions = {
+            course_id: (round(float(x), 1), round(float(y), 1))
+            for course_id, (x, y) in zip(ids, xy)
+        }
+        self._edges = edges
+        self.version = snapshot.version
+        return self.positions
+
+    def _full(self, n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        xy = layered_layout(n, src, dst)
+        if self.algorithm == "force" and n <= self.force_max_nodes:
+            xy = force_layout(xy, src, dst, np.ones(n, dtype=bool), FORCE_ITERATIONS, 2 * NODE_SPACING)
+        return xy
+
+    def _incremental(self, ids, index: Dict[int, int], affected: Set[int], src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        n = len(ids)
+        known = np.array([course_id in self.positions for course_id in ids], dtype=bool)
+        previous = np.array([self.positions.get(course_id, (0.0, 0.0)) for course_id in ids], dtype=float).reshape(-1, 2)
+
+        unchanged = known.copy()
+        unchanged[[index[course_id] for course_id in affected if course_id in index]] = False
+        if self.algorithm == "layered":
+            return place_in_layers(n, src, dst, previous, unchanged)
+
+        # New nodes start next to their already placed neighbours
+        mean, count = _neighbor_mean(previous, known, src, dst)
+        fresh = np.flatnonzero(~known)
+        angle = GOLDEN_ANGLE * np.arange(fresh.size)
+        jitter = 0.5 * NODE_SPACING * np.column_stack((np.cos(angle), np.sin(angle)))
+        previous[fresh] = np.where(count[fresh, None] > 0, mean[fresh], 0.0) + jitter
+
+        movable = ~unchanged
+        movable[dst[movable[src]]] = True
+        movable[src[movable[dst]]] = True
+        return force_layout(previous, src, dst, movable, INCREMENTAL_ITERATIONS, NODE_SPACING / 2)
+
+    def restore(self, other: "GraphLayout"):
+        """Take over the state of a copy that laid out a newer version elsewhere"""
+        if other is not self and (self.version is None or other.version >= self.version):
+            self.__dict__.update(other.__dict__)
+
+    def stats(self) -> dict:
+        return {
+            "algorithm": self.algorithm,
+            "version": self.version,
+            "nodes": len(self.positions),
+            "full_layouts": self.full_layouts,
+            "incremental_layouts": self.incremental_layouts,
+        }
+
+def render_layout(layout: GraphLayout, snapshot: GraphSnapshot) -> Tuple[GraphLayout, bytes]:
+    """Lay `snapshot` out with `layout` and serialize it with its coordinates.
+
+    Runs in a job worker process: the updated layout is returned so the caller
+    can restore it, since the worker's copy is lost with the call.
+    """
+    positions = layout.compute(snapshot)
+    body = GraphLayoutSnapshot(
+        version=snapshot.version,
+        algorithm=layout.algorithm,
+        nodes=[
+            GraphLayoutNode(
+                id=node.id,
+                name=node.name,
+                parent_id=node.parent_id,
+                version=node.version,
+                x=positions[node.id][0],
+                y=positions[node.id][1],
+            )
+            for node in snapshot.nodes
+        ],
+        edges=snapshot.edges,
+    )
+    return layout, body.model_dump_json().encode()
@@ -0,0 +1,594 @@
+import asyncio
+import copy
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.db import FAST_STARTUP, AsyncSessionLocal
+from app.core.events import graph_events
+from app.core.jobs import Job, job_queue
+from app.models.course import Course, course_prerequisite
+from app.models.graph import GraphChange, GraphState
+from app.services.graph_cache import GRAPH_CACHE_MAX_NODES, GRAPH_CACHE_TTL, GraphCache
+from app.services.search_index import SearchIndex
+from app.schemas.graph import (
+    GraphChange as GraphChangeSchema,
+    GraphChangeFeed,
+    GraphEdge,
+    GraphNode,
+    GraphSnapshot,
+)
+
+if TYPE_CHECKING:
+    # Both pull in NumPy, so they are imported where a layout or analytics is computed
+    from app.services.graph_analytics import GraphAnalytics
+    from app.services.graph_layout import GraphLayout
+
+logger = logging.getLogger("app.graph")
+
+# Number of graph versions kept in the change log before older entries are compacted
+CHANGE_LOG_RETENTION = int(os.getenv("GRAPH_CHANGE_LOG_RETENTION", "1000"))
+# Feeds longer than this are answered with a full snapshot instead
+MAX_FEED_CHANGES = int(os.getenv("GRAPH_MAX_FEED_CHANGES", "5000"))
+# Maps whose graphs one process keeps in memory; the least recently used go first
+GRAPH_CACHE_MAX_MAPS = int(os.getenv("GRAPH_CACHE_MAX_MAPS", "100"))
+# File written by `python -m app.cli snapshot` that seeds its map's graph cache on
+# first use instead of a full read of the map, e.g. one bundled with a deployment
+GRAPH_CACHE_SNAPSHOT = os.getenv("GRAPH_CACHE_SNAPSHOT")
+# Seconds between background checks of whether a map too large to cache has shrunk
+GRAPH_CACHE_RECOUNT_INTERVAL = float(os.getenv("GRAPH_CACHE_RECOUNT_INTERVAL", "60"))
+
+class MapGraph:
+    """What this process keeps about one map's graph"""
+
+    def __init__(self, disabled: bool = False):
+        self.cache = GraphCache()
+        if disabled:
+            self.cache.disable()
+        self._layout: Optional["GraphLayout"] = None
+        # Last snapshot built and its serialized form
+        self.snapshot: Optional[GraphSnapshot] = None
+        self.snapshot_json: Optional[bytes] = None
+        # (version, serialized snapshot with coordinates) of the last layout
+        self.layout_json: Optional[Tuple[int, bytes]] = None
+        # Metrics of the last version analysed
+        self.analytics: Optional["GraphAnalytics"] = None
+
+    @property
+    def layout(self) -> "GraphLayout":
+        if self._layout is None:
+            from app.services.graph_layout import GraphLayout
+            self._layout = GraphLayout()
+        return self._layout
+
+class MapGraphs:
+    """The MapGraph of each map this process served recently.
+
+    Bounded by map count so many small tenants cannot pin memory; a single large
+    map is bounded by GRAPH_CACHE_MAX_NODES like before.
+    """
+
+    def __init__(self, max_maps: int = GRAPH_CACHE_MAX_MAPS):
+        self.max_maps = max_maps
+        self.disabled = False
+        self.evictions = 0
+        self._graphs: "OrderedDict[int, MapGraph]" = OrderedDict()
+        # Counters of evicted caches, so the totals never go backwards
+        self._retired = {"hits": 0, "misses": 0, "reloads": 0}
+        # Read once, when the first map's cache is loaded
+        self.snapshot_path = GRAPH_CACHE_SNAPSHOT
+        self._snapshot_file: Optional[dict] = None
+
+    def get(self, map_id: int) -> MapGraph:
+        graph = self._graphs.get(map_id)
+        if graph is not None:
+            self._graphs.move_to_end(map_id)
+            return graph
+        graph = self._graphs[map_id] = MapGraph(self.disabled)
+        while len(self._graphs) > self.max_maps:
+            _, evicted = self._graphs.popitem(last=False)
+            self.evictions += 1
+            for key in self._retired:
+                self._retired[key] += getattr(evicted.cache, key)
+        return graph
+
+    def take_snapshot(self, map_id: int) -> Optional[dict]:
+        """The map's graph from GRAPH_CACHE_SNAPSHOT as GraphCache.restore takes
+        it, handed out only once"""
+        if self.snapshot_path is not None:
+            path, self.snapshot_path = self.snapshot_path, None
+            try:
+                with open(path, "rb") as f:
+                    self._snapshot_file = orjson.loads(f.read())
+            except (OSError, ValueError) as exc:
+                logger.warning("Ignoring graph cache snapshot %s: %s", path, exc)
+        snapshot_file = self._snapshot_file
+        if not isinstance(snapshot_file, dict) or snapshot_file.get("map_id") != map_id:
+            return None
+        self._snapshot_file = None
+        return snapshot_file
+
+    def peek(self, map_id: int) -> Optional[MapGraph]:
+        """The map's graph if it is held, without creating it or marking it used"""
+        return self._graphs.get(map_id)
+
+    def clear(self):
+        """Forget every map's graph, e.g. once the database was recreated"""
+        self._graphs.clear()
+
+    def disable(self):
+        """Stop caching graphs in this process; reads then go to the database"""
+        self.disabled = True
+        for graph in self._graphs.values():
+            graph.cache.disable()
+
+    def stats(self) -> dict:
+        caches = [graph.cache for graph in self._graphs.values()]
+        totals = {key: value + sum(getattr(cache, key) for cache in caches) for key, value in self._retired.items()}
+        return {
+            "maps": len(caches),
+            "max_maps": self.max_maps,
+            "loaded": sum(cache.loaded for cache in caches),
+            "disabled": self.disabled,
+            "nodes": sum(len(cache.nodes) for cache in caches),
+            "prerequisite_edges": sum(
+                len(ids) for cache in caches for ids in cache.prerequisites.values()
+            ),
+            "max_nodes": GRAPH_CACHE_MAX_NODES,
+            "ttl_seconds": GRAPH_CACHE_TTL,
+            "evictions": self.evictions,
+            **totals,
+        }
+
+map_graphs = MapGraphs()
+
+class GraphService:
+    @staticmethod
+    async def get_version(db: AsyncSession, map_id: int) -> int:
+        result = await db.execute(
+            select(GraphState.version).where(GraphState.id == map_id)
+        )
+        return result.scalar_one_or_none() or 0
+
+    @staticmethod
+    async def bump_version(db: AsyncSession, map_id: int) -> int:
+        """Increment the map's graph version inside the caller's transaction"""
+        increment = (
+            update(GraphState)
+            .where(GraphState.id == map_id)
+            .values(version=GraphState.version + 1)
+            .returning(GraphState.version)
+        )
+        version = (await db.execute(increment)).scalar_one_or_none()
+        if version is None:
+            # The map's first write. Another one may be creating the row at the same
+            # time; the insert that loses does nothing and increments the winner's
+            postgres = db.bind.dialect.name == "postgresql"
+            await db.execute(
+                (pg_insert if postgres else sqlite_insert)(GraphState)
+                .values(id=map_id, version=0)
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+            version = (await db.execute(increment)).scalar_one()
+        return version
+
+    @staticmethod
+    def course_changes(old: Optional[GraphNode], new: Optional[GraphNode]) -> List[dict]:
+        """Node and parent-edge changes turning course state `old` into `new`"""
+        changes = []
+        if new is not None:
+            changes.append({"op": "upsert", "node": new})
+        elif old is not None:
+            changes.append({"op": "delete", "node": old})
+
+        course_id = (new or old).id
+        old_parent_id = old.parent_id if old else None
+        new_parent_id = new.parent_id if new else None
+        if old_parent_id != new_parent_id:
+            if old_parent_id is not None:
+                changes.append({
+                    "op": "delete",
+                    "edge": GraphEdge(source=old_parent_id, target=course_id, type="parent"),
+                })
+            if new_parent_id is not None:
+                changes.append({
+                    "op": "upsert",
+                    "edge": GraphEdge(source=new_parent_id, target=course_id, type="parent"),
+                })
+        return changes
+
+    @staticmethod
+    async def record_changes(db: AsyncSession, map_id: int, changes: List[dict]) -> int:
+        """Bump the map's graph version and append `changes` to its change log under it"""
+        version = await GraphService.bump_version(db, map_id)
+        rows = []
+        for change in changes:
+            entity = "node" if change.get("node") is not None else "edge"
+            rows.append({
+                "map_id": map_id,
+                "version": version,
+                "entity": entity,
+                "op": change["op"],
+                "payload": change[entity].model_dump(),
+            })
+        if rows:
+            await db.execute(insert(GraphChange), rows)
+        if CHANGE_LOG_RETENTION and version % 100 == 0:
+            await GraphService.compact_changes(db, map_id, version - CHANGE_LOG_RETENTION)
+        return version
+
+    @staticmethod
+    def publish_changes(map_id: int, version: int, changes: List[dict]):
+        """Push committed `changes` to the map's live subscribers as a one-version change feed"""
+        if len(changes) > MAX_FEED_CHANGES:
+            # Such a feed would be answered with a snapshot anyway; let subscribers fetch one
+            graph_events.publish(map_id, f'{{"version": {version}}}', event="reset", event_id=version)
+        else:
+            feed = GraphChangeFeed(
+                version=version,
+                since=version - 1,
+                changes=[GraphChangeSchema(version=version, **change) for change in changes],
+            )
+            graph_events.publish(map_id, feed.model_dump_json(), event_id=version)
+        graph = map_graphs.peek(map_id)
+        if graph is not None and graph.cache.loaded and not graph.cache.apply(version, changes):
+            # Another write landed first; catch up through the change log on next read
+            graph.cache.checked_at = 0.0
+
+    @staticmethod
+    def publish_reset(map_id: int, version: int):
+        """Tell the map's subscribers and local cache that `version` is not described by the change log"""
+        graph_events.publish(map_id, f'{{"version": {version}}}', event="reset", event_id=version)
+        graph = map_graphs.peek(map_id)
+        if graph is not None:
+            graph.cache.clear()
+
+    @staticmethod
+    async def compact_changes(db: AsyncSession, map_id: int, up_to_version: int):
+        await db.execute(
+            delete(GraphChange).where(GraphChange.map_id == map_id, GraphChange.version <= up_to_version)
+        )
+
+    @staticmethod
+    def _live_courses(map_id: int):
+        return (Course.map_id == map_id, Course.deleted_at.is_(None))
+
+    @staticmethod
+    def _live_prerequisites(map_id: int):
+        # A prerequisite links two live courses or two deleted ones, so checking
+        # one end is enough
+        return select(course_prerequisite.c.course_id, course_prerequisite.c.prerequisite_id).where(
+            course_prerequisite.c.map_id == map_id,
+            course_prerequisite.c.course_id.in_(select(Course.id).where(*GraphService._live_courses(map_id))),
+        )
+
+    @staticmethod
+    async def build_snapshot(db: AsyncSession, map_id: int, version: int) -> GraphSnapshot:
+        courses = await db.execute(
+            select(Course.id, Course.name, Course.parent_id, Course.version)
+            .where(*GraphService._live_courses(map_id))
+            .order_by(Course.id)
+        )
+        prerequisites = await db.execute(GraphService._live_prerequisites(map_id))
+
+        nodes = []
+        edges = []
+        for row in courses:
+            nodes.append(GraphNode(id=row.id, name=row.name, parent_id=row.parent_id, version=row.version))
+            if row.parent_id is not None:
+                edges.append(GraphEdge(source=row.parent_id, target=row.id, type="parent"))
+        for row in prerequisites:
+            edges.append(
+                GraphEdge(source=row.prerequisite_id, target=row.course_id, type="prerequisite")
+            )
+
+        return GraphSnapshot(version=version, nodes=nodes, edges=edges)
+
+    @staticmethod
+    async def _load_cache_file(db: AsyncSession, map_id: int, cache: GraphCache) -> bool:
+        """Load the cache from GRAPH_CACHE_SNAPSHOT if it holds the map, then bring
+        it up to date through the change log rather than a full read"""
+        data = map_graphs.take_snapshot(map_id)
+        if data is None:
+            return False
+        try:
+            restored = cache.restore(data)
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.warning("Ignoring graph cache snapshot of map %s: %s", map_id, exc)
+            cache.clear()
+            return False
+        if restored:
+            await GraphService._refresh_cache(db, map_id, cache)
+            cache.checked_at = time.monotonic()
+        return cache.loaded
+
+    @staticmethod
+    async def load_cache(db: AsyncSession, map_id: int) -> bool:
+        if map_graphs.disabled:
+            return False
+        graph = map_graphs.get(map_id)
+        cache = graph.cache
+        if await GraphService._load_cache_file(db, map_id, cache):
+            return True
+        version = await GraphService.get_version(db, map_id)
+        if cache.disabled and version == cache.disabled_version:
+            # Still the graph that was too large; not worth counting again
+            cache.checked_at = time.monotonic()
+            return False
+        courses = (await db.execute(
+            select(func.count()).select_from(Course).where(*GraphService._live_courses(map_id))
+        )).scalar_one()
+        if courses > cache.max_nodes:
+            # Not worth building a snapshot only to throw it away
+            cache.reloads += 1
+            cache.disable(version)
+            loaded = False
+        else:
+            loaded = cache.load(await GraphService.build_snapshot(db, map_id, version))
+        cache.checked_at = time.monotonic()
+        return loaded
+
+    @staticmethod
+    async def get_cache(db: AsyncSession, map_id: int) -> Optional[GraphCache]:
+        """The map's in-process graph cache, re-validated against the map's shared
+        graph version once its TTL expires; None when reads have to go to the database"""
+        cache = map_graphs.get(map_id).cache
+        now = time.monotonic()
+        if cache.disabled and not map_graphs.disabled and now - cache.checked_at >= GRAPH_CACHE_RECOUNT_INTERVAL:
+            # The graph was too large to cache; once it changes, count it again in the
+            # background so the cache comes back when it has shrunk under the limit
+            cache.checked_at = now
+            GraphService.submit_cache_load(map_id)
+        if cache.disabled:
+            cache.misses += 1
+            return None
+        if not cache.loaded and FAST_STARTUP:
+            # A cold request reads from the database rather than waiting for the
+            # whole map to load
+            GraphService.submit_cache_load(map_id)
+            cache.misses += 1
+            return None
+
+        if not cache.loaded or now - cache.checked_at >= cache.ttl:
+            version = await GraphService.get_version(db, map_id)
+            # A lagging replica must not roll back a cache already patched with
+            # this worker's own writes
+            behind = db.info.get("replica") and cache.loaded and version < cache.version
+            if cache.version != version and not behind:
+                await GraphService._refresh_cache(db, map_id, cache)
+            cache.checked_at = now
+
+        if not cache.loaded:
+            cache.misses += 1
+            return None
+        if cache.needs_search_index:
+            GraphService.submit_search_index(map_id, cache)
+        cache.hits += 1
+        return cache
+
+    @staticmethod
+    def submit_search_index(map_id: int, cache: GraphCache) -> Optional[Job]:
+        """Build the search index of a loaded cache in a thread, so the event loop
+        keeps serving meanwhile; searches go to the database until it is installed"""
+        async def run() -> int:
+            generation, names = cache.search_names()
+            index = None
+            try:
+                index = await asyncio.to_thread(SearchIndex, names)
+            finally:
+                cache.set_search_index(generation, index)
+            return len(names)
+
+        try:
+            return job_queue.submit(
+                "search-index", run, key=("search-index", map_id, cache.generation), owner=map_id,
+                summarize=lambda courses: {"map_id": map_id, "courses": courses},
+            )
+        except HTTPException:
+            # The queue is full; a later request tries again
+            return None
+
+    @staticmethod
+    def submit_cache_load(map_id: int) -> Optional[Job]:
+        """Load the map's graph cache in a background job, unless one already is"""
+        async def run() -> bool:
+            async with AsyncSessionLocal() as db:
+                return await GraphService.load_cache(db, map_id)
+
+        try:
+            return job_queue.submit(
+                "graph-cache", run, key=("graph-cache", map_id), owner=map_id,
+                summarize=lambda loaded: {"map_id": map_id, "loaded": loaded},
+            )
+        except HTTPException:
+            # The queue is full; a later request tries again
+            return None
+
+    @staticmethod
+    async def _refresh_cache(db: AsyncSession, map_id: int, cache: GraphCache):
+        cached_version = cache.version
+        if cached_version is None:
+            await GraphService.load_cache(db, map_id)
+            return
+
+        feed = await GraphService.get_changes(db, map_id, cached_version)
+        if cache.version != cached_version:
+            # Refreshed concurrently by another request
+            return
+        if feed.snapshot is not None:
+            cache.load(feed.snapshot)
+            return
+
+        by_version: dict = {}
+        for change in feed.changes:
+            by_version.setdefault(change.version, []).append(
+                {"op": change.op, "node": change.node, "edge": change.edge}
+            )
+        for version in sorted(by_version):
+            if not cache.apply(version, by_version[version]):
+                cache.clear()
+                return
+
+    @staticmethod
+    async def get_snapshot(db: AsyncSession, map_id: int, version: Optional[int] = None) -> GraphSnapshot:
+        """Return the map's graph for the current version, rebuilding it only when stale"""
+        if version is None:
+            version = await GraphService.get_version(db, map_id)
+
+        graph = map_graphs.get(map_id)
+        cached = graph.snapshot
+        if cached is None or cached.version != version:
+            cache = graph.cache
+            cold = not cache.loaded and not cache.disabled
+            if cold:
+                await GraphService._load_cache_file(db, map_id, cache)
+            if cache.version == version:
+                cached = cache.snapshot()
+            else:
+                cached = await GraphService.build_snapshot(db, map_id, version)
+                # The whole map was read anyway, so the cache comes for free
+                if cold and not cache.loaded and cache.load(cached):
+                    cache.checked_at = time.monotonic()
+            graph.snapshot = cached
+            graph.snapshot_json = None
+        return cached
+
+    @staticmethod
+    async def get_snapshot_json(db: AsyncSession, map_id: int, version: Optional[int] = None) -> bytes:
+        snapshot = await GraphService.get_snapshot(db, map_id, version)
+        graph = map_graphs.get(map_id)
+        if graph.snapshot is not snapshot:
+            return snapshot.model_dump_json().encode()
+        if graph.snapshot_json is None:
+            graph.snapshot_json = snapshot.model_dump_json().encode()
+        return graph.snapshot_json
+
+    @staticmethod
+    def submit_layout(map_id: int, snapshot: GraphSnapshot) -> Job:
+        """Queue the layout of `snapshot`, or join the job already laying out its version"""
+        async def run() -> bytes:
+            from app.services.graph_layout import render_layout
+            # Copied when the job starts so it builds on the newest previous layout
+            graph = map_graphs.get(map_id)
+            layout, body = await job_queue.run_cpu(render_layout, copy.copy(graph.layout), snapshot)
+            graph.layout.restore(layout)
+            cached = graph.layout_json
+            if cached is None or cached[0] <= snapshot.version:
+                graph.layout_json = (snapshot.version, body)
+            return body
+
+        return job_queue.submit(
+            "layout", run, key=("layout", map_id, snapshot.version), owner=map_id,
+            summarize=lambda body: {"map_id": map_id, "version": snapshot.version, "bytes": len(body)},
+        )
+
+    @staticmethod
+    async def get_layout_json(db: AsyncSession, map_id: int, version: Optional[int] = None) -> bytes:
+        """The map's graph with x/y coordinates for every node, laid out once per
+        version by a background job so the event loop keeps serving other requests"""
+        snapshot = await GraphService.get_snapshot(db, map_id, version)
+        cached = map_graphs.get(map_id).layout_json
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        return await GraphService.submit_layout(map_id, snapshot).wait()
+
+    @staticmethod
+    async def _analytics_input(db: AsyncSession, map_id: int, version: int) -> tuple:
+        """Course ids, their parent ids (-1 for none) and the prerequisite edges as
+        parallel columns, from the map's graph cache when it is at `version`"""
+        cache = map_graphs.get(map_id).cache
+        if cache.version == version:
+            ids = list(cache.nodes)
+            parent_ids = [-1 if parent_id is None else parent_id for _, parent_id in cache.nodes.values()]
+            course_ids, prerequisite_ids = [], []
+            for course_id, prerequisites in cache.prerequisites.items():
+                course_ids.extend([course_id] * len(prerequisites))
+                prerequisite_ids.extend(prerequisites)
+            return ids, parent_ids, course_ids, prerequisite_ids
+
+        courses = (await db.execute(
+            select(Course.id, Course.parent_id).where(*GraphService._live_courses(map_id))
+        )).all()
+        prerequisites = (await db.execute(GraphService._live_prerequisites(map_id))).all()
+        return (
+            [row.id for row in courses],
+            [-1 if row.parent_id is None else row.parent_id for row in courses],
+            [row.course_id for row in prerequisites],
+            [row.prerequisite_id for row in prerequisites],
+        )
+
+    @staticmethod
+    def submit_analytics(map_id: int, version: int) -> Job:
+        """Queue the metrics of the map's graph `version`, or join the job already computing them"""
+        async def run() -> "GraphAnalytics":
+            from app.services.graph_analytics import GraphAnalytics
+            async with AsyncSessionLocal() as db:
+                columns = await GraphService._analytics_input(db, map_id, version)
+            analytics = await job_queue.run_cpu(GraphAnalytics, version, *columns)
+            graph = map_graphs.get(map_id)
+            if graph.analytics is None or graph.analytics.version <= version:
+                graph.analytics = analytics
+            return analytics
+
+        return job_queue.submit(
+            "analytics", run, key=("analytics", map_id, version), owner=map_id,
+            summarize=lambda analytics: {
+                "map_id": map_id, "version": version, "compute_ms": round(analytics.compute_ms, 1),
+            },
+        )
+
+    @staticmethod
+    async def get_analytics(db: AsyncSession, map_id: int, version: Optional[int] = None) -> "GraphAnalytics":
+        """Whole-graph metrics of a map, computed once per version by a background job"""
+        if version is None:
+            version = await GraphService.get_version(db, map_id)
+        cached = map_graphs.get(map_id).analytics
+        if cached is not None and cached.version == version:
+            return cached
+        return await GraphService.submit_analytics(map_id, version).wait()
+
+    @staticmethod
+    async def get_stats(db: AsyncSession, map_id: int, top: int = 10) -> dict:
+        analytics = await GraphService.get_analytics(db, map_id)
+        top_ids = [course_id for course_id, _, _ in analytics.most_depended_on(top)]
+        cache = map_graphs.get(map_id).cache
+        if cache.version == analytics.version:
+            names = {course_id: cache.nodes[course_id][0] for course_id in top_ids if course_id in cache.nodes}
+        else:
+            result = await db.execute(
+                select(Course.id, Course.name).where(Course.map_id == map_id, Course.id.in_(top_ids))
+            )
+            names = {row.id: row.name for row in result}
+        return analytics.stats(top, names)
+
+    @staticmethod
+    async def get_changes(db: AsyncSession, map_id: int, since: int) -> GraphChangeFeed:
+        """Changes after version `since`, or a full snapshot when the log no longer covers it"""
+        version = await GraphService.get_version(db, map_id)
+        if since == version:
+            return GraphChangeFeed(version=version, since=since)
+
+        if 0 <= since < version:
+            result = await db.execute(
+                select(GraphChange)
+                .where(GraphChange.map_id == map_id, GraphChange.version > since, GraphChange.version <= version)
+                .order_by(GraphChange.id)
+                .limit(MAX_FEED_CHANGES + 1)
+            )
+            rows = result.scalars().all()
+            if rows and rows[0].version == since + 1 and len(rows) <= MAX_FEED_CHANGES:
+                changes = [
+                    GraphChangeSchema(version=row.version, op=row.op, **{row.entity: row.payload})
+                    for row in rows
+                ]
+                return GraphChangeFeed(version=version, since=since, changes=changes)
+
+        snapshot = await GraphService.get_snapshot(db, map_id, version)
+        return GraphChangeFeed(version=version, since=since, snapshot=snapshot)
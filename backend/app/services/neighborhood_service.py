@@ -0,0 +1,148 @@
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.graph_service import GraphService
+
+NEIGHBORHOOD_EDGE_TYPES = ("parent", "prerequisite")
+MAX_NEIGHBORHOOD_DEPTH = 10
+MAX_NEIGHBORHOOD_NODES = 5000
+
+# Steps along each edge type: "up" goes to parents and prerequisites, "down" to
+# children and dependents, matching the source -> target direction of graph edges.
+# Edges never leave a map; the map filter lets "down" use (map_id, parent_id)
+ADJACENCY = {
+    ("parent", "up"): "SELECT id AS from_id, parent_id AS next_id FROM course WHERE parent_id IS NOT NULL AND deleted_at IS NULL",
+    ("parent", "down"): (
+        "SELECT parent_id AS from_id, id AS next_id FROM course"
+        " WHERE map_id = :map_id AND parent_id IS NOT NULL AND deleted_at IS NULL"
+    ),
+    ("prerequisite", "up"): "SELECT course_id AS from_id, prerequisite_id AS next_id FROM course_prerequisite",
+    ("prerequisite", "down"): "SELECT prerequisite_id AS from_id, course_id AS next_id FROM course_prerequisite",
+}
+
+# One statement returns the nearest :limit courses within :depth hops and then
+# the prerequisite edges among them (rows with a prerequisite_id). UNION keeps
+# the walk finite on cycles; the join into the UNION ALL of edge kinds is pushed
+# down to each branch's index
+NEIGHBORHOOD_QUERY = """
+    WITH RECURSIVE walk(id, depth) AS (
+        SELECT id, 0 FROM course WHERE id = :course_id AND map_id = :map_id AND deleted_at IS NULL
+        UNION
+        SELECT a.next_id, w.depth + 1
+        FROM walk w
+        INNER JOIN ({adjacency}) a ON a.from_id = w.id
+        WHERE w.depth < :depth
+    ),
+    reached AS (
+        SELECT id, MIN(depth) AS depth
+        FROM walk
+        GROUP BY id
+        ORDER BY MIN(depth), id
+        LIMIT :limit
+    )
+    SELECT c.id AS id, c.name AS name, c.parent_id AS parent_id, r.depth AS depth,
+        CAST(NULL AS INTEGER) AS prerequisite_id
+    FROM reached r
+    INNER JOIN course c ON c.id = r.id
+    {prerequisite_edges}
+    ORDER BY depth, id
+"""
+
+PREREQUISITE_EDGES = """
+    UNION ALL
+    SELECT cp.course_id, NULL, NULL, NULL, cp.prerequisite_id
+    FROM course_prerequisite cp
+    WHERE cp.course_id IN (SELECT id FROM reached)
+        AND cp.prerequisite_id IN (SELECT id FROM reached)
+"""
+
+class NeighborhoodService:
+    @staticmethod
+    def parse_edge_types(edges: Optional[str]) -> Tuple[str, ...]:
+        if not edges:
+            return NEIGHBORHOOD_EDGE_TYPES
+        requested = tuple(dict.fromkeys(edge.strip() for edge in edges.split(",") if edge.strip()))
+        unknown = [edge for edge in requested if edge not in NEIGHBORHOOD_EDGE_TYPES]
+        if unknown or not requested:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown edge types {', '.join(unknown)}; expected any of {', '.join(NEIGHBORHOOD_EDGE_TYPES)}",
+            )
+        return requested
+
+    @staticmethod
+    def _query(direction: str, edge_types: Tuple[str, ...]):
+        directions = ("up", "down") if direction == "both" else (direction,)
+        adjacency = " UNION ALL ".join(
+            ADJACENCY[(edge_type, step)] for edge_type in edge_types for step in directions
+        )
+        return text(NEIGHBORHOOD_QUERY.format(
+            adjacency=adjacency,
+            prerequisite_edges=PREREQUISITE_EDGES if "prerequisite" in edge_types else "",
+        ))
+
+    @staticmethod
+    def _subgraph(course_id: int, nodes: Dict[int, dict], prerequisite_edges, edge_types, truncated: bool) -> dict:
+        """GraphNeighborhood-shaped dict with the edges of the requested types among `nodes`"""
+        edges = []
+        if "parent" in edge_types:
+            edges.extend(
+                {"source": node["parent_id"], "target": node["id"], "type": "parent"}
+                for node in nodes.values()
+                if node["parent_id"] in nodes
+            )
+        edges.extend(
+            {"source": prerequisite_id, "target": dependent_id, "type": "prerequisite"}
+            for dependent_id, prerequisite_id in sorted(prerequisite_edges)
+            if dependent_id in nodes and prerequisite_id in nodes
+        )
+        return {"center": course_id, "nodes": list(nodes.values()), "edges": edges, "truncated": truncated}
+
+    @staticmethod
+    async def get_neighborhood(
+        db: AsyncSession,
+        map_id: int,
+        course_id: int,
+        depth: int = 1,
+        direction: str = "both",
+        edge_types: Tuple[str, ...] = NEIGHBORHOOD_EDGE_TYPES,
+        max_nodes: int = 200,
+    ) -> dict:
+        """The courses within `depth` hops of a course along the given edge types,
+        nearest first, capped at `max_nodes`, and the edges among them"""
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            if course_id not in cache.nodes:
+                raise HTTPException(status_code=404, detail="Course not found")
+            depths, truncated = cache.neighborhood(course_id, depth, direction, edge_types, max_nodes)
+            nodes = {}
+            prerequisite_edges = []
+            for reached, hops in depths.items():
+                name, parent_id = cache.nodes[reached]
+                nodes[reached] = {"id": reached, "name": name, "parent_id": parent_id, "depth": hops}
+                if "prerequisite" in edge_types:
+                    prerequisite_edges.extend(
+                        (reached, prerequisite_id) for prerequisite_id in cache.prerequisites.get(reached, ())
+                    )
+            return NeighborhoodService._subgraph(course_id, nodes, prerequisite_edges, edge_types, truncated)
+
+        result = await db.execute(
+            NeighborhoodService._query(direction, edge_types),
+            {"map_id": map_id, "course_id": course_id, "depth": depth, "limit": max_nodes + 1},
+        )
+        nodes = {}
+        prerequisite_edges = []
+        for row in result:
+            if row.prerequisite_id is not None:
+                prerequisite_edges.append((row.id, row.prerequisite_id))
+            else:
+                nodes[row.id] = {"id": row.id, "name": row.name, "parent_id": row.parent_id, "depth": row.depth}
+        if not nodes:
+            raise HTTPException(status_code=404, detail="Course not found")
+
+        truncated = len(nodes) > max_nodes
+        if truncated:
+            # The extra row only signals truncation; it is the last in (depth, id) order
+            nodes.popitem()
+        return NeighborhoodService._subgraph(course_id, nodes, prerequisite_edges, edge_types, truncated)
@@ -0,0 +1,237 @@
+import heapq
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.course import Course, course_closure, course_prerequisite
+from app.schemas.graph import GraphEdge
+from app.services.closure_service import ClosureService
+from app.services.course_service import CourseService
+from app.services.graph_service import GraphService
+
+DIRECTIONS = ("prerequisites", "dependents")
+MAX_TRAVERSAL_DEPTH = 1000
+
+# Walks course_prerequisite from :course_id of :map_id in either direction. UNION
+# keeps the recursion finite even if the table ever holds a cycle, and :max_depth
+# bounds it. Prerequisites never cross maps, so only the start is checked.
+WALK_QUERY = """
+    WITH RECURSIVE walk(id, depth) AS (
+        SELECT {next_col}, 1
+        FROM course_prerequisite
+        WHERE {from_col} = :course_id AND map_id = :map_id
+        UNION
+        SELECT cp.{next_col}, w.depth + 1
+        FROM course_prerequisite cp
+        INNER JOIN walk w ON cp.{from_col} = w.id
+        WHERE w.depth < :max_depth
+    )
+    SELECT c.id, c.name, c.parent_id, p.name AS parent_name, MIN(w.depth) AS depth
+    FROM walk w
+    INNER JOIN course c ON c.id = w.id
+    LEFT JOIN course p ON p.id = c.parent_id
+    WHERE w.id != :course_id
+    GROUP BY c.id, c.name, c.parent_id, p.name
+    ORDER BY depth, c.id
+"""
+
+WALK_COLUMNS = {
+    "prerequisites": {"from_col": "course_id", "next_col": "prerequisite_id"},
+    "dependents": {"from_col": "prerequisite_id", "next_col": "course_id"},
+}
+
+class PrerequisiteService:
+    @staticmethod
+    async def walk(
+        db: AsyncSession, map_id: int, course_id: int, direction: str, max_depth: int = MAX_TRAVERSAL_DEPTH
+    ) -> List[Dict]:
+        """Transitive prerequisites or dependents of a course, nearest first, as
+        CourseDependency-shaped dicts"""
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            depths = cache.walk(course_id, direction, max_depth)
+            ordered = sorted(depths, key=lambda reached: (depths[reached], reached))
+            return [
+                {**cache.course(reached), "depth": depths[reached]}
+                for reached in ordered
+            ]
+
+        if ClosureService.enabled:
+            closure_direction = "ancestors" if direction == "prerequisites" else "descendants"
+            result = await db.execute(ClosureService.related_query(
+                map_id, "prerequisite", course_id, closure_direction, max_depth
+            ))
+        else:
+            result = await db.execute(
+                text(WALK_QUERY.format(**WALK_COLUMNS[direction])),
+                {"map_id": map_id, "course_id": course_id, "max_depth": max_depth},
+            )
+        return [{**CourseService._to_dict(row), "depth": row.depth} for row in result]
+
+    @staticmethod
+    async def _edges_among(db: AsyncSession, map_id: int, course_ids: List[int]) -> Dict[int, List[int]]:
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            members = set(course_ids)
+            return {
+                course_id: [p for p in cache.prerequisites.get(course_id, ()) if p in members]
+                for course_id in course_ids
+            }
+
+        edges: Dict[int, List[int]] = {course_id: [] for course_id in course_ids}
+        result = await db.execute(
+            select(course_prerequisite.c.course_id, course_prerequisite.c.prerequisite_id)
+            .where(course_prerequisite.c.map_id == map_id)
+            .where(course_prerequisite.c.course_id.in_(course_ids))
+            .where(course_prerequisite.c.prerequisite_id.in_(course_ids))
+        )
+        for course_id, prerequisite_id in result:
+            edges[course_id].append(prerequisite_id)
+        return edges
+
+    @staticmethod
+    async def _course_dict(db: AsyncSession, map_id: int, course_id: int) -> Optional[Dict]:
+        """A live course shaped like the rows of `walk`, or None"""
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            return cache.course(course_id)
+        result = await db.execute(CourseService._course_query(map_id).where(Course.id == course_id))
+        row = result.one_or_none()
+        return CourseService._to_dict(row) if row is not None else None
+
+    @staticmethod
+    async def learning_order(
+        db: AsyncSession, map_id: int, course_id: int, max_depth: int = MAX_TRAVERSAL_DEPTH
+    ) -> Optional[List[Dict]]:
+        """Prerequisites of a course in an order where each one follows everything it requires,
+        ending with the course itself; None if there is no such course"""
+        target = await PrerequisiteService._course_dict(db, map_id, course_id)
+        if target is None:
+            return None
+        prerequisites = await PrerequisiteService.walk(db, map_id, course_id, "prerequisites", max_depth)
+        by_id = {course["id"]: course for course in prerequisites}
+        edges = await PrerequisiteService._edges_among(db, map_id, list(by_id))
+
+        remaining = {course_id: len(required) for course_id, required in edges.items()}
+        unlocks: Dict[int, List[int]] = {}
+        for dependent_id, required in edges.items():
+            for prerequisite_id in required:
+                unlocks.setdefault(prerequisite_id, []).append(dependent_id)
+
+        # Kahn's algorithm; among available courses take the deepest (most fundamental) first
+        ready = [(-by_id[c]["depth"], c) for c, count in remaining.items() if count == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            _, current = heapq.heappop(ready)
+            order.append(by_id[current])
+            for dependent_id in unlocks.get(current, ()):
+                remaining[dependent_id] -= 1
+                if remaining[dependent_id] == 0:
+                    heapq.heappush(ready, (-by_id[dependent_id]["depth"], dependent_id))
+
+        order.append({**target, "depth": 0})
+        return order
+
+    @staticmethod
+    async def would_create_cycle(db: AsyncSession, map_id: int, course_id: int, prerequisite_id: int) -> bool:
+        """True if `prerequisite_id` already (transitively) requires `course_id`"""
+        if course_id == prerequisite_id:
+            return True
+        cache = await GraphService.get_cache(db, map_id)
+        if cache is not None:
+            return course_id in cache.walk(prerequisite_id, "prerequisites", MAX_TRAVERSAL_DEPTH)
+
+        if ClosureService.enabled:
+            result = await db.execute(
+                select(course_closure.c.depth).where(
+                    course_closure.c.relation == "prerequisite",
+                    course_closure.c.ancestor_id == course_id,
+                    course_closure.c.descendant_id == prerequisite_id,
+                )
+            )
+            return result.first() is not None
+
+        result = await db.execute(
+            text("""
+                WITH RECURSIVE walk(id) AS (
+                    SELECT prerequisite_id FROM course_prerequisite WHERE course_id = :start
+                    UNION
+                    SELECT cp.prerequisite_id
+                    FROM course_prerequisite cp
+                    INNER JOIN walk w ON cp.course_id = w.id
+                )
+                SELECT 1 FROM walk WHERE id = :target LIMIT 1
+            """),
+            {"start": prerequisite_id, "target": course_id},
+        )
+        return result.first() is not None
+
+    @staticmethod
+    async def add_prerequisite(db: AsyncSession, map_id: int, course_id: int, prerequisite_id: int):
+        courses = await db.execute(
+            select(Course.id, Course.name).where(
+                Course.id.in_([course_id, prerequisite_id]), Course.map_id == map_id, Course.deleted_at.is_(None)
+            )
+        )
+        names = dict(courses.all())
+        for missing in (course_id, prerequisite_id):
+            if missing not in names:
+                raise HTTPException(status_code=404, detail=f"Course {missing} not found")
+
+        existing = await db.execute(
+            select(course_prerequisite.c.course_id)
+            .where(course_prerequisite.c.course_id == course_id)
+            .where(course_prerequisite.c.prerequisite_id == prerequisite_id)
+        )
+        if existing.first() is not None:
+            return
+
+        if await PrerequisiteService.would_create_cycle(db, map_id, course_id, prerequisite_id):
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"Adding '{names[prerequisite_id]}' as a prerequisite of "
+                    f"'{names[course_id]}' would create a cycle"
+                ),
+            )
+
+        await db.execute(
+            insert(course_prerequisite).values(course_id=course_id, prerequisite_id=prerequisite_id, map_id=map_id)
+        )
+        if ClosureService.enabled:
+            await ClosureService.add_prerequisite(db, course_id, prerequisite_id)
+        changes = [{
+            "op": "upsert",
+            "edge": GraphEdge(source=prerequisite_id, target=course_id, type="prerequisite"),
+        }]
+        version = await GraphService.record_changes(db, map_id, changes)
+        await db.commit()
+        GraphService.publish_changes(map_id, version, changes)
+
+    @staticmethod
+    async def remove_prerequisite(db: AsyncSession, map_id: int, course_id: int, prerequisite_id: int) -> bool:
+        result = await db.execute(
+            delete(course_prerequisite)
+            .where(course_prerequisite.c.course_id == course_id)
+            .where(course_prerequisite.c.prerequisite_id == prerequisite_id)
+            # Prerequisites among deleted courses come back with them on restore
+            .where(course_prerequisite.c.course_id.in_(
+                select(Course.id).where(
+                    Course.id == course_id, Course.map_id == map_id, Course.deleted_at.is_(None)
+                )
+            ))
+        )
+        if result.rowcount == 0:
+            await db.rollback()
+            return False
+        if ClosureService.enabled:
+            await ClosureService.remove_prerequisite(db, course_id, prerequisite_id)
+        changes = [{
+            "op": "delete",
+            "edge": GraphEdge(source=prerequisite_id, target=course_id, type="prerequisite"),
+        }]
+        version = await GraphService.record_changes(db, map_id, changes)
+        await db.commit()
+        GraphService.publish_changes(map_id, version, changes)
+        return True
@@ -0,0 +1,187 @@
+import bisect
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+# Same default as pg_trgm's similarity threshold
+MIN_SIMILARITY = 0.3
+
+# Rank bonuses added to trigram similarity, shared with SearchService's SQL
+EXACT_BONUS = 3.0
+PREFIX_BONUS = 2.0
+WORD_PREFIX_BONUS = 1.5
+
+WORD = re.compile(r"\w+")
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def _word_trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of each word padded the way pg_trgm pads them"""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        grams |= _word_trigrams(word)
+    return grams
+
+def similarity(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    shared = len(left & right)
+    return shared / (len(left) + len(right) - shared)
+
+class SearchIndex:
+    """Prefix and typo-tolerant index over course names.
+
+    Two sorted arrays act as a flattened trie: one of whole lower-cased names, one
+    of the name suffixes starting at each later word, so a prefix lookup is a
+    bisect plus a scan of at most `limit` entries. Typos are corrected per word
+    against the vocabulary of all names through a trigram index of its words,
+    then the corrected query goes through the same prefix lookups.
+    """
+
+    def __init__(self, names: Dict[int, str]):
+        self._names: Dict[int, str] = {course_id: normalize(name) for course_id, name in names.items()}
+        self._sorted_names: List[Tuple[str, int]] = sorted((key, course_id) for course_id, key in self._names.items())
+        self._suffixes: List[Tuple[str, int]] = sorted(
+            (suffix, course_id)
+            for course_id, key in self._names.items()
+            for suffix in self._word_suffixes(key)
+        )
+        # word -> number of names using it, and trigram -> words containing it
+        self._vocabulary: Dict[str, int] = dict(Counter(
+            word for key in self._names.values() for word in set(WORD.findall(key))
+        ))
+        self._sorted_vocabulary: List[str] = sorted(self._vocabulary)
+        self._word_postings: Dict[str, Set[str]] = {}
+        for word in self._sorted_vocabulary:
+            for gram in _word_trigrams(word):
+                self._word_postings.setdefault(gram, set()).add(word)
+
+    @staticmethod
+    def _word_suffixes(name: str) -> List[str]:
+        return [name[match.start():] for match in WORD.finditer(name)][1:]
+
+    def add(self, course_id: int, name: str):
+        if course_id in self._names:
+            self.remove(course_id)
+        key = normalize(name)
+        self._names[course_id] = key
+        bisect.insort(self._sorted_names, (key, course_id))
+        for suffix in self._word_suffixes(key):
+            bisect.insort(self._suffixes, (suffix, course_id))
+        for word in set(WORD.findall(key)):
+            count = self._vocabulary.get(word, 0)
+            self._vocabulary[word] = count + 1
+            if count == 0:
+                bisect.insort(self._sorted_vocabulary, word)
+                for gram in _word_trigrams(word):
+                    self._word_postings.setdefault(gram, set()).add(word)
+
+    @staticmethod
+    def _discard(entries: list, entry):
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def remove(self, course_id: int):
+        key = self._names.pop(course_id, None)
+        if key is None:
+            return
+        self._discard(self._sorted_names, (key, course_id))
+        for suffix in self._word_suffixes(key):
+            self._discard(self._suffixes, (suffix, course_id))
+        for word in set(WORD.findall(key)):
+            count = self._vocabulary.pop(word) - 1
+            if count:
+                self._vocabulary[word] = count
+                continue
+            self._discard(self._sorted_vocabulary, word)
+            for gram in _word_trigrams(word):
+                posting = self._word_postings[gram]
+                posting.discard(word)
+                if not posting:
+                    del self._word_postings[gram]
+
+    @staticmethod
+    def _prefixed(entries: List[Tuple[str, int]], prefix: str, limit: int) -> List[int]:
+        found = []
+        position = bisect.bisect_left(entries, (prefix,))
+        while position < len(entries) and len(found) < limit:
+            key, course_id = entries[position]
+            if not key.startswith(prefix):
+                break
+            found.append(course_id)
+            position += 1
+        return found
+
+    def _is_word_prefix(self, word: str) -> bool:
+        position = bisect.bisect_left(self._sorted_vocabulary, word)
+        return position < len(self._sorted_vocabulary) and self._sorted_vocabulary[position].startswith(word)
+
+    def _closest_word(self, word: str) -> Optional[str]:
+        """The vocabulary word most similar to `word`, if any reaches MIN_SIMILARITY"""
+        word_grams = _word_trigrams(word)
+        shared: Dict[str, int] = {}
+        for gram in word_grams:
+            for candidate in self._word_postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_score = None, MIN_SIMILARITY
+        for candidate, count in shared.items():
+            score = count / (len(word_grams) + len(_word_trigrams(candidate)) - count)
+            if score > best_score or (score == best_score and best is not None
+                                      and self._vocabulary[candidate] > self._vocabulary[best]):
+                best, best_score = candidate, score
+        return best
+
+    def _corrected(self, query: str) -> Optional[str]:
+        """`query` with unknown words replaced by their closest vocabulary word;
+        the last word may stay a partial word. None when nothing was corrected"""
+        words = WORD.findall(query)
+        corrected = []
+        for position, word in enumerate(words):
+            last = position == len(words) - 1
+            if word in self._vocabulary or (last and self._is_word_prefix(word)):
+                corrected.append(word)
+                continue
+            replacement = self._closest_word(word)
+            if replacement is None:
+                return None
+            corrected.append(replacement)
+        return " ".join(corrected) if corrected != words else None
+
+    def _matches(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        return [
+            (course_id, bonus)
+            for bonus, entries in ((PREFIX_BONUS, self._sorted_names), (WORD_PREFIX_BONUS, self._suffixes))
+            for course_id in self._prefixed(entries, query, limit)
+        ]
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """(course id, score) pairs, best first: exact name, name prefix, word
+        prefix, then matches of the typo-corrected query by trigram similarity"""
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+        query_grams = trigrams(query)
+
+        ranked: Dict[int, float] = {}
+        for course_id, bonus in self._matches(query, limit):
+            if course_id not in ranked:
+                key = self._names[course_id]
+                ranked[course_id] = (EXACT_BONUS if key == query else bonus) + similarity(query_grams, trigrams(key))
+        if len(ranked) < limit:
+            corrected = self._corrected(query)
+            if corrected is not None:
+                for course_id, _ in self._matches(corrected, limit):
+                    if course_id not in ranked:
+                        ranked[course_id] = similarity(query_grams, trigrams(self._names[course_id]))
+
+        results = sorted(
+            ranked.items(),
+            key=lambda item: (-item[1], len(self._names[item[0]]), self._names[item[0]]),
+        )
+        return results[:limit]
@@ -0,0 +1,94 @@
+import re
+from typing import Dict, List
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.graph_service import GraphService
+from app.services.search_index import (
+    EXACT_BONUS,
+    MIN_SIMILARITY,
+    PREFIX_BONUS,
+    WORD,
+    WORD_PREFIX_BONUS,
+    normalize,
+)
+
+MAX_SEARCH_RESULTS = 100
+
+# Served by the indexes of migration e7c4a9b1d350: the text_pattern_ops index for
+# the name prefix, the tsvector index for word prefixes and the trigram index
+# for typo-tolerant matches
+POSTGRES_SEARCH_QUERY = text(f"""
+    SELECT c.id, c.name, c.parent_id, p.name AS parent_name,
+        CASE
+            WHEN lower(c.name) = :query THEN {EXACT_BONUS}
+            WHEN lower(c.name) LIKE :prefix ESCAPE '\\' THEN {PREFIX_BONUS}
+            WHEN :tsquery <> '' AND to_tsvector('simple', c.name) @@ to_tsquery('simple', :tsquery)
+                THEN {WORD_PREFIX_BONUS}
+            ELSE 0
+        END + similarity(lower(c.name), :query) AS score
+    FROM course c
+    LEFT JOIN course p ON p.id = c.parent_id
+    WHERE c.map_id = :map_id AND c.deleted_at IS NULL AND (
+        lower(c.name) LIKE :prefix ESCAPE '\\'
+        OR (:tsquery <> '' AND to_tsvector('simple', c.name) @@ to_tsquery('simple', :tsquery))
+        OR lower(c.name) % :query
+    )
+    ORDER BY score DESC, length(c.name), c.name
+    LIMIT :limit
+""")
+
+# Other databases have neither trigrams nor text search: rank prefix and
+# substring matches only
+FALLBACK_SEARCH_QUERY = text(f"""
+    SELECT c.id, c.name, c.parent_id, p.name AS parent_name,
+        CASE
+            WHEN lower(c.name) = :query THEN {EXACT_BONUS}
+            WHEN lower(c.name) LIKE :prefix ESCAPE '\\' THEN {PREFIX_BONUS}
+            WHEN lower(c.name) LIKE :word_prefix ESCAPE '\\' THEN {WORD_PREFIX_BONUS}
+            ELSE {MIN_SIMILARITY}
+        END AS score
+    FROM course c
+    LEFT JOIN course p ON p.id = c.parent_id
+    WHERE c.map_id = :map_id AND c.deleted_at IS NULL AND lower(c.name) LIKE :contains ESCAPE '\\'
+    ORDER BY score DESC, length(c.name), c.name
+    LIMIT :limit
+""")
+
+def _escape_like(value: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+class SearchService:
+    @staticmethod
+    async def search_courses(db: AsyncSession, map_id: int, query: str, limit: int = 10) -> List[Dict]:
+        """The map's courses matching `query` by name, best first: exact match, name prefix,
+        word prefix, then typo-tolerant trigram matches. Returns CourseSearchResult-shaped dicts"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        cache = await GraphService.get_cache(db, map_id)
+        # The cache's index is built in the background after each load
+        matches = cache.search(query, limit) if cache is not None else None
+        if matches is not None:
+            return [{**course, "score": round(score, 4)} for course, score in matches]
+
+        escaped = _escape_like(query)
+        params = {"map_id": map_id, "query": query, "prefix": f"{escaped}%", "limit": limit}
+        if db.bind.dialect.name == "postgresql":
+            words = WORD.findall(query)
+            params["tsquery"] = " & ".join(f"{word}:*" for word in words)
+            result = await db.execute(POSTGRES_SEARCH_QUERY, params)
+        else:
+            params["word_prefix"] = f"% {escaped}%"
+            params["contains"] = f"%{escaped}%"
+            result = await db.execute(FALLBACK_SEARCH_QUERY, params)
+        return [
+            {
+                "id": row.id,
+                "name": row.name,
+                "parent_id": row.parent_id,
+                "parent_name": row.parent_name,
+                "score": round(float(row.score), 4),
+            }
+            for row in result
+        ]
@@ -0,0 +1,487 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import bindparam, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.models.course import Course
+from app.schemas.course import Course as CourseSchema, CourseMove, CourseSubtreeChange
+from app.schemas.graph import GraphEdge, GraphNode
+from app.services.closure_service import MAX_WALK_DEPTH, ClosureService
+from app.services.graph_service import GraphService
+
+Parent = aliased(Course, name="parent")
+
+MAX_DELETED_COURSES = 1000
+
+# :course_id of :map_id and, down to :max_depth levels, the children below it
+# that are in the given state; every statement below is one walk plus one
+# set-based write. Children are looked up through the (map_id, parent_id) index
+SUBTREE = """
+    WITH RECURSIVE subtree(id, depth) AS (
+        SELECT id, 0 FROM course
+        WHERE id = :course_id AND map_id = :map_id AND {root_state} {conditions}
+        UNION ALL
+        SELECT c.id, s.depth + 1 FROM course c
+        INNER JOIN subtree s ON c.parent_id = s.id
+        WHERE c.map_id = :map_id AND {child_state} AND s.depth < :max_depth
+    )
+"""
+# Live, deleted by the delete :deletion_id, or either. The deleted_at test lets
+# the deletion walk use the partial index on deleted rows
+STATES = {
+    "live": "{alias}deleted_at IS NULL",
+    "deletion": "{alias}deleted_at IS NOT NULL AND {alias}deletion_id = :deletion_id",
+    "any": "1 = 1",
+}
+VERSION_CONDITION = "AND version = :expected_version"
+# The same check on the written rows themselves: on Postgres a row changed by a
+# concurrent transaction is re-checked at its latest version, where the walk's
+# condition is not, so the course drops out instead of its update being lost
+ROW_VERSION_CONDITION = "AND ({alias}id <> :course_id OR {alias}version = :expected_version)"
+
+SOFT_DELETE_QUERY = """
+    {subtree}
+    UPDATE course SET deleted_at = :deleted_at, deletion_id = :deletion_id, version = version + 1
+    WHERE id IN (SELECT id FROM subtree) {row_conditions}
+    RETURNING id, name, parent_id, version
+"""
+RESTORE_QUERY = """
+    {subtree}
+    UPDATE course SET
+        deleted_at = NULL,
+        deletion_id = NULL,
+        parent_id = CASE WHEN id = :course_id THEN CAST(:parent_id AS INTEGER) ELSE parent_id END,
+        version = version + 1
+    WHERE id IN (SELECT id FROM subtree)
+    RETURNING id, name, parent_id, version
+"""
+SUBTREE_ROWS_QUERY = """
+    {subtree}
+    SELECT c.id, c.name, c.parent_id, c.version, c.deleted_at
+    FROM subtree s INNER JOIN course c ON c.id = s.id
+    WHERE 1 = 1 {row_conditions}
+    {lock}
+"""
+PURGE_QUERY = """
+    {subtree}
+    DELETE FROM course WHERE id IN (SELECT id FROM subtree)
+"""
+PURGE_PREREQUISITES_QUERY = """
+    {subtree}
+    DELETE FROM course_prerequisite
+    WHERE course_id IN (SELECT id FROM subtree) OR prerequisite_id IN (SELECT id FROM subtree)
+"""
+SUBTREE_PREREQUISITES_QUERY = """
+    {subtree}
+    SELECT course_id, prerequisite_id FROM course_prerequisite
+    WHERE course_id IN (SELECT id FROM subtree)
+"""
+# Prerequisites linking the courses of one deletion to anything else; links
+# among them are kept so restoring the deletion brings them back, the others
+# are gone for good
+BOUNDARY_PREREQUISITES_QUERY = """
+    {subtree}
+    DELETE FROM course_prerequisite
+    WHERE (course_id IN ({members}) AND prerequisite_id NOT IN ({members}))
+        OR (prerequisite_id IN ({members}) AND course_id NOT IN ({members}))
+"""
+DELETION_MEMBERS = (
+    "SELECT id FROM course WHERE map_id = :map_id AND deleted_at IS NOT NULL AND deletion_id = :deletion_id"
+)
+SUBTREE_MEMBERS = "SELECT id FROM subtree"
+
+# :parent_id and its ancestors; a move is refused when it would put a course below itself
+MOVE_ANCESTORS = """
+    WITH RECURSIVE new_ancestors(id, depth) AS (
+        SELECT id, 0 FROM course WHERE id = :parent_id AND map_id = :map_id AND deleted_at IS NULL
+        UNION ALL
+        SELECT c.parent_id, a.depth + 1 FROM course c
+        INNER JOIN new_ancestors a ON c.id = a.id
+        WHERE c.parent_id IS NOT NULL AND a.depth < :max_depth
+    )
+"""
+MOVE_QUERY = """
+    {ancestors}
+    UPDATE course SET parent_id = :parent_id, version = version + 1
+    WHERE id IN :ids AND map_id = :map_id AND deleted_at IS NULL {conditions}
+    RETURNING id, name, parent_id, version
+"""
+MOVE_CONDITIONS = """
+    AND EXISTS (SELECT 1 FROM new_ancestors)
+    AND NOT EXISTS (SELECT 1 FROM new_ancestors WHERE id IN :ids)
+"""
+
+def _statement(template: str, state: Optional[str] = "live", conditions: str = "", **fragments):
+    """`template` with the walk from :course_id through courses in `state`, if any"""
+    walk = ""
+    if state is not None:
+        walk = SUBTREE.format(
+            root_state=STATES[state].format(alias=""),
+            child_state=STATES[state].format(alias="c."),
+            conditions=conditions,
+        )
+    query = template.format(subtree=walk, **fragments)
+    statement = text(query)
+    if ":deleted_at" in query:
+        # Typed so SQLite stores the timestamp in the text form it is read back in
+        statement = statement.bindparams(bindparam("deleted_at", type_=Course.deleted_at.type))
+    return statement
+
+def _walk_params(map_id: int, course_id: int, subtree: bool, **params) -> dict:
+    """Without `subtree` the walk stops at the course itself"""
+    return {"map_id": map_id, "course_id": course_id, "max_depth": MAX_WALK_DEPTH if subtree else 0, **params}
+
+def new_deletion_id() -> str:
+    """Marks the courses of one delete, so they are restored together and only
+    with each other"""
+    return uuid.uuid4().hex
+
+def _node(row, version: Optional[int] = None) -> GraphNode:
+    return GraphNode(id=row.id, name=row.name, parent_id=row.parent_id, version=version)
+
+class SubtreeService:
+    """Deletes, restores and moves whole branches of the course tree, each with a
+    handful of statements however large the branch is"""
+
+    @staticmethod
+    async def _live_parent_name(db: AsyncSession, parent_id: Optional[int]) -> Optional[str]:
+        if parent_id is None:
+            return None
+        result = await db.execute(
+            select(Course.name).where(Course.id == parent_id, Course.deleted_at.is_(None))
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def _not_matched(
+        db: AsyncSession, map_id: int, course_id: int, expected_version: Optional[int], live: bool
+    ):
+        """Raise 409 when a delete matched nothing because If-Match named an old
+        version; otherwise the course is missing"""
+        result = await db.execute(
+            select(Course.version, Course.deleted_at).where(Course.id == course_id, Course.map_id == map_id)
+        )
+        row = result.one_or_none()
+        if row is None or (live and row.deleted_at is not None):
+            return
+        if expected_version is not None and row.version != expected_version:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Course {course_id} is at version {row.version}, not {expected_version}",
+            )
+
+    @staticmethod
+    async def _detach_children(db: AsyncSession, map_id: int, course_id: int, live_only: bool) -> List[dict]:
+        """Children lose their parent, which is a change to their rows too"""
+        query = update(Course).where(Course.map_id == map_id, Course.parent_id == course_id)
+        if live_only:
+            query = query.where(Course.deleted_at.is_(None))
+        detached = await db.execute(
+            query.values(parent_id=None, version=Course.version + 1)
+            .returning(Course.id, Course.name, Course.version, Course.deleted_at)
+        )
+        changes = []
+        for child in detached:
+            if child.deleted_at is None:
+                changes.extend(GraphService.course_changes(
+                    GraphNode(id=child.id, name=child.name, parent_id=course_id, version=child.version - 1),
+                    GraphNode(id=child.id, name=child.name, version=child.version),
+                ))
+        return changes
+
+    @staticmethod
+    async def _soft_delete(
+        db: AsyncSession, map_id: int, course_id: int, expected_version: Optional[int], subtree: bool
+    ) -> tuple:
+        deletion_id = new_deletion_id()
+        params = _walk_params(
+            map_id, course_id, subtree, deleted_at=datetime.now(timezone.utc), deletion_id=deletion_id
+        )
+        conditions = row_conditions = ""
+        if expected_version is not None:
+            conditions = VERSION_CONDITION
+            row_conditions = ROW_VERSION_CONDITION.format(alias="")
+            params["expected_version"] = expected_version
+        result = await db.execute(
+            _statement(SOFT_DELETE_QUERY, "live", conditions, row_conditions=row_conditions), params
+        )
+        rows = result.all()
+        if not any(row.id == course_id for row in rows):
+            return [], []
+
+        changes = []
+        for row in rows:
+            changes.extend(GraphService.course_changes(_node(row, row.version - 1), None))
+        # Detached children are changed rows, not deleted ones
+        child_changes = [] if subtree else await SubtreeService._detach_children(
+            db, map_id, course_id, live_only=True
+        )
+        changes.extend(child_changes)
+
+        ids = [row.id for row in rows]
+        if ClosureService.enabled:
+            deleted = set(ids)
+            detached = [change["node"].id for change in child_changes if change.get("node") is not None]
+            parent_affected = await ClosureService.descendants(db, "parent", detached)
+            prerequisite_affected = [
+                affected for affected in await ClosureService.descendants(db, "prerequisite", ids)
+                if affected not in deleted
+            ]
+        await db.execute(
+            _statement(BOUNDARY_PREREQUISITES_QUERY, None, members=DELETION_MEMBERS),
+            {"map_id": map_id, "deletion_id": deletion_id},
+        )
+        if ClosureService.enabled:
+            await ClosureService.remove_courses(db, ids)
+            await ClosureService.recompute(db, "parent", parent_affected)
+            await ClosureService.recompute(db, "prerequisite", prerequisite_affected)
+        return rows, changes
+
+    @staticmethod
+    async def _purge(
+        db: AsyncSession, map_id: int, course_id: int, expected_version: Optional[int], subtree: bool
+    ) -> tuple:
+        params = _walk_params(map_id, course_id, subtree)
+        conditions = row_conditions = ""
+        if expected_version is not None:
+            conditions = VERSION_CONDITION
+            row_conditions = ROW_VERSION_CONDITION.format(alias="c.")
+            params["expected_version"] = expected_version
+        # Locked, so the rows cannot change before the deletes below; SQLite
+        # serializes writers anyway
+        lock = "FOR UPDATE OF c" if db.bind.dialect.name == "postgresql" else ""
+        result = await db.execute(
+            _statement(SUBTREE_ROWS_QUERY, "any", conditions, row_conditions=row_conditions, lock=lock), params
+        )
+        rows = result.all()
+        if not any(row.id == course_id for row in rows):
+            return [], []
+
+        # Deleted courses already left the graph when they were soft-deleted
+        changes = []
+        for row in rows:
+            if row.deleted_at is None:
+                changes.extend(GraphService.course_changes(_node(row, row.version), None))
+        child_changes = [] if subtree else await SubtreeService._detach_children(
+            db, map_id, course_id, live_only=False
+        )
+        changes.extend(child_changes)
+
+        ids = [row.id for row in rows]
+        if ClosureService.enabled:
+            deleted = set(ids)
+            detached = [change["node"].id for change in child_changes if change.get("node") is not None]
+            parent_affected = await ClosureService.descendants(db, "parent", detached)
+            prerequisite_affected = [
+                affected for affected in await ClosureService.descendants(db, "prerequisite", ids)
+                if affected not in deleted
+            ]
+            await ClosureService.remove_courses(db, ids)
+        await db.execute(_statement(PURGE_PREREQUISITES_QUERY, "any", conditions), params)
+        await db.execute(_statement(PURGE_QUERY, "any", conditions), params)
+        if ClosureService.enabled:
+            await ClosureService.recompute(db, "parent", parent_affected)
+            await ClosureService.recompute(db, "prerequisite", prerequisite_affected)
+        return rows, changes
+
+    @staticmethod
+    async def delete_course(
+        db: AsyncSession,
+        map_id: int,
+        course_id: int,
+        expected_version: Optional[int] = None,
+        subtree: bool = False,
+        permanent: bool = False,
+    ) -> Optional[CourseSubtreeChange]:
+        """Delete a course, or with `subtree` the whole branch below it, in one
+        transaction. Deletes are soft unless `permanent`, which also purges
+        courses already deleted. Without `subtree` children are detached"""
+        try:
+            if permanent:
+                rows, changes = await SubtreeService._purge(db, map_id, course_id, expected_version, subtree)
+            else:
+                rows, changes = await SubtreeService._soft_delete(db, map_id, course_id, expected_version, subtree)
+            if not rows:
+                await SubtreeService._not_matched(db, map_id, course_id, expected_version, live=not permanent)
+                await db.rollback()
+                return None
+            root = next(row for row in rows if row.id == course_id)
+            parent_name = await SubtreeService._live_parent_name(db, root.parent_id)
+            version = await GraphService.record_changes(db, map_id, changes)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        GraphService.publish_changes(map_id, version, changes)
+        return CourseSubtreeChange(
+            id=root.id,
+            name=root.name,
+            parent_id=root.parent_id,
+            parent_name=parent_name,
+            version=root.version,
+            courses=len(rows),
+        )
+
+    @staticmethod
+    async def restore_course(db: AsyncSession, map_id: int, course_id: int) -> Optional[CourseSubtreeChange]:
+        """Undo a soft delete: the course comes back with the courses below it that
+        the same delete took down and the prerequisites among them. Prerequisites
+        to other courses were dropped by the delete and stay lost. Its parent is
+        kept if still live"""
+        try:
+            result = await db.execute(
+                select(Course.parent_id, Course.deleted_at, Course.deletion_id)
+                .where(Course.id == course_id, Course.map_id == map_id)
+            )
+            root = result.one_or_none()
+            if root is None:
+                return None
+            if root.deleted_at is None:
+                raise HTTPException(status_code=409, detail=f"Course {course_id} is not deleted")
+            # A parent deleted on its own since then leaves the course at the top level
+            parent_name = await SubtreeService._live_parent_name(db, root.parent_id)
+            parent_id = root.parent_id if parent_name is not None else None
+
+            params = _walk_params(map_id, course_id, True, deletion_id=root.deletion_id, parent_id=parent_id)
+            # Courses of the same deletion outside this branch stay deleted
+            await db.execute(
+                _statement(BOUNDARY_PREREQUISITES_QUERY, "deletion", members=SUBTREE_MEMBERS), params
+            )
+            result = await db.execute(_statement(SUBTREE_PREREQUISITES_QUERY, "deletion"), params)
+            prerequisites = result.all()
+            try:
+                result = await db.execute(_statement(RESTORE_QUERY, "deletion"), params)
+            except IntegrityError:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Course {course_id} or a course below it has a name a live course took since",
+                )
+            rows = result.all()
+            if ClosureService.enabled:
+                await ClosureService.add_courses(db, [row.id for row in rows])
+            changes = []
+            for row in rows:
+                changes.extend(GraphService.course_changes(None, _node(row, row.version)))
+            changes.extend(
+                {"op": "upsert", "edge": GraphEdge(source=edge.prerequisite_id, target=edge.course_id, type="prerequisite")}
+                for edge in prerequisites
+            )
+            version = await GraphService.record_changes(db, map_id, changes)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        GraphService.publish_changes(map_id, version, changes)
+        restored = next(row for row in rows if row.id == course_id)
+        return CourseSubtreeChange(
+            id=restored.id,
+            name=restored.name,
+            parent_id=restored.parent_id,
+            parent_name=parent_name,
+            version=restored.version,
+            courses=len(rows),
+        )
+
+    @staticmethod
+    async def move_courses(db: AsyncSession, map_id: int, move: CourseMove) -> List[CourseSchema]:
+        """Reparent several courses, with the branches below them, in one statement"""
+        ids = list(dict.fromkeys(move.ids))
+        try:
+            result = await db.execute(
+                select(Course.id, Course.name, Course.parent_id, Course.version)
+                .where(Course.id.in_(ids), Course.map_id == map_id, Course.deleted_at.is_(None))
+                .with_for_update()
+            )
+            old = {row.id: row for row in result}
+            missing = [course_id for course_id in ids if course_id not in old]
+            if missing:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Courses not found: {', '.join(str(course_id) for course_id in missing)}",
+                )
+
+            ancestors = ""
+            conditions = ""
+            parent_name = None
+            if move.parent_id is not None:
+                result = await db.execute(
+                    text(MOVE_ANCESTORS + "SELECT id FROM new_ancestors"),
+                    {"map_id": map_id, "parent_id": move.parent_id, "max_depth": MAX_WALK_DEPTH},
+                )
+                new_ancestors = result.scalars().all()
+                if not new_ancestors:
+                    raise HTTPException(status_code=404, detail=f"Parent course {move.parent_id} not found")
+                cycle = [course_id for course_id in new_ancestors if course_id in old]
+                if cycle:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Moving course {cycle[0]} below course {move.parent_id} would create a cycle",
+                    )
+                ancestors, conditions = MOVE_ANCESTORS, MOVE_CONDITIONS
+                parent_name = await SubtreeService._live_parent_name(db, move.parent_id)
+
+            moved = [course_id for course_id in ids if old[course_id].parent_id != move.parent_id]
+            versions = {course_id: old[course_id].version for course_id in ids}
+            changes = []
+            if moved:
+                statement = text(MOVE_QUERY.format(ancestors=ancestors, conditions=conditions)).bindparams(
+                    bindparam("ids", expanding=True)
+                )
+                result = await db.execute(
+                    statement,
+                    {"ids": moved, "map_id": map_id, "parent_id": move.parent_id, "max_depth": MAX_WALK_DEPTH},
+                )
+                rows = result.all()
+                if len(rows) != len(moved):
+                    raise HTTPException(
+                        status_code=409,
+                        detail="Courses are being changed concurrently; retry the move",
+                    )
+                for row in rows:
+                    versions[row.id] = row.version
+                    changes.extend(GraphService.course_changes(
+                        _node(old[row.id], row.version - 1), _node(row, row.version)
+                    ))
+                    if ClosureService.enabled:
+                        await ClosureService.move_course(db, row.id, move.parent_id)
+                version = await GraphService.record_changes(db, map_id, changes)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        if changes:
+            GraphService.publish_changes(map_id, version, changes)
+        return [
+            CourseSchema(
+                id=course_id,
+                name=old[course_id].name,
+                parent_id=move.parent_id,
+                parent_name=parent_name,
+                version=versions[course_id],
+            )
+            for course_id in ids
+        ]
+
+    @staticmethod
+    async def get_deleted_courses(db: AsyncSession, map_id: int, limit: int = 100) -> List[Dict]:
+        """The map's soft-deleted courses, most recently deleted first"""
+        result = await db.execute(
+            select(
+                Course.id,
+                Course.name,
+                Course.parent_id,
+                Parent.name.label("parent_name"),
+                Course.deleted_at,
+            )
+            .outerjoin(Parent, Parent.id == Course.parent_id)
+            .where(Course.map_id == map_id, Course.deleted_at.is_not(None))
+            .order_by(Course.deleted_at.desc(), Course.id)
+            .limit(limit)
+        )
+        return [dict(row._mapping) for row in result]
@@ -0,0 +1,462 @@
+"""Reproducible load test for the /api/v1/courses endpoints.
+
+Generates a synthetic course graph (a deep parent chain, a wide fan-out tree
+or a random DAG, each with prerequisites), loads it into a scratch database
+and drives every course endpoint with concurrent async clients. Prints one
+JSON report with throughput, p50/p95/p99 latency and SQL statements per
+request for each scenario, so runs on different commits can be diffed.
+
+    python -m benchmarks.api_load --shape dag --nodes 10000 --concurrency 16
+    DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.api_load --shape chain --nodes 100000
+
+By default the app runs in-process over an ASGI transport (no sockets) against
+a temporary SQLite file. --base-url drives a running server instead; the graph
+is still loaded through DATABASE_URL, which must be the server's database.
+DATABASE_URL must point at a throwaway database: its tables are emptied.
+Statement counts come from the Server-Timing header, so a remote server has to
+run with SLOW_REQUEST_MS=0 for them to be reported; streamed responses have none.
+The clients use httpx (pip install httpx), which the app itself does not need.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "api_load.db"
+    )
+# Every in-process response carries Server-Timing, which holds the statement count
+os.environ.setdefault("SLOW_REQUEST_MS", "0")
+
+import httpx
+from sqlalchemy import delete, text
+
+from app.core.db import AsyncSessionLocal, Base, async_engine
+from app.core.maps import DEFAULT_MAP_ID
+from app.models.course import Course, course_prerequisite
+from app.services.bulk_service import BulkService
+from app.services.closure_service import ClosureService
+from app.services.course_service import CourseService
+from app.services.graph_service import GraphService, map_graphs
+
+API = "/api/v1"
+SHAPES = ("chain", "fan", "dag")
+WORDS = (
+    "algebra", "calculus", "geometry", "statistics", "physics", "chemistry",
+    "biology", "networks", "compilers", "databases", "graphics", "security",
+    "robotics", "economics", "history", "philosophy", "linguistics", "music",
+)
+# Scenarios that read the whole catalog run this many times fewer requests
+HEAVY_SCENARIO_DIVISOR = 50
+IMPORT_RECORDS = 10
+BATCH_OPERATIONS = 10
+# Bodies produced after the headers are sent, so Server-Timing cannot count their statements
+STREAMED_MEDIA_TYPES = ("application/x-ndjson", "text/csv")
+
+
+class SyntheticGraph:
+    """Courses 1..n with parents and prerequisites that only point at lower ids"""
+
+    def __init__(self, shape: str, nodes: int, fanout: int, prerequisites: int, seed: int):
+        rng = random.Random(seed)
+        self.shape = shape
+        self.names = [None] + [
+            f"{WORDS[i % len(WORDS)].title()} {WORDS[(i // len(WORDS)) % len(WORDS)].title()} {i}"
+            for i in range(1, nodes + 1)
+        ]
+        self.parents: List[Optional[int]] = [None] * (nodes + 1)
+        self.edges: List[Tuple[int, int]] = []
+        for i in range(2, nodes + 1):
+            if shape == "chain":
+                self.parents[i] = i - 1
+                self.edges.append((i, i - 1))
+            elif shape == "fan":
+                parent_id = (i - 2) // fanout + 1
+                self.parents[i] = parent_id
+                self.edges.append((i, parent_id))
+            else:
+                self.parents[i] = rng.randrange(1, i) if rng.random() < 0.9 else None
+                for prerequisite_id in rng.sample(range(1, i), min(prerequisites, i - 1)):
+                    self.edges.append((i, prerequisite_id))
+        self.children = [i for i in range(1, nodes + 1) if self.parents[i] is not None]
+        self.parent_ids = sorted({self.parents[i] for i in self.children})
+
+    @property
+    def size(self) -> int:
+        return len(self.names) - 1
+
+
+async def load(graph: SyntheticGraph) -> float:
+    """Replace the database contents with the graph; returns the load time"""
+    started = time.perf_counter()
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Emptied rather than dropped so indexes created by migrations survive
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(delete(table))
+
+    async with AsyncSessionLocal() as db:
+        await BulkService._insert_rows(
+            db, Course.__table__, ["id", "name", "parent_id"],
+            [(i, graph.names[i], graph.parents[i]) for i in range(1, graph.size + 1)],
+        )
+        await BulkService._insert_rows(db, course_prerequisite, ["course_id", "prerequisite_id"], graph.edges)
+        if db.bind.dialect.name == "postgresql":
+            await db.execute(text("SELECT setval(pg_get_serial_sequence('course', 'id'), :n)"), {"n": graph.size})
+        if ClosureService.enabled:
+            await ClosureService.rebuild(db)
+        await GraphService.bump_version(db, DEFAULT_MAP_ID)
+        await db.commit()
+    return time.perf_counter() - started
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def statement_count(server_timing: Optional[str]) -> Optional[int]:
+    # db;dur=1.2;desc="3 queries", ...
+    if not server_timing or 'desc="' not in server_timing:
+        return None
+    return int(server_timing.split('desc="', 1)[1].split(" ", 1)[0])
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statements: List[int] = []
+        self.statuses: Counter = Counter()
+
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.append(time.perf_counter() - started)
+        self.statuses[response.status_code] += 1
+        count = statement_count(response.headers.get("server-timing"))
+        if count is not None and not response.headers.get("content-type", "").startswith(STREAMED_MEDIA_TYPES):
+            self.statements.append(count)
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        ms = lambda seconds: round(seconds * 1000, 3)
+        errors = sum(count for status, count in self.statuses.items() if status >= 500)
+        return {
+            "requests": len(self.latencies),
+            "errors": errors,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "throughput_rps": round(len(self.latencies) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": ms(percentile(self.latencies, 50)),
+            "p95_ms": ms(percentile(self.latencies, 95)),
+            "p99_ms": ms(percentile(self.latencies, 99)),
+            "max_ms": ms(max(self.latencies, default=0.0)),
+            "queries_per_request": (
+                round(sum(self.statements) / len(self.statements), 2) if self.statements else None
+            ),
+            "max_queries": max(self.statements, default=None),
+        }
+
+
+class LoadState:
+    """Courses created during the run, which the later write scenarios edit and delete"""
+
+    def __init__(self, graph: SyntheticGraph):
+        self.graph = graph
+        self.created: List[int] = []
+        self.linked: List[Tuple[int, int]] = []
+        self.serial = 0
+
+    def name(self, prefix: str) -> str:
+        self.serial += 1
+        return f"{prefix} {self.serial}"
+
+    def course_id(self, rng: random.Random) -> int:
+        return rng.randint(1, self.graph.size)
+
+
+Scenario = Callable[[httpx.AsyncClient, Recorder, random.Random, LoadState], Awaitable[None]]
+
+
+async def list_offset(client, recorder, rng, state):
+    skip = rng.randrange(0, max(1, state.graph.size - 100))
+    await recorder.call(client, "GET", f"{API}/courses/", params={"skip": skip, "limit": 100})
+
+
+async def list_keyset(client, recorder, rng, state):
+    cursor = CourseService.encode_cursor(state.course_id(rng) - 1)
+    await recorder.call(client, "GET", f"{API}/courses/", params={"cursor": cursor, "limit": 100})
+
+
+async def list_ndjson(client, recorder, rng, state):
+    cursor = CourseService.encode_cursor(state.course_id(rng) - 1)
+    await recorder.call(
+        client, "GET", f"{API}/courses/",
+        params={"cursor": cursor, "limit": 1000, "fields": "id,name", "format": "ndjson"},
+    )
+
+
+async def get_course(client, recorder, rng, state):
+    await recorder.call(client, "GET", f"{API}/courses/{state.course_id(rng)}")
+
+
+async def get_course_dependencies(client, recorder, rng, state):
+    course_id = rng.choice(state.graph.children)
+    await recorder.call(client, "GET", f"{API}/courses/{course_id}/dependencies")
+
+
+async def get_courses_by_parent_id(client, recorder, rng, state):
+    parent_id = rng.choice(state.graph.parent_ids)
+    await recorder.call(client, "GET", f"{API}/courses/parent/{parent_id}")
+
+
+async def get_prerequisites(client, recorder, rng, state):
+    await recorder.call(client, "GET", f"{API}/courses/{state.course_id(rng)}/prerequisites")
+
+
+async def get_dependents(client, recorder, rng, state):
+    await recorder.call(client, "GET", f"{API}/courses/{state.course_id(rng)}/dependents")
+
+
+async def get_learning_path(client, recorder, rng, state):
+    await recorder.call(client, "GET", f"{API}/courses/{state.course_id(rng)}/learning-path")
+
+
+async def search(client, recorder, rng, state):
+    word = rng.choice(WORDS)
+    if rng.random() < 0.5:
+        # One dropped letter exercises typo correction
+        position = rng.randrange(1, len(word))
+        word = word[:position] + word[position + 1:]
+    await recorder.call(client, "GET", f"{API}/courses/search", params={"q": word[:rng.randint(3, len(word))]})
+
+
+async def export(client, recorder, rng, state):
+    await recorder.call(client, "GET", f"{API}/courses/export")
+
+
+async def create(client, recorder, rng, state):
+    payload = {"name": state.name("Load Create"), "parent_name": state.graph.names[state.course_id(rng)]}
+    response = await recorder.call(client, "POST", f"{API}/courses/", json=payload)
+    if response.status_code == 200:
+        state.created.append(response.json()["id"])
+
+
+async def update(client, recorder, rng, state):
+    if not state.created:
+        return
+    course_id = rng.choice(state.created)
+    payload = {"name": state.name("Load Update"), "parent_name": state.graph.names[state.course_id(rng)]}
+    await recorder.call(client, "PUT", f"{API}/courses/{course_id}", json=payload)
+
+
+async def add_prerequisite(client, recorder, rng, state):
+    if not state.created:
+        return
+    # Created courses have no dependents, so these edges can never close a cycle
+    course_id, prerequisite_id = rng.choice(state.created), state.course_id(rng)
+    response = await recorder.call(client, "POST", f"{API}/courses/{course_id}/prerequisites/{prerequisite_id}")
+    if response.status_code == 204:
+        state.linked.append((course_id, prerequisite_id))
+
+
+async def remove_prerequisite(client, recorder, rng, state):
+    if not state.linked:
+        return
+    course_id, prerequisite_id = state.linked.pop()
+    await recorder.call(client, "DELETE", f"{API}/courses/{course_id}/prerequisites/{prerequisite_id}")
+
+
+async def delete_course(client, recorder, rng, state):
+    if not state.created:
+        return
+    await recorder.call(client, "DELETE", f"{API}/courses/{state.created.pop()}")
+
+
+async def batch(client, recorder, rng, state):
+    operations = [
+        {"op": "create", "name": state.name("Load Batch"), "parent_name": state.graph.names[state.course_id(rng)]}
+        for _ in range(BATCH_OPERATIONS // 2)
+    ]
+    # Rename courses created earlier in the run; the new ones are only created
+    renamed = rng.sample(state.created, min(len(state.created), BATCH_OPERATIONS - len(operations)))
+    operations += [{"op": "update", "id": course_id, "name": state.name("Load Batch")} for course_id in renamed]
+    response = await recorder.call(client, "POST", f"{API}/courses/batch", json={"operations": operations})
+    if response.status_code == 200:
+        state.created.extend(
+            result["course"]["id"] for result in response.json()["results"] if result["op"] == "create"
+        )
+
+
+async def import_courses(client, recorder, rng, state):
+    records = [
+        json.dumps({
+            "name": state.name("Load Import"),
+            "parent_name": state.graph.names[state.course_id(rng)],
+            "prerequisites": [state.graph.names[state.course_id(rng)]],
+        })
+        for _ in range(IMPORT_RECORDS)
+    ]
+    await recorder.call(
+        client, "POST", f"{API}/courses/import", params={"format": "jsonl"},
+        content="\n".join(records).encode(),
+    )
+
+
+# Writes run after the reads and in this order, so updates, prerequisite edits
+# and deletes work on the courses the earlier scenarios created
+SCENARIOS: Dict[str, Scenario] = {
+    "list_offset": list_offset,
+    "list_keyset": list_keyset,
+    "list_ndjson": list_ndjson,
+    "get_course": get_course,
+    "get_course_dependencies": get_course_dependencies,
+    "get_courses_by_parent_id": get_courses_by_parent_id,
+    "get_prerequisites": get_prerequisites,
+    "get_dependents": get_dependents,
+    "get_learning_path": get_learning_path,
+    "search": search,
+    "export": export,
+    "create": create,
+    "update": update,
+    "add_prerequisite": add_prerequisite,
+    "remove_prerequisite": remove_prerequisite,
+    "batch": batch,
+    "import": import_courses,
+    "delete": delete_course,
+}
+HEAVY_SCENARIOS = {"export", "import"}
+WRITE_SCENARIOS = {"create", "update", "add_prerequisite", "remove_prerequisite", "batch", "import", "delete"}
+
+
+async def run_scenario(client, scenario: Scenario, state: LoadState, requests: int, concurrency: int, seed: int):
+    recorder = Recorder()
+    remaining = iter(range(requests))
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        for _ in remaining:
+            await scenario(client, recorder, rng, state)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return recorder.report(time.perf_counter() - started)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    graph = SyntheticGraph(args.shape, args.nodes, args.fanout, args.prerequisites, args.seed)
+    load_seconds = await load(graph)
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    else:
+        from app.main import app
+
+        if args.no_cache:
+            map_graphs.disable()
+        else:
+            async with AsyncSessionLocal() as db:
+                await GraphService.load_cache(db, DEFAULT_MAP_ID)
+        client = httpx.AsyncClient(
+            # Unhandled errors become 500s in the report instead of aborting the run
+            transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+            base_url="http://load", timeout=args.timeout,
+        )
+
+    state = LoadState(graph)
+    selected = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    write_concurrency = args.write_concurrency
+    if write_concurrency is None:
+        # SQLite has a single writer; concurrent writes only measure lock timeouts
+        write_concurrency = 1 if async_engine.dialect.name == "sqlite" else args.concurrency
+    results = {}
+    async with client:
+        for name in selected:
+            requests = args.requests
+            if name in HEAVY_SCENARIOS:
+                requests = max(1, requests // HEAVY_SCENARIO_DIVISOR)
+            concurrency = write_concurrency if name in WRITE_SCENARIOS else args.concurrency
+            results[name] = await run_scenario(
+                client, SCENARIOS[name], state, requests, concurrency, args.seed,
+            )
+
+    return {
+        "commit": git_commit(),
+        "database": async_engine.dialect.name,
+        "target": args.base_url or "in-process",
+        "graph_cache": None if args.base_url else not args.no_cache,
+        "closure_table": ClosureService.enabled,
+        "shape": args.shape,
+        "nodes": graph.size,
+        "prerequisites": len(graph.edges),
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "write_concurrency": write_concurrency,
+        "load_seconds": round(load_seconds, 3),
+        "scenarios": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shape", choices=SHAPES, default="dag")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--fanout", type=int, default=100, help="children per course for --shape fan")
+    parser.add_argument("--prerequisites", type=int, default=2, help="prerequisites per course for --shape dag")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--write-concurrency", type=int,
+        help="clients for the write scenarios (default: 1 on SQLite, --concurrency otherwise)",
+    )
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--no-cache", action="store_true", help="disable the in-process graph cache")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.scenarios:
+        unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Every request is "slow" at SLOW_REQUEST_MS=0; keep the log quiet
+    logging.getLogger("app.slow_requests").setLevel(logging.ERROR)
+    async_engine.echo = False
+
+    async def run_and_dispose():
+        try:
+            return await run(args)
+        finally:
+            await async_engine.dispose()
+
+    report = asyncio.run(run_and_dispose())
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 1 if any(result["errors"] for result in report["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
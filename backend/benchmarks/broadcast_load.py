@@ -0,0 +1,94 @@
+"""Fan-out load test for the graph event broker.
+
+Simulates thousands of SSE subscribers on one event loop (a single uvicorn
+worker), publishes a burst of graph events and reports broadcast latency
+from publish() to delivery. A fraction of subscribers consume slowly to show
+that they are dropped instead of stalling the publisher.
+
+    python -m benchmarks.broadcast_load --subscribers 5000 --events 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from app.core.events import GraphEventBroker
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def consume(subscription, published, latencies, delay):
+    async for frame in subscription.frames():
+        if frame.startswith(b"id: ") and not delay:
+            event_id = int(frame[4:frame.index(b"\n")])
+            latencies.append(time.perf_counter() - published[event_id])
+        if delay:
+            await asyncio.sleep(delay)
+
+
+async def run(subscribers: int, events: int, interval: float, slow_ratio: float, queue_size: int):
+    broker = GraphEventBroker(queue_size=queue_size)
+    published = {}
+    latencies = []
+    slow = int(subscribers * slow_ratio)
+    consumers = [
+        asyncio.create_task(
+            consume(broker.subscribe(), published, latencies, 0.5 if i < slow else 0)
+        )
+        for i in range(subscribers)
+    ]
+    await asyncio.sleep(0)
+
+    payload = json.dumps({"version": 0, "changes": [{"op": "upsert", "node": {"id": 1, "name": "x" * 64}}]})
+    publish_times = []
+    for event_id in range(1, events + 1):
+        published[event_id] = time.perf_counter()
+        broker.publish(payload, event_id=event_id)
+        publish_times.append(time.perf_counter() - published[event_id])
+        await asyncio.sleep(interval)
+
+    await asyncio.sleep(0.1)
+    remaining = broker.subscriber_count
+    broker.close()
+    await asyncio.gather(*consumers)
+
+    ms = [value * 1000 for value in latencies]
+    return {
+        "subscribers": subscribers,
+        "slow_subscribers": slow,
+        "dropped_subscribers": subscribers - remaining,
+        "events": events,
+        "fast_deliveries": len(latencies),
+        "publish_ms_mean": round(statistics.mean(publish_times) * 1000, 3),
+        "publish_ms_max": round(max(publish_times) * 1000, 3),
+        "latency_ms_p50": round(percentile(ms, 50), 3),
+        "latency_ms_p95": round(percentile(ms, 95), 3),
+        "latency_ms_p99": round(percentile(ms, 99), 3),
+        "latency_ms_max": round(max(ms, default=0), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between events")
+    parser.add_argument("--slow-ratio", type=float, default=0.01)
+    parser.add_argument("--queue-size", type=int, default=100)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    result = asyncio.run(
+        run(args.subscribers, args.events, args.interval, args.slow_ratio, args.queue_size)
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
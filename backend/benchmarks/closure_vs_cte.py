@@ -0,0 +1,127 @@
+"""Compare recursive-CTE and closure-table lookups on deep and wide course trees.
+
+Each shape is loaded with matching parent and prerequisite edges (a child
+requires its parent). The script then times ancestor lookups from the deepest
+leaf and dependent lookups from the root, with the closure table off (CTE) and
+on (indexed closure scan).
+
+    DATABASE_URL=postgresql+asyncpg://.../scratch python -m benchmarks.closure_vs_cte
+
+DATABASE_URL must point at a throwaway database: its tables are dropped.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "closure_vs_cte.db"
+    )
+
+from sqlalchemy import insert
+
+from app.core.db import AsyncSessionLocal, Base, async_engine
+from app.core.maps import DEFAULT_MAP_ID
+from app.models.course import Course, course_prerequisite
+from app.services.closure_service import ClosureService
+from app.services.course_service import CourseService
+from app.services.graph_service import map_graphs
+from app.services.prerequisite_service import PrerequisiteService
+
+REPEAT = 20
+
+
+def chain(depth):
+    return [(i, i - 1 if i > 1 else None) for i in range(1, depth + 2)]
+
+
+def wide(fanout, levels):
+    nodes = [(1, None)]
+    frontier = [1]
+    for _ in range(levels):
+        next_frontier = []
+        for parent in frontier:
+            for _ in range(fanout):
+                nodes.append((len(nodes) + 1, parent))
+                next_frontier.append(len(nodes))
+        frontier = next_frontier
+    return nodes
+
+
+SHAPES = {
+    "chain_depth_50": chain(50),
+    "chain_depth_200": chain(200),
+    "chain_depth_1000": chain(1000),
+    "wide_fanout_10_depth_4": wide(10, 4),
+    "wide_fanout_4_depth_7": wide(4, 7),
+}
+
+
+async def load(nodes):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(Course), [{"id": i, "name": f"course-{i}", "parent_id": p} for i, p in nodes]
+        )
+        edges = [{"course_id": i, "prerequisite_id": p} for i, p in nodes if p]
+        for start in range(0, len(edges), 5000):
+            await conn.execute(insert(course_prerequisite), edges[start:start + 5000])
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await ClosureService.rebuild(db)
+        await db.commit()
+        return time.perf_counter() - started
+
+
+async def timed(call):
+    samples = []
+    rows = 0
+    for _ in range(REPEAT):
+        async with AsyncSessionLocal() as db:
+            started = time.perf_counter()
+            rows = len(await call(db))
+            samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3), rows
+
+
+async def measure(nodes):
+    leaf = nodes[-1][0]
+    lookups = {
+        "parent_ancestors_of_leaf": lambda db: CourseService.get_course_dependencies(db, DEFAULT_MAP_ID, leaf),
+        "prerequisites_of_leaf": lambda db: PrerequisiteService.walk(db, DEFAULT_MAP_ID, leaf, "prerequisites"),
+        "dependents_of_root": lambda db: PrerequisiteService.walk(db, DEFAULT_MAP_ID, 1, "dependents"),
+    }
+    result = {"nodes": len(nodes), "closure_rebuild_ms": round(await load(nodes) * 1000, 3)}
+    for name, call in lookups.items():
+        ClosureService.enabled = False
+        cte_ms, rows = await timed(call)
+        ClosureService.enabled = True
+        closure_ms, _ = await timed(call)
+        result[name] = {
+            "rows": rows,
+            "cte_ms": cte_ms,
+            "closure_ms": closure_ms,
+            "speedup": round(cte_ms / closure_ms, 2) if closure_ms else None,
+        }
+    return result
+
+
+async def main():
+    map_graphs.disable()
+    shapes = sys.argv[1:] or list(SHAPES)
+    results = {
+        "database": async_engine.dialect.name,
+        "repeat": REPEAT,
+        "shapes": {name: await measure(SHAPES[name]) for name in shapes},
+    }
+    await async_engine.dispose()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""Time the in-memory graph analytics behind GET /api/v1/graph/stats.
+
+Builds synthetic prerequisite graphs as NumPy columns, the same shape
+GraphService hands to GraphAnalytics, and reports the median compute time:
+
+    random  every course requires `edges / courses` random earlier courses on
+            average and half the courses have a random earlier parent
+    chain   one prerequisite chain through every course, the deepest graph
+            for its size
+
+    python -m benchmarks.graph_stats [--courses 100000] [--edges 1000000]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# GraphAnalytics does not touch the database, but importing the app does
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "graph_stats.db"
+    )
+
+import numpy as np
+
+from app.services.graph_analytics import GraphAnalytics
+
+REPEAT = 3
+
+
+def random_graph(courses: int, edges: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, courses + 1)
+    earlier = (rng.random(courses) * np.arange(courses)).astype(np.int64) + 1
+    parent_ids = np.where((rng.random(courses) < 0.5) & (ids > 1), earlier, -1)
+    course_ids = rng.integers(2, courses + 1, edges)
+    prerequisite_ids = (rng.random(edges) * (course_ids - 1)).astype(np.int64) + 1
+    return ids, parent_ids, course_ids, prerequisite_ids
+
+
+def chain_graph(courses: int):
+    ids = np.arange(1, courses + 1)
+    return ids, np.full(courses, -1), ids[1:], ids[:-1]
+
+
+def timed(columns) -> dict:
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        analytics = GraphAnalytics(1, *columns)
+        samples.append(time.perf_counter() - started)
+    stats = analytics.stats(1)
+    return {
+        "courses": stats["courses"],
+        "prerequisite_edges": stats["prerequisite_edges"],
+        "max_prerequisite_depth": stats["max_prerequisite_depth"],
+        "transitive_dependents_exact": stats["transitive_dependents_exact"],
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, default=100_000)
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    results = {
+        "repeat": REPEAT,
+        "random": timed(random_graph(args.courses, args.edges)),
+        "chain": timed(chain_graph(args.courses)),
+    }
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
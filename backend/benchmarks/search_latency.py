@@ -0,0 +1,82 @@
+"""Time course search against the in-memory index of a cached 100k-course catalog.
+
+Course names are random combinations of subject words. The script reports how
+long the index takes to build, and then the p50/p99 latency
+of autocomplete (prefix), multi-word and misspelled queries.
+
+    python -m benchmarks.search_latency [courses]
+"""
+import json
+import random
+import statistics
+import sys
+import time
+
+from app.schemas.graph import GraphNode, GraphSnapshot
+from app.services.graph_cache import GraphCache
+from app.services.search_index import SearchIndex
+
+REPEAT = 200
+LIMIT = 10
+
+WORDS = (
+    "introduction advanced applied theoretical computational discrete linear "
+    "numerical statistical quantum organic molecular digital distributed "
+    "algorithms structures systems analysis methods design networks databases "
+    "calculus algebra geometry probability physics chemistry biology economics "
+    "programming compilers security learning vision graphics robotics logic"
+).split()
+
+QUERIES = {
+    "prefix_1": ["a", "c", "d", "p"],
+    "prefix_3": ["alg", "cal", "dat", "pro"],
+    "prefix_word": ["algorithms", "calculus", "databases", "programming"],
+    "multi_word": ["applied alg", "linear algebra", "distributed sys", "quantum phys"],
+    "word_prefix": ["networks", "sys", "geom", "learn"],
+    "typo": ["algoritms", "calclus", "databsaes", "progamming"],
+}
+
+
+def catalog(size, seed=7):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < size:
+        names.add(" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title() + f" {len(names)}")
+    nodes = [GraphNode(id=i, name=name) for i, name in enumerate(sorted(names), start=1)]
+    return GraphSnapshot(version=1, nodes=nodes, edges=[])
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    cache = GraphCache(max_nodes=size)
+    cache.load(catalog(size))
+
+    # The app builds the index in a background thread once the cache is loaded
+    started = time.perf_counter()
+    generation, names = cache.search_names()
+    cache.set_search_index(generation, SearchIndex(names))
+    result = {"courses": size, "limit": LIMIT, "index_build_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    for kind, queries in QUERIES.items():
+        samples = []
+        hits = 0
+        for i in range(REPEAT):
+            query = queries[i % len(queries)]
+            started = time.perf_counter()
+            hits += len(cache.search(query, LIMIT))
+            samples.append((time.perf_counter() - started) * 1000)
+        result[kind] = {
+            "p50_ms": round(statistics.median(samples), 3),
+            "p99_ms": round(percentile(samples, 0.99), 3),
+            "mean_results": round(hits / REPEAT, 1),
+        }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
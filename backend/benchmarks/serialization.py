@@ -0,0 +1,106 @@
+"""Time building and serializing course list responses, per 10k rows.
+
+Compares the previous path, where a Pydantic model is built per row and FastAPI
+validates and serializes it again through `response_model`, with plain dicts
+rendered by ORJSONResponse. Also compares the NDJSON line encoders.
+
+    python -m benchmarks.serialization [rows]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from typing import List
+
+# CourseService imports the engine; no database is queried
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "serialization.db"
+    )
+
+import orjson
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.schemas.course import Course, CourseDependency
+from app.services.course_service import CourseService
+
+REPEAT = 20
+Row = namedtuple("Row", ["id", "name", "parent_id", "parent_name", "depth"])
+
+
+def rows(count: int) -> List[Row]:
+    return [
+        Row(i, f"Course {i}", i - 1 if i > 1 else None, f"Course {i - 1}" if i > 1 else None, i % 7)
+        for i in range(1, count + 1)
+    ]
+
+
+def timed(fn) -> float:
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def model_path(schema, field, data):
+    def run():
+        if schema is CourseDependency:
+            objects = [CourseDependency(**row._asdict()) for row in data]
+        else:
+            objects = [
+                Course(id=row.id, name=row.name, parent_id=row.parent_id, parent_name=row.parent_name)
+                for row in data
+            ]
+        content = asyncio.run(serialize_response(field=field, response_content=objects))
+        return JSONResponse(content).body
+    return run
+
+
+def dict_path(schema, data):
+    def run():
+        if schema is CourseDependency:
+            courses = [{**CourseService._to_dict(row), "depth": row.depth} for row in data]
+        else:
+            courses = [CourseService._to_dict(row) for row in data]
+        return ORJSONResponse(courses).body
+    return run
+
+
+def main(count: int):
+    data = rows(count)
+    per_10k = 10000 / count
+    results = {"rows": count, "repeat": REPEAT}
+
+    for schema in (Course, CourseDependency):
+        field = create_response_field(name="response", type_=List[schema], mode="serialization")
+        before = model_path(schema, field, data)
+        after = dict_path(schema, data)
+        assert orjson.loads(before()) == orjson.loads(after())
+        before_seconds, after_seconds = timed(before), timed(after)
+        results[schema.__name__] = {
+            "pydantic_response_model_ms_per_10k": round(before_seconds * 1000 * per_10k, 2),
+            "orjson_dicts_ms_per_10k": round(after_seconds * 1000 * per_10k, 2),
+            "speedup": round(before_seconds / after_seconds, 1),
+        }
+
+    courses = [CourseService._to_dict(row) for row in data]
+    json_lines = timed(lambda: "".join(json.dumps(course) + "\n" for course in courses).encode())
+    orjson_lines = timed(lambda: b"\n".join(orjson.dumps(course) for course in courses) + b"\n")
+    results["ndjson"] = {
+        "json_dumps_ms_per_10k": round(json_lines * 1000 * per_10k, 2),
+        "orjson_ms_per_10k": round(orjson_lines * 1000 * per_10k, 2),
+        "speedup": round(json_lines / orjson_lines, 1),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,135 @@
+"""Cold start of the app, as a serverless function sees it.
+
+Loads a synthetic course graph into a scratch database, then starts the app
+in fresh interpreters and reports the median time to import app.main, to run
+the lifespan startup and to answer the first and second request, for each
+startup mode:
+
+    default         .env lookup and a full graph cache load before serving
+    fast            FAST_STARTUP=1, the default on Vercel: nothing before the
+                    first request, which loads the cache on demand
+    fast+snapshot   FAST_STARTUP=1 with GRAPH_CACHE_SNAPSHOT, so the cache comes
+                    from a local file written by `python -m app.cli snapshot`
+
+    python -m benchmarks.startup [--nodes 10000] [--runs 5] [--path /api/v1/graph]
+
+cold_ms is import, startup and first request together. Without DATABASE_URL a
+temporary SQLite file is used; otherwise its tables are emptied.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("default", "fast", "fast+snapshot")
+TIMINGS = ("import_ms", "startup_ms", "first_request_ms", "second_request_ms", "cold_ms", "process_ms")
+
+
+async def child(path: str) -> dict:
+    """Runs in the measured interpreter"""
+    started = time.perf_counter()
+    import httpx
+    from app.main import app
+    imported = time.perf_counter()
+
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            first = await client.get(path)
+            answered = time.perf_counter()
+            second = await client.get(path)
+            done = time.perf_counter()
+
+    return {
+        "status": [first.status_code, second.status_code],
+        "import_ms": (imported - started) * 1000,
+        "startup_ms": (ready - imported) * 1000,
+        "first_request_ms": (answered - ready) * 1000,
+        "second_request_ms": (done - answered) * 1000,
+        "cold_ms": (answered - started) * 1000,
+    }
+
+
+def measure(mode: str, snapshot_path: str, path: str) -> dict:
+    env = dict(os.environ, FAST_STARTUP="0" if mode == "default" else "1")
+    env.pop("GRAPH_CACHE_SNAPSHOT", None)
+    if mode == "fast+snapshot":
+        env["GRAPH_CACHE_SNAPSHOT"] = snapshot_path
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", "--path", path],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    # Includes interpreter startup, which no setting of the app changes
+    sample["process_ms"] = (time.perf_counter() - started) * 1000
+    return sample
+
+
+async def prepare(nodes: int, snapshot_path: str) -> int:
+    from benchmarks.api_load import SyntheticGraph, load
+    from app.cli import snapshot_graph
+    from app.core.db import dispose_engines
+
+    graph = SyntheticGraph("dag", nodes, 100, 2, 42)
+    try:
+        await load(graph)
+        with contextlib.redirect_stdout(sys.stderr):
+            await snapshot_graph(snapshot_path)
+    finally:
+        await dispose_engines()
+    return len(graph.edges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--path", default="/api/v1/graph", help="route of the requests")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"comma-separated subset of: {', '.join(MODES)}")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(child(args.path))))
+        return 0
+    # Imported here: the measured processes must import the app only while timed
+    from benchmarks.api_load import git_commit
+
+    modes = args.modes.split(",")
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    snapshot_path = os.path.join(tempfile.mkdtemp(), "graph-cache.json")
+    edges = asyncio.run(prepare(args.nodes, snapshot_path))
+    samples = {mode: [] for mode in modes}
+    # Interleaved, so drift in the machine's load affects every mode alike
+    for _ in range(args.runs):
+        for mode in modes:
+            samples[mode].append(measure(mode, snapshot_path, args.path))
+    results = {}
+    for mode, runs in samples.items():
+        results[mode] = {key: round(statistics.median(run[key] for run in runs), 1) for key in TIMINGS}
+        results[mode]["status"] = sorted({code for run in runs for code in run["status"]})
+
+    print(json.dumps({
+        "commit": git_commit(),
+        "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        "nodes": args.nodes,
+        "prerequisites": edges,
+        "path": args.path,
+        "runs": args.runs,
+        "modes": results,
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
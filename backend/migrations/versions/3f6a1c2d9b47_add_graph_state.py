@@ -0,0 +1,31 @@
+"""add graph state
+
+Revision ID: 3f6a1c2d9b47
+Revises: cdec2f7a959e
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6a1c2d9b47'
+down_revision: Union[str, None] = 'cdec2f7a959e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    graph_state = op.create_table('graph_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(graph_state, [{'id': 1, 'version': 0}])
+
+
+def downgrade() -> None:
+    op.drop_table('graph_state')
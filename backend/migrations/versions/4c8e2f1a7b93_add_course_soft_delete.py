@@ -0,0 +1,42 @@
+"""add course soft delete
+
+Revision ID: 4c8e2f1a7b93
+Revises: 9d3f5b7a2c81
+Create Date: 2026-10-18 18:05:41.207316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e2f1a7b93'
+down_revision: Union[str, None] = '9d3f5b7a2c81'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LIVE = sa.text('deleted_at IS NULL')
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+
+def upgrade() -> None:
+    op.add_column('course', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True))
+    # Deleted courses keep their names, so uniqueness only covers live ones
+    op.drop_index(op.f('ix_course_name'), table_name='course')
+    op.create_index('ix_course_name_live', 'course', ['name'], unique=True, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_parent_id_live', 'course', ['parent_id'], unique=False, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_deleted', 'course', ['deleted_at', 'parent_id'], unique=False, postgresql_where=DELETED, sqlite_where=DELETED)
+
+
+def downgrade() -> None:
+    # Soft-deleted courses cannot be represented without the column
+    op.execute('DELETE FROM course_prerequisite WHERE course_id IN (SELECT id FROM course WHERE deleted_at IS NOT NULL)')
+    op.execute('UPDATE course SET parent_id = NULL WHERE parent_id IN (SELECT id FROM course WHERE deleted_at IS NOT NULL)')
+    op.execute('DELETE FROM course WHERE deleted_at IS NOT NULL')
+    op.drop_index('ix_course_deleted', table_name='course')
+    op.drop_index('ix_course_parent_id_live', table_name='course')
+    op.drop_index('ix_course_name_live', table_name='course')
+    op.create_index(op.f('ix_course_name'), 'course', ['name'], unique=True)
+    op.drop_column('course', 'deleted_at')
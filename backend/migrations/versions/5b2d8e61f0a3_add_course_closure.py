@@ -0,0 +1,67 @@
+"""add course closure
+
+Revision ID: 5b2d8e61f0a3
+Revises: a41e7c90d2f5
+Create Date: 2026-10-18 13:41:05.226718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2d8e61f0a3'
+down_revision: Union[str, None] = 'a41e7c90d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('course_closure',
+    sa.Column('relation', sa.String(), nullable=False),
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['course.id'], ),
+    sa.ForeignKeyConstraint(['descendant_id'], ['course.id'], ),
+    sa.PrimaryKeyConstraint('relation', 'ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_course_closure_descendant', 'course_closure', ['relation', 'descendant_id', 'depth'], unique=False)
+
+    # Backfill so the table is usable as soon as GRAPH_CLOSURE_ENABLED is turned on
+    op.execute("""
+        INSERT INTO course_closure (relation, ancestor_id, descendant_id, depth)
+        SELECT relation, id, id, 0
+        FROM course CROSS JOIN (SELECT 'parent' AS relation UNION ALL SELECT 'prerequisite') r
+    """)
+    op.execute("""
+        INSERT INTO course_closure (relation, ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk(descendant_id, ancestor_id, depth) AS (
+            SELECT id, parent_id, 1 FROM course WHERE parent_id IS NOT NULL
+            UNION ALL
+            SELECT w.descendant_id, c.parent_id, w.depth + 1
+            FROM walk w INNER JOIN course c ON c.id = w.ancestor_id
+            WHERE c.parent_id IS NOT NULL AND w.depth < 1000
+        )
+        SELECT 'parent', ancestor_id, descendant_id, MIN(depth)
+        FROM walk GROUP BY ancestor_id, descendant_id
+    """)
+    op.execute("""
+        INSERT INTO course_closure (relation, ancestor_id, descendant_id, depth)
+        WITH RECURSIVE walk(descendant_id, ancestor_id, depth) AS (
+            SELECT course_id, prerequisite_id, 1 FROM course_prerequisite
+            UNION
+            SELECT w.descendant_id, cp.prerequisite_id, w.depth + 1
+            FROM walk w INNER JOIN course_prerequisite cp ON cp.course_id = w.ancestor_id
+            WHERE w.depth < 1000
+        )
+        SELECT 'prerequisite', ancestor_id, descendant_id, MIN(depth)
+        FROM walk GROUP BY ancestor_id, descendant_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_course_closure_descendant', table_name='course_closure')
+    op.drop_table('course_closure')
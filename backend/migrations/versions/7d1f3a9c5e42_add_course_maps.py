@@ -0,0 +1,67 @@
+"""add course maps
+
+Revision ID: 7d1f3a9c5e42
+Revises: 4c8e2f1a7b93
+Create Date: 2026-10-18 20:12:09.614382
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d1f3a9c5e42'
+down_revision: Union[str, None] = '4c8e2f1a7b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LIVE = sa.text('deleted_at IS NULL')
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+
+def upgrade() -> None:
+    # Everything written so far belongs to the default map 1
+    op.add_column('course', sa.Column('map_id', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('course_prerequisite', sa.Column('map_id', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('graph_change', sa.Column('map_id', sa.Integer(), server_default='1', nullable=False))
+
+    # Names are unique per map, and every lookup leads with the map
+    op.drop_index('ix_course_deleted', table_name='course')
+    op.drop_index('ix_course_parent_id_live', table_name='course')
+    op.drop_index('ix_course_name_live', table_name='course')
+    op.create_index('ix_course_map_name_live', 'course', ['map_id', 'name'], unique=True, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_map_parent_id_live', 'course', ['map_id', 'parent_id'], unique=False, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_map_id', 'course', ['map_id', 'id'], unique=False)
+    op.create_index('ix_course_map_deleted', 'course', ['map_id', 'deleted_at', 'parent_id'], unique=False, postgresql_where=DELETED, sqlite_where=DELETED)
+    op.create_index('ix_course_prerequisite_map_id', 'course_prerequisite', ['map_id', 'course_id'], unique=False)
+
+    op.drop_index(op.f('ix_graph_change_version'), table_name='graph_change')
+    op.create_index('ix_graph_change_map_version', 'graph_change', ['map_id', 'version'], unique=False)
+
+
+def downgrade() -> None:
+    # Courses of other maps cannot be represented without the column
+    op.execute('DELETE FROM course_closure WHERE ancestor_id IN (SELECT id FROM course WHERE map_id <> 1)')
+    op.execute('DELETE FROM course_closure WHERE descendant_id IN (SELECT id FROM course WHERE map_id <> 1)')
+    op.execute('DELETE FROM course_prerequisite WHERE map_id <> 1')
+    op.execute('DELETE FROM course WHERE map_id <> 1')
+    op.execute('DELETE FROM graph_change WHERE map_id <> 1')
+    op.execute('DELETE FROM graph_state WHERE id <> 1')
+
+    op.drop_index('ix_graph_change_map_version', table_name='graph_change')
+    op.create_index(op.f('ix_graph_change_version'), 'graph_change', ['version'], unique=False)
+
+    op.drop_index('ix_course_prerequisite_map_id', table_name='course_prerequisite')
+    op.drop_index('ix_course_map_deleted', table_name='course')
+    op.drop_index('ix_course_map_id', table_name='course')
+    op.drop_index('ix_course_map_parent_id_live', table_name='course')
+    op.drop_index('ix_course_map_name_live', table_name='course')
+    op.create_index('ix_course_name_live', 'course', ['name'], unique=True, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_parent_id_live', 'course', ['parent_id'], unique=False, postgresql_where=LIVE, sqlite_where=LIVE)
+    op.create_index('ix_course_deleted', 'course', ['deleted_at', 'parent_id'], unique=False, postgresql_where=DELETED, sqlite_where=DELETED)
+
+    op.drop_column('graph_change', 'map_id')
+    op.drop_column('course_prerequisite', 'map_id')
+    op.drop_column('course', 'map_id')
@@ -0,0 +1,32 @@
+"""add course version, make course names unique
+
+Revision ID: 9d3f5b7a2c81
+Revises: e7c4a9b1d350
+Create Date: 2026-10-18 16:40:12.530871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3f5b7a2c81'
+down_revision: Union[str, None] = 'e7c4a9b1d350'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('course', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    # Course writes use INSERT ... ON CONFLICT (name) and rely on this index
+    # instead of checking for duplicate names first
+    op.drop_index(op.f('ix_course_name'), table_name='course')
+    op.create_index(op.f('ix_course_name'), 'course', ['name'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_course_name'), table_name='course')
+    op.create_index(op.f('ix_course_name'), 'course', ['name'], unique=False)
+    op.drop_column('course', 'version')
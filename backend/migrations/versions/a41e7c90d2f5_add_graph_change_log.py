@@ -0,0 +1,35 @@
+"""add graph change log
+
+Revision ID: a41e7c90d2f5
+Revises: 3f6a1c2d9b47
+Create Date: 2026-10-18 10:03:17.502913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41e7c90d2f5'
+down_revision: Union[str, None] = '3f6a1c2d9b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('graph_change',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('op', sa.String(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_graph_change_version'), 'graph_change', ['version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_graph_change_version'), table_name='graph_change')
+    op.drop_table('graph_change')
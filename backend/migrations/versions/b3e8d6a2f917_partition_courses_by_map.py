@@ -0,0 +1,154 @@
+"""partition courses by map
+
+Revision ID: b3e8d6a2f917
+Revises: 7d1f3a9c5e42
+Create Date: 2026-10-18 20:47:31.285640
+
+"""
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8d6a2f917'
+down_revision: Union[str, None] = '7d1f3a9c5e42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Opt-in, Postgres only: set when upgrading to split course and
+# course_prerequisite into partitions by map_id, so a large map's scans, vacuums
+# and index bloat stay in its own partition.
+#   MAP_PARTITIONS=hash:16     16 hash partitions
+#   MAP_PARTITIONS=list:1,2,7  a partition per listed map plus a default one
+# Unset, the migration does nothing and the tables stay as they are.
+MAP_PARTITIONS = os.getenv("MAP_PARTITIONS", "")
+
+TABLES = ("course", "course_prerequisite")
+LIVE = "deleted_at IS NULL"
+DELETED = "deleted_at IS NOT NULL"
+
+# Indexes of the partitioned tables. Unique indexes must contain the partition
+# key, so course ids are only unique per map in the schema (the shared id
+# sequence still keeps them globally unique) and course_closure can no longer
+# reference course.id with a foreign key
+PARTITIONED_INDEXES = (
+    f"CREATE UNIQUE INDEX ix_course_map_name_live ON course (map_id, name) WHERE {LIVE}",
+    f"CREATE INDEX ix_course_map_parent_id_live ON course (map_id, parent_id) WHERE {LIVE}",
+    f"CREATE INDEX ix_course_map_deleted ON course (map_id, deleted_at, parent_id) WHERE {DELETED}",
+    "CREATE INDEX ix_course_id ON course (id)",
+    "CREATE INDEX ix_course_name_prefix ON course (lower(name) text_pattern_ops)",
+    "CREATE INDEX ix_course_name_trgm ON course USING gin (lower(name) gin_trgm_ops)",
+    "CREATE INDEX ix_course_name_tsv ON course USING gin (to_tsvector('simple', name))",
+    "CREATE INDEX ix_course_prerequisite_map_id ON course_prerequisite (map_id, course_id)",
+    "CREATE INDEX ix_course_prerequisite_course_id ON course_prerequisite (course_id)",
+    "CREATE INDEX ix_course_prerequisite_prerequisite_id ON course_prerequisite (prerequisite_id)",
+)
+# Composite keys also keep parents and prerequisites inside one map
+PARTITIONED_CONSTRAINTS = (
+    "ALTER TABLE course ADD CONSTRAINT course_pkey PRIMARY KEY (map_id, id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_pkey"
+    " PRIMARY KEY (map_id, course_id, prerequisite_id)",
+    "ALTER TABLE course ADD CONSTRAINT course_parent_id_fkey"
+    " FOREIGN KEY (map_id, parent_id) REFERENCES course (map_id, id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_course_id_fkey"
+    " FOREIGN KEY (map_id, course_id) REFERENCES course (map_id, id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_prerequisite_id_fkey"
+    " FOREIGN KEY (map_id, prerequisite_id) REFERENCES course (map_id, id)",
+)
+
+# The schema of revision 7d1f3a9c5e42
+PLAIN_INDEXES = PARTITIONED_INDEXES + (
+    "CREATE INDEX ix_course_map_id ON course (map_id, id)",
+)
+PLAIN_CONSTRAINTS = (
+    "ALTER TABLE course ADD CONSTRAINT course_pkey PRIMARY KEY (id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_pkey"
+    " PRIMARY KEY (course_id, prerequisite_id)",
+    "ALTER TABLE course ADD CONSTRAINT course_parent_id_fkey FOREIGN KEY (parent_id) REFERENCES course (id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_course_id_fkey"
+    " FOREIGN KEY (course_id) REFERENCES course (id)",
+    "ALTER TABLE course_prerequisite ADD CONSTRAINT course_prerequisite_prerequisite_id_fkey"
+    " FOREIGN KEY (prerequisite_id) REFERENCES course (id)",
+    "ALTER TABLE course_closure ADD CONSTRAINT course_closure_ancestor_id_fkey"
+    " FOREIGN KEY (ancestor_id) REFERENCES course (id)",
+    "ALTER TABLE course_closure ADD CONSTRAINT course_closure_descendant_id_fkey"
+    " FOREIGN KEY (descendant_id) REFERENCES course (id)",
+)
+
+
+def _partitioning() -> Optional[Tuple[str, List[int]]]:
+    """("hash", [count]) or ("list", map ids) from MAP_PARTITIONS, or None"""
+    if op.get_bind().dialect.name != 'postgresql' or not MAP_PARTITIONS:
+        return None
+    kind, _, values = MAP_PARTITIONS.partition(':')
+    try:
+        numbers = [int(value) for value in values.split(',') if value.strip()]
+    except ValueError:
+        numbers = []
+    if kind not in ('hash', 'list') or not numbers or (kind == 'hash' and (len(numbers) != 1 or numbers[0] < 1)):
+        raise ValueError(f"MAP_PARTITIONS must look like 'hash:16' or 'list:1,2,7', not {MAP_PARTITIONS!r}")
+    return kind, numbers
+
+
+def _is_partitioned() -> bool:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'course'::regclass"
+    )).first() is not None
+
+
+def _rebuild(create_table, indexes, constraints):
+    """Recreate course and course_prerequisite through `create_table(name, old_name)`
+    and copy their rows over. The id sequence is detached first so it survives
+    the old table being dropped"""
+    sequence = op.get_bind().execute(sa.text("SELECT pg_get_serial_sequence('course', 'id')")).scalar()
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    for table in TABLES:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        create_table(table, f"{table}_old")
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_old")
+    # CASCADE drops the foreign keys course_closure had on the old table
+    op.execute("DROP TABLE course_prerequisite_old, course_old CASCADE")
+    for statement in constraints + indexes:
+        op.execute(statement)
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY course.id")
+
+
+def upgrade() -> None:
+    partitioning = _partitioning()
+    if partitioning is None or _is_partitioned():
+        return
+    kind, numbers = partitioning
+
+    def create_partitioned(table: str, old_table: str):
+        op.execute(
+            f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS) PARTITION BY {kind.upper()} (map_id)"
+        )
+        if kind == 'hash':
+            for remainder in range(numbers[0]):
+                op.execute(
+                    f"CREATE TABLE {table}_p{remainder} PARTITION OF {table}"
+                    f" FOR VALUES WITH (MODULUS {numbers[0]}, REMAINDER {remainder})"
+                )
+        else:
+            for map_id in numbers:
+                op.execute(f"CREATE TABLE {table}_map{map_id} PARTITION OF {table} FOR VALUES IN ({map_id})")
+            op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    _rebuild(create_partitioned, PARTITIONED_INDEXES, PARTITIONED_CONSTRAINTS)
+
+
+def downgrade() -> None:
+    if not _is_partitioned():
+        return
+
+    def create_plain(table: str, old_table: str):
+        op.execute(f"CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS)")
+
+    # Dropping the partitioned tables drops their partitions too
+    _rebuild(create_plain, PLAIN_INDEXES, PLAIN_CONSTRAINTS)
@@ -0,0 +1,35 @@
+"""add course deletion id
+
+Revision ID: d5a9c3e7f184
+Revises: b3e8d6a2f917
+Create Date: 2026-10-18 22:14:09.531872
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a9c3e7f184'
+down_revision: Union[str, None] = 'b3e8d6a2f917'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+
+def upgrade() -> None:
+    op.add_column('course', sa.Column('deletion_id', sa.String(), nullable=True))
+    # Courses deleted so far were grouped by their shared timestamp
+    op.execute(
+        "UPDATE course SET deletion_id = CAST(map_id AS VARCHAR) || '/' || CAST(deleted_at AS VARCHAR)"
+        " WHERE deleted_at IS NOT NULL"
+    )
+    op.create_index('ix_course_map_deletion', 'course', ['map_id', 'deletion_id', 'parent_id'], unique=False, postgresql_where=DELETED, sqlite_where=DELETED)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_course_map_deletion', table_name='course')
+    op.drop_column('course', 'deletion_id')
@@ -0,0 +1,37 @@
+"""add course search indexes
+
+Revision ID: e7c4a9b1d350
+Revises: 5b2d8e61f0a3
+Create Date: 2026-10-18 15:02:47.913204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7c4a9b1d350'
+down_revision: Union[str, None] = '5b2d8e61f0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Expression indexes backing SearchService's Postgres query; other databases
+    # search with plain LIKE scans
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_course_name_prefix', 'course', [sa.text('lower(name) text_pattern_ops')], unique=False)
+    op.create_index('ix_course_name_trgm', 'course', [sa.text('lower(name) gin_trgm_ops')], unique=False, postgresql_using='gin')
+    op.create_index('ix_course_name_tsv', 'course', [sa.text("to_tsvector('simple', name)")], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_course_name_tsv', table_name='course')
+    op.drop_index('ix_course_name_trgm', table_name='course')
+    op.drop_index('ix_course_name_prefix', table_name='course')
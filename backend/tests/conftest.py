@@ -0,0 +1,50 @@
+"""The tests drive the app over ASGI against a scratch SQLite database, which
+`api` recreates for every test"""
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+# CPU-bound jobs run in threads rather than spawned processes
+os.environ.setdefault("JOBS_PROCESSES", "0")
+
+import httpx
+from sqlalchemy import event
+from app import models  # noqa: F401  (registers the tables)
+from app.core.db import Base, get_engine
+from app.main import app
+from app.services.graph_service import map_graphs
+
+@asynccontextmanager
+async def api(cache: bool = True):
+    """A client of the running app on empty tables; `cache=False` sends every read
+    to the database"""
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+    map_graphs.clear()
+    map_graphs.disabled = False
+    if not cache:
+        map_graphs.disable()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements executed inside the block"""
+    counter = StatementCounter()
+    engine = get_engine().sync_engine
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
@@ -0,0 +1,53 @@
+import asyncio
+from sqlalchemy import text
+from app.core.db import get_engine
+from app.services.batch_service import BatchService
+from conftest import api
+
+async def _swap_names():
+    async with api() as client:
+        a = (await client.post("/api/v1/courses/", json={"name": "A"})).json()
+        b = (await client.post("/api/v1/courses/", json={"name": "B"})).json()
+        response = await client.post("/api/v1/courses/batch", json={"operations": [
+            {"op": "update", "id": a["id"], "name": "tmp"},
+            {"op": "update", "id": b["id"], "name": "A"},
+            {"op": "update", "id": a["id"], "name": "B"},
+        ]})
+        async with get_engine().connect() as connection:
+            names = dict((await connection.execute(text("SELECT id, name FROM course"))).all())
+    return response, names, a["id"], b["id"]
+
+def test_batch_swaps_names_through_an_intermediate_name():
+    response, names, a_id, b_id = asyncio.run(_swap_names())
+    assert response.status_code == 200, response.text
+    assert names == {a_id: "B", b_id: "A"}
+
+async def _concurrent_write():
+    load_state = BatchService._load_state
+
+    async def load_state_then_rename(db, map_id, operations):
+        state = await load_state(db, map_id, operations)
+        # Another request renames B after the batch has read it
+        async with get_engine().begin() as connection:
+            await connection.execute(text("UPDATE course SET name = 'B2', version = version + 1 WHERE name = 'B'"))
+        return state
+
+    async with api() as client:
+        a = (await client.post("/api/v1/courses/", json={"name": "A"})).json()
+        b = (await client.post("/api/v1/courses/", json={"name": "B"})).json()
+        BatchService._load_state = load_state_then_rename
+        try:
+            response = await client.post("/api/v1/courses/batch", json={"operations": [
+                {"op": "update", "id": a["id"], "name": "A1"},
+                {"op": "update", "id": b["id"], "name": "B1"},
+            ]})
+        finally:
+            BatchService._load_state = load_state
+        async with get_engine().connect() as connection:
+            rows = (await connection.execute(text("SELECT name, version FROM course ORDER BY id"))).all()
+    return response, rows
+
+def test_batch_does_not_overwrite_a_concurrent_write():
+    response, rows = asyncio.run(_concurrent_write())
+    assert response.status_code == 409, response.text
+    assert rows == [("A", 1), ("B2", 2)]
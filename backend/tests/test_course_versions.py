@@ -0,0 +1,129 @@
+import asyncio
+from sqlalchemy import text
+from app.core.db import get_engine
+from app.services.course_service import MAX_WRITE_ATTEMPTS, CourseService
+from conftest import api
+
+async def _rows(query: str):
+    async with get_engine().connect() as connection:
+        return (await connection.execute(text(query))).all()
+
+# Everything a course write changes
+STATE_QUERIES = (
+    "SELECT id, name, parent_id, version, deleted_at FROM course ORDER BY id",
+    "SELECT id, version FROM graph_state",
+    "SELECT count(*) FROM graph_change",
+)
+
+async def _stale_if_match():
+    async with api() as client:
+        course = await client.post("/api/v1/courses/", json={"name": "A"})
+        renamed = await client.put(f"/api/v1/courses/{course.json()['id']}", json={"name": "B"})
+        stale = {"If-Match": course.headers["ETag"]}
+        put = await client.put(f"/api/v1/courses/{course.json()['id']}", json={"name": "C"}, headers=stale)
+        delete = await client.delete(f"/api/v1/courses/{course.json()['id']}", headers=stale)
+        rows = await _rows("SELECT name, version, deleted_at FROM course")
+    return course, renamed, put, delete, rows
+
+def test_stale_if_match_is_a_conflict_and_changes_nothing():
+    course, renamed, put, delete, rows = asyncio.run(_stale_if_match())
+    assert course.headers["ETag"] == '"1"'
+    assert renamed.headers["ETag"] == '"2"'
+    assert put.status_code == 409, put.text
+    assert delete.status_code == 409, delete.text
+    assert rows == [("B", 2, None)]
+
+async def _versioned_writes():
+    async with api() as client:
+        created = await client.post("/api/v1/courses/", json={"name": "A"})
+        url = f"/api/v1/courses/{created.json()['id']}"
+        responses = [
+            created,
+            await client.put(url, json={"name": "B"}),
+            await client.put(url, json={"name": "C"}, headers={"If-Match": "*"}),
+            await client.put(url, json={"name": "D"}, headers={"If-Match": '"3"'}),
+            await client.put(url, json={"name": "E"}, headers={"If-Match": 'W/"4"'}),
+        ]
+        read = await client.get(url)
+        deleted = await client.delete(url, headers={"If-Match": read.headers["ETag"]})
+        graph_versions = await _rows("SELECT version FROM graph_change ORDER BY id")
+    return responses, read, deleted, graph_versions
+
+def test_every_write_increments_the_version_once():
+    responses, read, deleted, graph_versions = asyncio.run(_versioned_writes())
+    for response in responses:
+        assert response.status_code == 200, response.text
+    assert [response.json()["version"] for response in responses] == [1, 2, 3, 4, 5]
+    assert [response.headers["ETag"] for response in responses] == ['"1"', '"2"', '"3"', '"4"', '"5"']
+    assert read.json()["name"] == "E" and read.headers["ETag"] == '"5"'
+    assert deleted.status_code == 200, deleted.text
+    assert [version for version, in graph_versions] == [1, 2, 3, 4, 5, 6]
+
+async def _duplicate_names():
+    async with api() as client:
+        await client.post("/api/v1/courses/", json={"name": "A"})
+        b = (await client.post("/api/v1/courses/", json={"name": "B", "parent_name": "A"})).json()
+        before = [await _rows(query) for query in STATE_QUERIES]
+        create = await client.post("/api/v1/courses/", json={"name": "A"})
+        update = await client.put(f"/api/v1/courses/{b['id']}", json={"name": "A"})
+        after = [await _rows(query) for query in STATE_QUERIES]
+    return create, update, before, after
+
+def test_duplicate_name_is_a_conflict_without_a_partial_write():
+    create, update, before, after = asyncio.run(_duplicate_names())
+    assert create.status_code == 409, create.text
+    # The rename would also have moved B to the top level
+    assert update.status_code == 409, update.text
+    assert after == before
+
+async def _concurrent_update(lost_races: int, if_match=None):
+    """Update a course while another writer changes it before each of the first
+    `lost_races` attempts, so the conditional UPDATE matches no row"""
+    update_row = CourseService._update_row
+    attempts = []
+
+    async def racing_update_row(db, map_id, course_id, course, expected_version):
+        attempts.append(expected_version)
+        if len(attempts) <= lost_races:
+            await db.execute(text("UPDATE course SET version = version + 1 WHERE id = :id"), {"id": course_id})
+            return None
+        return await update_row(db, map_id, course_id, course, expected_version)
+
+    async with api() as client:
+        course = (await client.post("/api/v1/courses/", json={"name": "A"})).json()
+        CourseService._update_row = racing_update_row
+        try:
+            headers = {"If-Match": if_match} if if_match else {}
+            response = await client.put(f"/api/v1/courses/{course['id']}", json={"name": "B"}, headers=headers)
+        finally:
+            CourseService._update_row = update_row
+        rows = await _rows("SELECT name, version FROM course")
+    return response, attempts, rows
+
+def test_update_retries_after_losing_a_race():
+    response, attempts, rows = asyncio.run(_concurrent_update(lost_races=1))
+    assert response.status_code == 200, response.text
+    assert len(attempts) == 2
+    assert response.json()["version"] == 3
+    assert rows == [("B", 3)]
+
+def test_update_gives_up_after_max_write_attempts():
+    response, attempts, rows = asyncio.run(_concurrent_update(lost_races=MAX_WRITE_ATTEMPTS))
+    assert response.status_code == 409, response.text
+    assert len(attempts) == MAX_WRITE_ATTEMPTS
+    # The failed request rolled back, the simulated concurrent writes with it
+    assert rows == [("A", 1)]
+
+def test_update_with_if_match_does_not_retry_past_a_concurrent_write():
+    response, attempts, rows = asyncio.run(_concurrent_update(lost_races=1, if_match='"1"'))
+    assert response.status_code == 409, response.text
+    assert len(attempts) == 1
+    assert rows == [("A", 1)]
+
+def test_bad_if_match_is_rejected():
+    async def scenario():
+        async with api() as client:
+            course = (await client.post("/api/v1/courses/", json={"name": "A"})).json()
+            return await client.put(f"/api/v1/courses/{course['id']}", json={"name": "B"}, headers={"If-Match": "abc"})
+
+    assert asyncio.run(scenario()).status_code == 400
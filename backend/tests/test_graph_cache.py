@@ -0,0 +1,84 @@
+import asyncio
+from app.core.db import AsyncSessionLocal
+from app.core.maps import DEFAULT_MAP_ID
+from app.services.graph_service import GraphService, map_graphs
+from conftest import api, count_statements
+
+async def _database_snapshot():
+    async with AsyncSessionLocal() as db:
+        version = await GraphService.get_version(db, DEFAULT_MAP_ID)
+        return _comparable(await GraphService.build_snapshot(db, DEFAULT_MAP_ID, version))
+
+def _comparable(snapshot) -> dict:
+    data = snapshot.model_dump()
+    data["edges"] = sorted(data["edges"], key=lambda edge: (edge["type"], edge["source"], edge["target"]))
+    return data
+
+async def _writes_through_the_cache():
+    snapshots = []
+    async with api() as client:
+        async def check(step: str):
+            # A read brings the cache up to the map's version first
+            response = await client.get("/api/v1/courses/")
+            assert response.status_code == 200, response.text
+            cache = map_graphs.get(DEFAULT_MAP_ID).cache
+            assert cache.loaded, step
+            snapshots.append((step, _comparable(cache.snapshot()), await _database_snapshot()))
+
+        ids = {}
+        for name, parent_name in (("A", None), ("B", "A"), ("C", "B"), ("D", None)):
+            course = await client.post("/api/v1/courses/", json={"name": name, "parent_name": parent_name})
+            ids[name] = course.json()["id"]
+        await check("create")
+        await client.post(f"/api/v1/courses/{ids['C']}/prerequisites/{ids['D']}")
+        await client.post(f"/api/v1/courses/{ids['D']}/prerequisites/{ids['A']}")
+        await check("add prerequisites")
+        await client.put(f"/api/v1/courses/{ids['B']}", json={"name": "B2", "parent_name": "D"})
+        await check("update")
+        await client.post("/api/v1/courses/move", json={"ids": [ids["B"]], "parent_id": None})
+        await check("move")
+        await client.delete(f"/api/v1/courses/{ids['D']}")
+        await check("delete")
+        await client.post(f"/api/v1/courses/{ids['D']}/restore")
+        await check("restore")
+        await client.delete(f"/api/v1/courses/{ids['B']}?subtree=true")
+        await check("delete subtree")
+    return snapshots
+
+def test_cache_matches_the_database_after_every_write():
+    for step, cached, stored in asyncio.run(_writes_through_the_cache()):
+        assert cached == stored, step
+
+async def _oversized_map():
+    async with api() as client:
+        for name in ("A", "B", "C"):
+            await client.post("/api/v1/courses/", json={"name": name})
+        cache = map_graphs.get(DEFAULT_MAP_ID).cache
+        cache.max_nodes = 2
+        async with AsyncSessionLocal() as db:
+            assert not await GraphService.load_cache(db, DEFAULT_MAP_ID)
+
+        # Once the recount interval is up, a read only queues the recount
+        submitted = []
+        submit_cache_load = GraphService.submit_cache_load
+        GraphService.submit_cache_load = submitted.append
+        try:
+            cache.checked_at = 0
+            with count_statements() as request_statements:
+                listed = await client.get("/api/v1/courses/")
+        finally:
+            GraphService.submit_cache_load = submit_cache_load
+
+        # The graph is unchanged, so the recount stops at its version
+        with count_statements() as unchanged_statements:
+            unchanged = await GraphService.submit_cache_load(DEFAULT_MAP_ID).wait()
+        await client.delete("/api/v1/courses/{}".format(listed.json()[0]["id"]))
+        shrunk = await GraphService.submit_cache_load(DEFAULT_MAP_ID).wait()
+    return submitted, request_statements.count, unchanged_statements.count, unchanged, shrunk, cache.loaded
+
+def test_oversized_map_is_recounted_in_the_background():
+    submitted, request_statements, unchanged_statements, unchanged, shrunk, loaded = asyncio.run(_oversized_map())
+    assert submitted == [DEFAULT_MAP_ID]
+    assert request_statements == 1
+    assert not unchanged and unchanged_statements == 1
+    assert shrunk and loaded
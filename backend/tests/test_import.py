@@ -0,0 +1,24 @@
+import asyncio
+from conftest import api
+
+LINES = b"""{"name": "Algebra"}
+{"name": "Calculus", "parent_name": "Algebra", "prerequisites": ["Algebra"]}
+not json
+{"name": "Algebra"}
+{"name": "Optics", "parent_name": "Physics"}
+{"name": "Topology", "prerequisites": ["Calculus"]}
+"""
+
+async def _import():
+    async with api() as client:
+        report = await client.post("/api/v1/courses/import?format=jsonl", content=LINES)
+        courses = await client.get("/api/v1/courses/")
+    return report, courses
+
+def test_import_writes_the_valid_rows_and_reports_the_others():
+    report, courses = asyncio.run(_import())
+    assert report.status_code == 200, report.text
+    body = report.json()
+    assert body["imported"] == 3 and body["failed"] == 3
+    assert [error["line"] for error in body["errors"]] == [3, 4, 5]
+    assert sorted(course["name"] for course in courses.json()) == ["Algebra", "Calculus", "Topology"]
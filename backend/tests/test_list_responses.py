@@ -0,0 +1,42 @@
+import asyncio
+from pydantic import TypeAdapter
+from app.main import app
+from conftest import api
+
+def _documented_models() -> dict:
+    """The body model each list route documents in place of a response_model"""
+    return {
+        route.path: route.responses[200]["model"]
+        for route in app.routes
+        if getattr(route, "responses", None) and 200 in route.responses and "GET" in route.methods
+    }
+
+async def _bodies():
+    async with api() as client:
+        a = (await client.post("/api/v1/courses/", json={"name": "A"})).json()
+        b = (await client.post("/api/v1/courses/", json={"name": "B", "parent_name": "A"})).json()
+        c = (await client.post("/api/v1/courses/", json={"name": "C"})).json()
+        await client.post(f"/api/v1/courses/{b['id']}/prerequisites/{a['id']}")
+        await client.delete(f"/api/v1/courses/{c['id']}")
+        urls = {
+            "/api/v1/courses/": "/api/v1/courses/",
+            "/api/v1/courses/search": "/api/v1/courses/search?q=A",
+            "/api/v1/courses/deleted": "/api/v1/courses/deleted",
+            "/api/v1/courses/{course_id}/dependencies": f"/api/v1/courses/{b['id']}/dependencies",
+            "/api/v1/courses/parent/{parent_id}": f"/api/v1/courses/parent/{a['id']}",
+            "/api/v1/courses/{course_id}/prerequisites": f"/api/v1/courses/{b['id']}/prerequisites",
+            "/api/v1/courses/{course_id}/dependents": f"/api/v1/courses/{a['id']}/dependents",
+            "/api/v1/courses/{course_id}/learning-path": f"/api/v1/courses/{b['id']}/learning-path",
+            "/api/v1/courses/{course_id}/neighborhood": f"/api/v1/courses/{a['id']}/neighborhood",
+        }
+        return {path: await client.get(url) for path, url in urls.items()}
+
+def test_list_bodies_match_the_documented_models():
+    models = _documented_models()
+    for path, response in asyncio.run(_bodies()).items():
+        assert response.status_code == 200, (path, response.text)
+        body = response.json()
+        assert body, path
+        validated = TypeAdapter(models[path]).validate_python(body)
+        # Rows carry no version, rather than a null one
+        assert TypeAdapter(models[path]).dump_python(validated, mode="json", exclude_unset=True) == body, path
@@ -0,0 +1,75 @@
+import asyncio
+from conftest import api
+
+MAP_A = "/api/v1/maps/1"
+MAP_B = "/api/v1/maps/2"
+
+async def _same_name_in_two_maps():
+    async with api() as client:
+        in_a = await client.post(f"{MAP_A}/courses/", json={"name": "Algebra"})
+        in_b = await client.post(f"{MAP_B}/courses/", json={"name": "Algebra"})
+        duplicate = await client.post(f"{MAP_B}/courses/", json={"name": "Algebra"})
+        default_map = await client.get("/api/v1/courses/")
+        listed_b = await client.get(f"{MAP_B}/courses/")
+    return in_a, in_b, duplicate, default_map, listed_b
+
+def test_a_name_is_unique_per_map():
+    in_a, in_b, duplicate, default_map, listed_b = asyncio.run(_same_name_in_two_maps())
+    assert in_a.status_code == 200, in_a.text
+    assert in_b.status_code == 200, in_b.text
+    assert in_a.json()["id"] != in_b.json()["id"]
+    assert duplicate.status_code == 409, duplicate.text
+    # Routes without a prefix work on map 1
+    assert [course["id"] for course in default_map.json()] == [in_a.json()["id"]]
+    assert [course["id"] for course in listed_b.json()] == [in_b.json()["id"]]
+
+async def _foreign_ids():
+    async with api() as client:
+        a = (await client.post(f"{MAP_A}/courses/", json={"name": "A"})).json()
+        a2 = (await client.post(f"{MAP_A}/courses/", json={"name": "A2"})).json()
+        b = (await client.post(f"{MAP_B}/courses/", json={"name": "B"})).json()
+        url = f"{MAP_B}/courses/{a['id']}"
+        responses = {
+            "read": await client.get(url),
+            "update": await client.put(url, json={"name": "A1"}),
+            "prerequisites": await client.get(f"{url}/prerequisites"),
+            "neighborhood": await client.get(f"{url}/neighborhood"),
+            "link": await client.post(f"{MAP_B}/courses/{b['id']}/prerequisites/{a['id']}"),
+            "link within map A": await client.post(f"{MAP_B}/courses/{a2['id']}/prerequisites/{a['id']}"),
+            "move": await client.post(f"{MAP_B}/courses/move", json={"ids": [a["id"]], "parent_id": b["id"]}),
+            "delete": await client.delete(url),
+        }
+        unchanged = await client.get(f"{MAP_A}/courses/{a['id']}")
+    return responses, unchanged
+
+def test_an_id_from_another_map_is_not_found():
+    responses, unchanged = asyncio.run(_foreign_ids())
+    for name, response in responses.items():
+        assert response.status_code == 404, (name, response.text)
+    assert unchanged.status_code == 200
+    assert unchanged.json()["name"] == "A" and unchanged.json()["version"] == 1
+
+async def _versions_per_map():
+    async with api() as client:
+        await client.post(f"{MAP_A}/courses/", json={"name": "A"})
+        graph_a = await client.get(f"{MAP_A}/graph")
+        for name in ("B1", "B2", "B3"):
+            await client.post(f"{MAP_B}/courses/", json={"name": name})
+        graph_b = await client.get(f"{MAP_B}/graph")
+        # Map B's writes leave map A's version and ETag alone
+        revalidated_a = await client.get(f"{MAP_A}/graph", headers={"If-None-Match": graph_a.headers["ETag"]})
+        changes_a = await client.get(f"{MAP_A}/graph/changes?since=0")
+        changes_b = await client.get(f"{MAP_B}/graph/changes?since=1")
+    return graph_a, graph_b, revalidated_a, changes_a, changes_b
+
+def test_graph_versions_changes_and_etags_are_per_map():
+    graph_a, graph_b, revalidated_a, changes_a, changes_b = asyncio.run(_versions_per_map())
+    assert graph_a.headers["ETag"] == '"1"'
+    assert [node["name"] for node in graph_a.json()["nodes"]] == ["A"]
+    assert graph_b.headers["ETag"] == '"3"'
+    assert [node["name"] for node in graph_b.json()["nodes"]] == ["B1", "B2", "B3"]
+    assert revalidated_a.status_code == 304
+    assert changes_a.json()["version"] == 1
+    assert [change["node"]["name"] for change in changes_a.json()["changes"]] == ["A"]
+    assert changes_b.json()["version"] == 3
+    assert [change["node"]["name"] for change in changes_b.json()["changes"]] == ["B2", "B3"]
@@ -0,0 +1,24 @@
+import asyncio
+from conftest import api
+
+async def _learning_path(cache: bool):
+    async with api(cache=cache) as client:
+        ids = {}
+        for name in ("Algebra", "Calculus", "Physics", "Mechanics"):
+            ids[name] = (await client.post("/api/v1/courses/", json={"name": name})).json()["id"]
+        for course, prerequisite in (("Calculus", "Algebra"), ("Physics", "Algebra"), ("Mechanics", "Calculus"),
+                                     ("Mechanics", "Physics")):
+            await client.post(f"/api/v1/courses/{ids[course]}/prerequisites/{ids[prerequisite]}")
+        path = await client.get(f"/api/v1/courses/{ids['Mechanics']}/learning-path")
+        missing = await client.get("/api/v1/courses/999/learning-path")
+    return path, missing
+
+def test_learning_path_ends_with_the_course_in_the_same_shape():
+    for cache in (True, False):
+        path, missing = asyncio.run(_learning_path(cache))
+        assert path.status_code == 200, path.text
+        courses = path.json()
+        assert [course["name"] for course in courses] == ["Algebra", "Calculus", "Physics", "Mechanics"]
+        assert courses[-1]["depth"] == 0
+        assert {tuple(sorted(course)) for course in courses} == {tuple(sorted(courses[0]))}
+        assert missing.status_code == 404
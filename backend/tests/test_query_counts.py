@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from app.core.db import get_engine
+from app.models.course import Course, course_prerequisite
+from conftest import api, count_statements
+
+SIZES = (10, 500)
+# Statements per request, which must not grow with the catalog; the walks look the
+# course up first so a missing one answers 404
+STATEMENTS = {
+    "courses": 1,
+    "courses page": 1,
+    "courses projection": 1,
+    "courses by parent": 1,
+    "dependencies": 1,
+    "deleted courses": 1,
+    "prerequisites": 2,
+    "dependents": 2,
+    "learning path": 3,
+    "neighborhood": 1,
+    "search": 1,
+}
+
+async def _seed(size: int):
+    """Courses 1..size in a tree below course 1, each requiring the one before it,
+    and as many soft-deleted courses after them"""
+    deleted_at = datetime.now(timezone.utc)
+    async with get_engine().begin() as connection:
+        await connection.execute(insert(Course), [{"id": 1, "name": "course-1"}])
+        await connection.execute(insert(Course), [
+            {"id": i, "name": f"course-{i}", "parent_id": 1 if i % 2 else i - 1}
+            for i in range(2, size + 1)
+        ])
+        await connection.execute(insert(course_prerequisite), [
+            {"course_id": i, "prerequisite_id": i - 1} for i in range(2, size + 1)
+        ])
+        await connection.execute(insert(Course), [
+            {"id": i, "name": f"course-{i}", "deleted_at": deleted_at}
+            for i in range(size + 1, 2 * size + 1)
+        ])
+
+def _list_urls(size: int):
+    middle = size // 2
+    return {
+        "courses": f"/api/v1/courses/?limit={size}",
+        "courses page": f"/api/v1/courses/?cursor=&limit={size}",
+        "courses projection": f"/api/v1/courses/?cursor=&fields=id,name&limit={size}",
+        "courses by parent": "/api/v1/courses/parent/1",
+        "dependencies": f"/api/v1/courses/{size}/dependencies",
+        "deleted courses": f"/api/v1/courses/deleted?limit={size}",
+        "prerequisites": f"/api/v1/courses/{size}/prerequisites",
+        "dependents": "/api/v1/courses/1/dependents",
+        "learning path": f"/api/v1/courses/{size}/learning-path",
+        "neighborhood": f"/api/v1/courses/{middle}/neighborhood?depth=3",
+        "search": "/api/v1/courses/search?q=course",
+    }
+
+async def _count(size: int):
+    # Measure the database path, not reads served from the in-process graph cache
+    async with api(cache=False) as client:
+        await _seed(size)
+        counts = {}
+        for name, url in _list_urls(size).items():
+            with count_statements() as counter:
+                response = await client.get(url)
+            assert response.status_code == 200, (name, response.text)
+            counts[name] = counter.count
+    return counts
+
+def test_list_endpoints_issue_the_same_statements_at_any_size():
+    for size in SIZES:
+        assert asyncio.run(_count(size)) == STATEMENTS, size
@@ -0,0 +1,98 @@
+import asyncio
+from sqlalchemy import text
+from app.core.db import get_engine
+from conftest import api
+
+async def _state():
+    """Live courses by name with their parents' names, and the prerequisites among them"""
+    async with get_engine().connect() as connection:
+        courses = dict((await connection.execute(text("""
+            SELECT c.name, p.name FROM course c LEFT JOIN course p ON p.id = c.parent_id
+            WHERE c.deleted_at IS NULL
+        """))).all())
+        prerequisites = set((await connection.execute(text("""
+            SELECT c.name, p.name FROM course_prerequisite cp
+            INNER JOIN course c ON c.id = cp.course_id
+            INNER JOIN course p ON p.id = cp.prerequisite_id
+            WHERE c.deleted_at IS NULL AND p.deleted_at IS NULL
+        """))).all())
+    return courses, prerequisites
+
+async def _create(client, *courses):
+    ids = {}
+    for name, parent_name in courses:
+        response = await client.post("/api/v1/courses/", json={"name": name, "parent_name": parent_name})
+        assert response.status_code == 200, response.text
+        ids[name] = response.json()["id"]
+    return ids
+
+async def _subtree_round_trip():
+    async with api() as client:
+        ids = await _create(client, ("A", None), ("B", "A"), ("C", "B"), ("X", None))
+        for course, prerequisite in (("C", "B"), ("X", "C"), ("B", "X")):
+            await client.post(f"/api/v1/courses/{ids[course]}/prerequisites/{ids[prerequisite]}")
+        deleted = await client.delete(f"/api/v1/courses/{ids['A']}?subtree=true")
+        after_delete = await _state()
+        restored = await client.post(f"/api/v1/courses/{ids['A']}/restore")
+        after_restore = await _state()
+    return deleted, after_delete, restored, after_restore
+
+def test_restore_brings_back_the_subtree_but_not_its_outside_prerequisites():
+    deleted, after_delete, restored, after_restore = asyncio.run(_subtree_round_trip())
+    assert deleted.status_code == 200 and deleted.json()["courses"] == 3, deleted.text
+    assert after_delete == ({"X": None}, set())
+    assert restored.status_code == 200 and restored.json()["courses"] == 3, restored.text
+    assert after_restore == ({"A": None, "B": "A", "C": "B", "X": None}, {("C", "B")})
+
+async def _separate_deletes():
+    async with api() as client:
+        ids = await _create(client, ("A", None), ("B", "A"), ("C", "B"))
+        await client.delete(f"/api/v1/courses/{ids['B']}?subtree=true")
+        await client.delete(f"/api/v1/courses/{ids['A']}")
+        restored_a = await client.post(f"/api/v1/courses/{ids['A']}/restore")
+        after_a = await _state()
+        restored_b = await client.post(f"/api/v1/courses/{ids['B']}/restore")
+        after_b = await _state()
+    return restored_a, after_a, restored_b, after_b
+
+def test_restore_leaves_courses_of_an_earlier_delete_deleted():
+    restored_a, after_a, restored_b, after_b = asyncio.run(_separate_deletes())
+    assert restored_a.json()["courses"] == 1
+    assert after_a == ({"A": None}, set())
+    # B's parent is live again, so B goes back below it
+    assert restored_b.json()["courses"] == 2
+    assert after_b == ({"A": None, "B": "A", "C": "B"}, set())
+
+async def _batch_deletes():
+    async with api() as client:
+        ids = await _create(client, ("A", None), ("B", "A"), ("C", None))
+        batch = await client.post("/api/v1/courses/batch", json={"operations": [
+            {"op": "delete", "id": ids["B"]},
+            {"op": "delete", "id": ids["A"]},
+            {"op": "delete", "id": ids["C"]},
+        ]})
+        restored = await client.post(f"/api/v1/courses/{ids['A']}/restore")
+        after = await _state()
+    return batch, restored, after
+
+def test_each_batch_delete_is_restored_on_its_own():
+    batch, restored, after = asyncio.run(_batch_deletes())
+    assert batch.status_code == 200, batch.text
+    assert restored.status_code == 200 and restored.json()["courses"] == 1, restored.text
+    assert after == ({"A": None}, set())
+
+async def _conflicts():
+    async with api() as client:
+        ids = await _create(client, ("A", None), ("B", "A"))
+        live = await client.post(f"/api/v1/courses/{ids['A']}/restore")
+        await client.delete(f"/api/v1/courses/{ids['A']}?subtree=true")
+        await _create(client, ("B", None))
+        taken = await client.post(f"/api/v1/courses/{ids['A']}/restore")
+        after = await _state()
+    return live, taken, after
+
+def test_restore_conflicts():
+    live, taken, after = asyncio.run(_conflicts())
+    assert live.status_code == 409, live.text
+    assert taken.status_code == 409, taken.text
+    assert after == ({"B": None}, set())
@@ -9,6 +9,20 @@ interface Course {
   parent_name: string | null;
 }
 
+interface NeighborhoodOptions {
+  depth?: number;
+  direction?: "up" | "down" | "both";
+  edges?: Array<"parent" | "prerequisite">;
+  maxNodes?: number;
+}
+
+interface Neighborhood {
+  center: string;
+  nodes: Array<{ id: string; name: string; parent_id: string | null; depth: number }>;
+  edges: Array<{ source: string; target: string; type: string }>;
+  truncated: boolean;
+}
+
 export const useCourseStore = defineStore("courses", () => {
   const courses = ref<Course[]>([]);
   const isLoading = ref(false);
@@ -39,6 +53,24 @@ export const useCourseStore = defineStore("courses", () => {
     }
   }
 
+  async function fetchNeighborhood(
+    courseId: string,
+    options: NeighborhoodOptions = {}
+  ): Promise<Neighborhood> {
+    const response = await axios.get(
+      `${API_URL}/courses/${courseId}/neighborhood`,
+      {
+        params: {
+          depth: options.depth ?? 1,
+          direction: options.direction ?? "both",
+          edges: options.edges?.join(","),
+          max_nodes: options.maxNodes,
+        },
+      }
+    );
+    return response.data;
+  }
+
   async function addCourse(name: string, parentId: string | null = null) {
     isLoading.value = true;
     error.value = null;
@@ -67,6 +99,7 @@ export const useCourseStore = defineStore("courses", () => {
     isLoading,
     error,
     fetchCourses,
+    fetchNeighborhood,
     addCourse,
   };
 });